@@ -0,0 +1,209 @@
+# Read Kawai K5000 files straight out of ZIP and tar archives
+#
+# A file inside an archive is named by the archive and the member, separated by "!",
+# like "Library.zip!Banks/BANK01.KAA". Members are read on demand, so nothing is
+# extracted to disk. ZIP members can be read in any order. Compressed tar archives
+# are one stream, so their members are cheapest to read in the order they are stored.
+
+import io
+import os
+import time
+import bisect
+import tarfile
+import zipfile
+import threading
+import contextlib
+import typing
+
+SEPARATOR = '!'
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+MAX_OPEN_ARCHIVES = 16  # per process
+READ_AHEAD_SIZE = 16 * 1024 * 1024  # bytes of compressed tar members kept after reading past them
+IGNORED_PREFIXES = ('__MACOSX/',)  # resource forks added by the macOS archiver
+
+def is_archive(filename: str) -> bool:
+    """Tell from the name if a file is a ZIP or tar archive."""
+    return filename.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+
+def split_path(path: str) -> tuple[str, typing.Optional[str]]:
+    """Split a path into the archive and the member name.
+    For a path that is not inside an archive the member is None."""
+    start = 0
+    while (index := path.find(SEPARATOR, start)) >= 0:
+        if is_archive(path[:index]) and os.path.isfile(path[:index]):
+            return path[:index], path[index + 1 :]
+        start = index + 1
+    return path, None
+
+def is_member(path: str) -> bool:
+    return split_path(path)[1] is not None
+
+def join_path(filename: str, member: str) -> str:
+    return f'{filename}{SEPARATOR}{member}'
+
+def get_basename(path: str) -> str:
+    """Get the name of a file or an archive member without the directory."""
+    filename, member = split_path(path)
+    return os.path.basename(filename) if member is None else member.rsplit('/', 1)[-1]
+
+class Archive:
+    """An open ZIP or tar archive.
+
+    The members of a tar archive are found by reading the headers only as far as needed,
+    and reading them is serialized, because they all come from the same stream.
+    Going back in a compressed stream means decompressing it again from the start,
+    so the members of a compressed tar archive are read whole, and the ones passed on
+    the way to another member are kept for a while, in case they are asked for next.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        try:
+            if filename.lower().endswith(ZIP_EXTENSIONS):
+                self.zip, self.tar = zipfile.ZipFile(filename), None
+                self.members = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+            else:
+                self.zip, self.tar = None, tarfile.open(filename, 'r:*')
+                self.members = {}
+                self.compressed = not filename.lower().endswith('.tar')
+                self.position = 0  # where the last member read ends
+                self.read_ahead = {}
+                self.read_ahead_size = 0
+                self.last = (None, None)  # the name and data of the last member read
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise OSError(0, f'Not a valid archive ({e})', filename) from e
+
+    def get_names(self) -> list[str]:
+        """Get the names of all the files in the archive (for a tar archive, this reads all the headers)."""
+        if self.tar is not None:
+            with self.lock:
+                self.members.update((info.name, info) for info in self.tar.getmembers() if info.isfile())
+        return [name for name in self.members if not name.startswith(IGNORED_PREFIXES)]
+
+    def get_info(self, name: str) -> typing.Any:
+        info = self.members.get(name)
+        if info is None and self.tar is not None:
+            with self.lock:
+                for tar_info in self.tar:  # goes on from the last header read
+                    if tar_info.isfile():
+                        self.members[tar_info.name] = tar_info
+                    if tar_info.name == name:
+                        break
+            info = self.members.get(name)
+        if info is None:
+            raise FileNotFoundError(2, 'No such file in the archive', join_path(self.filename, name))
+        return info
+
+    def stat(self, name: str) -> tuple[int, int]:
+        info = self.get_info(name)
+        if self.zip is not None:
+            return info.file_size, int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+        return info.size, int(info.mtime) * 1_000_000_000
+
+    @contextlib.contextmanager
+    def open(self, name: str) -> typing.Iterator[typing.BinaryIO]:
+        info = self.get_info(name)
+        if self.zip is not None:
+            # ZipFile reads the members through a shared file with its own lock
+            with self.zip.open(info) as f:
+                yield f
+        elif self.compressed:
+            with self.lock:
+                data = self.read_tar_member(info)
+            yield io.BytesIO(data)
+        else:
+            with self.lock, self.tar.extractfile(info) as f:
+                yield f
+
+    def read_tar_member(self, info: tarfile.TarInfo) -> bytes:
+        if self.last[0] == info.name:
+            return self.last[1]
+        data = self.read_ahead.pop(info.name, None)
+        if data is not None:
+            self.read_ahead_size -= len(data)
+            self.last = (info.name, data)
+            return data
+        start_offset = max(self.position, self.tar.fileobj.tell())
+        if start_offset <= info.offset_data <= start_offset + READ_AHEAD_SIZE:
+            # Keep the members between here and there that the stream has not gone past
+            # yet (looking for a header goes past them), with the oldest dropped first.
+            # Further away, the members in between are likely somebody else's.
+            members = self.tar.members
+            start = bisect.bisect_left(members, start_offset, key=lambda m: m.offset_data)
+            end = bisect.bisect_left(members, info.offset_data, key=lambda m: m.offset_data)
+            for other in members[start : end]:
+                if other.isfile() and other.size <= READ_AHEAD_SIZE:
+                    self.read_ahead[other.name] = self.tar.extractfile(other).read()
+                    self.read_ahead_size += other.size
+            while self.read_ahead_size > READ_AHEAD_SIZE:
+                self.read_ahead_size -= len(self.read_ahead.pop(next(iter(self.read_ahead))))
+        data = self.tar.extractfile(info).read()
+        self.position = info.offset_data + info.size
+        self.last = (info.name, data)
+        return data
+
+    def close(self) -> None:
+        (self.zip or self.tar).close()
+
+_open_archives = {}
+_open_archives_pid = None
+_open_archives_lock = threading.Lock()
+
+def get_archive(filename: str) -> Archive:
+    """Get an open archive for this process. The latest MAX_OPEN_ARCHIVES archives are kept open."""
+    global _open_archives, _open_archives_pid
+    key = os.path.abspath(filename)
+    with _open_archives_lock:
+        if _open_archives_pid != os.getpid():  # don't share open files with worker processes
+            _open_archives, _open_archives_pid = {}, os.getpid()
+        archive = _open_archives.pop(key, None)
+        if archive is None:
+            archive = Archive(filename)
+            if len(_open_archives) >= MAX_OPEN_ARCHIVES:
+                # Leave the oldest one to be closed when nobody is reading from it anymore
+                del _open_archives[next(iter(_open_archives))]
+        _open_archives[key] = archive  # the most recently used go last
+    return archive
+
+def list_members(filename: str, extensions: list[str]) -> list[str]:
+    """Get the paths of the members of an archive whose extension (without the dot,
+    case-insensitive) is in extensions. ZIP members are sorted by name, tar members
+    are in the order they are stored, so that they can be read in one pass."""
+    names = get_archive(filename).get_names()
+    if filename.lower().endswith(ZIP_EXTENSIONS):
+        names = sorted(names)
+    return [join_path(filename, name) for name in names if os.path.splitext(name)[1].lower()[1:] in extensions]
+
+@contextlib.contextmanager
+def open_file(path: str) -> typing.Iterator[typing.BinaryIO]:
+    """Open a file or an archive member for reading in binary mode."""
+    filename, member = split_path(path)
+    if member is None:
+        with open(filename, 'rb') as f:
+            yield f
+    else:
+        with get_archive(filename).open(member) as f:
+            yield f
+
+def read_data(path: str) -> bytes:
+    """Read all of a file or an archive member."""
+    with open_file(path) as f:
+        return f.read()
+
+def stat(path: str) -> tuple[int, int]:
+    """Get the size and the modification time (in nanoseconds) of a file or an archive member,
+    without reading it."""
+    filename, member = split_path(path)
+    if member is None:
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime_ns
+    return get_archive(filename).stat(member)
+
+def exists(path: str) -> bool:
+    try:
+        stat(path)
+    except OSError:
+        return False
+    return True
@@ -1,6 +1,14 @@
+import mmap
 import struct
 import typing
 
+import archive
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 MAX_PATCH_COUNT = 128
 MAX_SOURCE_COUNT = 6
 POOL_SIZE = 0x20000
@@ -10,6 +18,8 @@ NAME_LENGTH = 8
 SOURCE_COUNT_OFFSET = 51
 SOURCE_DATA_SIZE = 86
 ADD_KIT_SIZE = 806
+WAVE_KIT_OFFSET = 22  # wave kit MSB and LSB in the source data
+ADD_WAVE_NUMBER = 512  # wave kit number of an ADD source
 
 # key = file size, value = tuple of (PCM count, ADD count)
 # This is based on the table by Jens Groh.
@@ -44,6 +54,22 @@ SINGLE_INFO = {
 def check_single_size(length: int) -> bool:
     return length in SINGLE_INFO
 
+def get_add_sources(data: bytes, offset: int = 0) -> list[bool]:
+    """Tell which sources of the single patch starting at offset are ADD sources, from
+    the wave kit numbers (for when there are no pointers to tell the ADD sources)."""
+    source_count = data[offset + SOURCE_COUNT_OFFSET]
+    flags = []
+    for i in range(source_count):
+        wave_offset = offset + TONE_COMMON_DATA_SIZE + i * SOURCE_DATA_SIZE + WAVE_KIT_OFFSET
+        flags.append(((data[wave_offset] & 0x07) << 7) | data[wave_offset + 1] == ADD_WAVE_NUMBER)
+    return flags
+
+def get_single_size(data: bytes, offset: int = 0) -> int:
+    """Get the size of the single patch starting at offset."""
+    source_count = data[offset + SOURCE_COUNT_OFFSET]
+    add_kit_count = sum(get_add_sources(data, offset))
+    return TONE_COMMON_DATA_SIZE + SOURCE_DATA_SIZE * source_count + ADD_KIT_SIZE * add_kit_count
+
 def get_single_name(number: int) -> str:
     if number in range(0, 128):
         return f'G{number + 1:03}'
@@ -59,28 +85,43 @@ def get_single_name(number: int) -> str:
         return f'F{number - 640 + 1:03}'
     return ''
 
+_POINTER_TABLE_STRUCT = struct.Struct(f'>{MAX_PATCH_COUNT * 7}I')
+
+def get_pointer_words(data: bytes) -> typing.Any:
+    """Decode the whole pointer table in one go, as 128 rows of seven pointers.
+
+    Returns a (128, 7) NumPy array if NumPy is installed, otherwise a list of tuples.
+    """
+    if np is not None:
+        words = np.frombuffer(data, dtype='>u4', count=MAX_PATCH_COUNT * 7)
+        return words.reshape(MAX_PATCH_COUNT, 7).astype(np.int64)
+    words = _POINTER_TABLE_STRUCT.unpack_from(data, 0)
+    return [words[i : i + 7] for i in range(0, len(words), 7)]
+
 def get_pointer_table(data: bytes) -> list[dict[str, typing.Any]]:
-    offset = 0
+    rows = get_pointer_words(data)
     pointer_table = []
     for p in range(MAX_PATCH_COUNT):
-        spec = '>7I'
-        entry = struct.unpack_from(spec, data, offset)
-        offset += struct.calcsize(spec)
-
-        tone_ptr = entry[0]
-        source_ptrs = entry[1:]
-        is_used = True if tone_ptr != 0 else False
-        if is_used:
-            pointer_table.append({'index': p, 'is_used': is_used, 'tone': tone_ptr, 'sources': source_ptrs})
+        tone_ptr = int(rows[p][0])
+        if tone_ptr != 0:
+            source_ptrs = tuple(int(ptr) for ptr in rows[p][1:])
+            pointer_table.append({'index': p, 'is_used': True, 'tone': tone_ptr, 'sources': source_ptrs})
     return pointer_table
 
+POINTER_TABLE_SIZE = MAX_PATCH_COUNT * 7 * 4  # 128 patch locations with seven pointers of four bytes each
+BANK_SIZE = POINTER_TABLE_SIZE + 4 + POOL_SIZE  # pointer table, high pointer and pool
+
+# All the pointers in a bank are relative to the base address, so any non-zero
+# value will do for a new bank.
+DEFAULT_BASE_ADDRESS = 0x00010000
+
 def get_high_pointer(data: bytes) -> int:
-    offset = MAX_PATCH_COUNT * 7 * 4  # 128 patch locations with seven pointers of four bytes each
+    offset = POINTER_TABLE_SIZE
     entry = struct.unpack_from('>I', data, offset)
     return int(entry[0])
 
 def get_patch_data(data: bytes) -> bytes:
-    offset = MAX_PATCH_COUNT * 7 * 4 + 4
+    offset = POINTER_TABLE_SIZE + 4
     return data[offset : offset + POOL_SIZE]
 
 def print_pointer_table(pt: dict[str, typing.Any]) -> None:
@@ -94,48 +135,224 @@ def print_pointer_table(pt: dict[str, typing.Any]) -> None:
             print(hex(src))
         print()
 
-def get_bank(data: bytes) -> dict[str, typing.Any]:
-    pointer_table = get_pointer_table(data)
-    sorted_pointer_table = sorted(pointer_table, key=lambda x: x['tone'])
-    print(f"Pointer table has {len(sorted_pointer_table)} pointers")
-    #print_pointer_table(sorted_pointer_table)
+class SinglePatch:
+    """One single patch in a bank, with pointers relative to the bank base.
+
+    The name is decoded from the patch data only when it is first needed.
+    Item access with the old dictionary keys (like patch['name']) is supported.
+    """
+
+    __slots__ = ('index', 'tone', 'sources', 'source_count', 'size', 'next_tone', 'data', '_name')
+
+    KEYS = ('name', 'index', 'source_count', 'size', 'padding', 'tone', 'sources', 'data')
+
+    def __init__(self, index: int, tone: int, sources: tuple[int, ...], source_count: int,
+                 size: int, next_tone: int, data: bytes, name: str = None):
+        self.index = index
+        self.tone = tone
+        self.sources = sources
+        self.source_count = source_count
+        self.size = size
+        self.next_tone = next_tone  # start of the next patch, or the high pointer
+        self.data = data  # None if the patch came from the parse cache
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        if self._name is None:
+            # Decode the name as UTF-8, which should be equivalent to the original (probably ASCII;
+            # but not specified), except strip out any trailing 0x7f characters which seem to occur
+            # from time to time in the patches, they are trouble.
+            name_data = bytes(self.data[NAME_OFFSET : NAME_OFFSET + NAME_LENGTH])
+            self._name = name_data.decode('UTF-8').rstrip('\x7f')
+        return self._name
+
+    @property
+    def padding(self) -> int:
+        return self.next_tone - self.tone - self.size
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key not in SinglePatch.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return f'SinglePatch(index={self.index}, name={self.name!r}, size={self.size}, tone=0x{self.tone:06X})'
+
+class Bank:
+    """The patches of a .KAA bank, sorted by their location in the pool.
+
+    Supports bank['patches'] and bank['base'] like the old dictionary.
+    """
+
+    __slots__ = ('patches', 'base', 'high')
+
+    KEYS = ('patches', 'base')
 
+    def __init__(self, patches: list[SinglePatch], base: int, high: int):
+        self.patches = patches
+        self.base = base
+        self.high = high  # relative to base
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key not in Bank.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __len__(self) -> int:
+        return len(self.patches)
+
+def get_bank_layout(data: bytes) -> dict[str, typing.Any]:
+    """Get the structure of a bank without decoding any patch names.
+
+    The values for 'index', 'tone', 'sources', 'source_count', 'size', 'padding'
+    and 'next' have one item per used patch (none for an empty bank), in pool order, with pointers relative
+    to 'base' (like 'high'). They are NumPy arrays if NumPy is installed, otherwise lists.
+    """
+    rows = get_pointer_words(data)
     high_ptr = get_high_pointer(data)
-    print('high: {}'.format(hex(high_ptr)))
+    patch_data = get_patch_data(data)
 
-    base_ptr = sorted_pointer_table[0]['tone']
-    print('base: {}'.format(hex(base_ptr)))
+    if np is not None:
+        used = np.flatnonzero(rows[:, 0])
+        order = used[np.argsort(rows[used, 0], kind='stable')]
+        if len(order) > 0:
+            base_ptr = int(rows[order[0], 0])
+        else:
+            # No patch to take the base from, but the high pointer of an empty pool is the base (if it is set)
+            base_ptr = high_ptr = high_ptr or DEFAULT_BASE_ADDRESS
+        tones = rows[order, 0] - base_ptr
+        source_ptrs = rows[order, 1:]
+        sources = np.where(source_ptrs != 0, source_ptrs - base_ptr, 0)
+        pool = np.frombuffer(patch_data, dtype=np.uint8)
+        source_counts = pool[tones + SOURCE_COUNT_OFFSET].astype(np.int64)
+        del pool  # don't hold on to the buffer, it could be a memory-mapped file
+        add_kit_counts = np.count_nonzero(sources, axis=1)
+        sizes = TONE_COMMON_DATA_SIZE + SOURCE_DATA_SIZE * source_counts + ADD_KIT_SIZE * add_kit_counts
+        next_ptrs = np.append(tones[1:], high_ptr - base_ptr)[:len(tones)]
+        padding = next_ptrs - tones - sizes
+    else:
+        order = sorted((ix for ix in range(MAX_PATCH_COUNT) if rows[ix][0] != 0), key=lambda ix: rows[ix][0])
+        if order:
+            base_ptr = rows[order[0]][0]
+        else:
+            base_ptr = high_ptr = high_ptr or DEFAULT_BASE_ADDRESS
+        tones = [rows[ix][0] - base_ptr for ix in order]
+        sources = [tuple(ptr - base_ptr if ptr != 0 else ptr for ptr in rows[ix][1:]) for ix in order]
+        source_counts = [patch_data[tone + SOURCE_COUNT_OFFSET] for tone in tones]
+        sizes = [TONE_COMMON_DATA_SIZE + SOURCE_DATA_SIZE * sc + ADD_KIT_SIZE * sum(ptr != 0 for ptr in src)
+            for sc, src in zip(source_counts, sources)]
+        next_ptrs = (tones[1:] + [high_ptr - base_ptr])[:len(tones)]
+        padding = [n - t - s for n, t, s in zip(next_ptrs, tones, sizes)]
+
+    return {'index': order, 'tone': tones, 'sources': sources, 'source_count': source_counts,
+        'size': sizes, 'padding': padding, 'next': next_ptrs, 'base': base_ptr, 'high': high_ptr - base_ptr}
 
-    for entry in sorted_pointer_table:
-        entry['tone'] -= base_ptr
-        entry['sources'] = [ptr - base_ptr if ptr != 0 else ptr for ptr in entry['sources']]
-    high_ptr -= base_ptr
+def get_bank(data: bytes, verbose: bool = True) -> Bank:
+    layout = get_bank_layout(data)
+    if np is not None:
+        layout = {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in layout.items()}
+
+    if verbose:
+        print(f"Pointer table has {len(layout['index'])} pointers")
+        print('high: {}'.format(hex(layout['high'] + layout['base'])))
+        print('base: {}'.format(hex(layout['base'])))
 
     patch_data = get_patch_data(data)
 
     patches = []
+    for ix, tone_ptr in enumerate(layout['tone']):
+        size = layout['size'][ix]
+        patches.append(SinglePatch(layout['index'][ix], tone_ptr, tuple(layout['sources'][ix]),
+            layout['source_count'][ix], size, layout['next'][ix], patch_data[tone_ptr : tone_ptr + size]))
 
-    for ix, p in enumerate(sorted_pointer_table):
-        tone_ptr = p['tone']
-        source_count = patch_data[tone_ptr + SOURCE_COUNT_OFFSET]
-        add_kit_count = sum(x != 0 for x in p['sources'])
-        size = TONE_COMMON_DATA_SIZE + SOURCE_DATA_SIZE * source_count + ADD_KIT_SIZE * add_kit_count
-        next_ptr = high_ptr
-        if ix < len(sorted_pointer_table) - 1:
-            next_ptr = sorted_pointer_table[ix + 1]['tone']
-        else:
-            next_ptr = high_ptr
-        padding = next_ptr - tone_ptr - size
+    return Bank(patches, layout['base'], layout['high'])
+
+def make_single_patch(index: int, data: bytes) -> SinglePatch:
+    """Make a patch for bank slot index (0...127) from the data of a single, like a .KA1 file.
+
+    The ADD kits are assumed to follow the sources in the same order as the ADD sources.
+    """
+    add_sources = get_add_sources(data)
+    sources = [0] * MAX_SOURCE_COUNT
+    kit_ptr = TONE_COMMON_DATA_SIZE + SOURCE_DATA_SIZE * len(add_sources)
+    for i, is_add in enumerate(add_sources):
+        if is_add:
+            sources[i] = kit_ptr
+            kit_ptr += ADD_KIT_SIZE
+    return SinglePatch(index, 0, tuple(sources), len(add_sources), kit_ptr, kit_ptr, data)
+
+def write_bank(patches: list[SinglePatch], base: int = DEFAULT_BASE_ADDRESS) -> bytes:
+    """Build the data of a .KAA bank from patches, in the order given.
+
+    The patches are packed into the pool without any padding. Their source pointers
+    are kept at the same offsets from the start of the patch as they were.
+    """
+    if len(patches) > MAX_PATCH_COUNT:
+        raise ValueError(f'Too many patches for one bank ({len(patches)}, maximum is {MAX_PATCH_COUNT})')
+    if base == 0:
+        raise ValueError('Base address must not be zero')
+
+    data = bytearray(BANK_SIZE)
+    pool_offset = POINTER_TABLE_SIZE + 4
+    used = set()
+    tone_ptr = 0
+    for patch in patches:
+        if patch.index not in range(MAX_PATCH_COUNT) or patch.index in used:
+            raise ValueError(f'Invalid or duplicate patch index {patch.index}')
+        used.add(patch.index)
+        if len(patch.data) != patch.size:
+            raise ValueError(f'Patch {patch.index + 1} has {len(patch.data)} bytes of data, expected {patch.size}')
+        if tone_ptr + patch.size > POOL_SIZE:
+            raise ValueError(f'Patches do not fit in the pool of {POOL_SIZE} bytes')
+
+        sources = [tone_ptr + base + ptr - patch.tone if ptr != 0 else 0 for ptr in patch.sources]
+        struct.pack_into('>7I', data, patch.index * 7 * 4, tone_ptr + base, *sources)
+        data[pool_offset + tone_ptr : pool_offset + tone_ptr + patch.size] = patch.data
+        tone_ptr += patch.size
+
+    struct.pack_into('>I', data, POINTER_TABLE_SIZE, tone_ptr + base)
+    return bytes(data)
+
+class BankFile:
+    """A .KAA bank file mapped into memory.
+
+    The patch data handed out by get_bank() are memoryviews into the mapping,
+    so nothing is copied, but they are only valid until the file is closed.
+    A bank inside an archive can't be mapped, so it is read into memory instead.
+    If the file can't be opened, OSError is raised for the caller to report.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._views = []
+        self._mmap = None
+        if archive.is_member(filename):
+            self.data = memoryview(archive.read_data(filename))
+            return
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
 
-        name_offset = tone_ptr + NAME_OFFSET
+    def get_bank(self, verbose: bool = True) -> Bank:
+        bank_data = get_bank(self.data, verbose)
+        self._views.extend(patch.data for patch in bank_data.patches)
+        return bank_data
 
-        # Decode the name as UTF-8, which should be equivalent to the original (probably ASCII;
-        # but not specified), except strip out any trailing 0x7f characters which seem to occur
-        # from time to time in the patches, they are trouble.
-        name = patch_data[name_offset : name_offset + NAME_LENGTH].decode('UTF-8').rstrip('\x7f')
+    def close(self) -> None:
+        if self.data is None:
+            return
+        # Release the views first, otherwise the mapping can't be closed
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self.data.release()
+        self.data = None
+        if self._mmap is not None:
+            self._mmap.close()
 
-        patches.append({'name': name, 'index': p['index'], 'source_count': source_count,
-            'size': size, 'padding': padding, 'tone': tone_ptr, 'sources': p['sources'],
-            'data': patch_data[tone_ptr : tone_ptr + size]})
+    def __enter__(self):
+        return self
 
-    return {'patches': patches, 'base': base_ptr}
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
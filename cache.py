@@ -0,0 +1,203 @@
+# Persistent cache of parsed Kawai K5000 bank structures
+#
+# The cache is an SQLite database keyed by the file path, size, modification time
+# and content hash. It is only used when the K5KTOOLS_CACHE environment variable
+# is set, to "on" for the default database file or to the name of another file.
+
+import os
+import json
+import typing
+import contextlib
+import time
+import hashlib
+import sqlite3
+import multiprocessing.util
+
+import archive
+import bank
+import multi
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # bytes of cached structure data
+COMMIT_INTERVAL = 500  # changes kept in memory before writing them all at once
+
+def get_cache_dir() -> str:
+    """Get the directory for the cache files of k5ktools."""
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'k5ktools')
+
+def get_default_path() -> str:
+    """Get the parse cache database file, or None if the cache is not in use."""
+    path = os.environ.get('K5KTOOLS_CACHE', 'off')
+    if path.lower() == 'off':
+        return None
+    if path.lower() == 'on':
+        path = os.path.join(get_cache_dir(), 'parse.sqlite')
+    return path
+
+def parse_bank(data: bytes) -> dict:
+    bank_data = bank.get_bank(data, verbose=False)
+    return {'base': bank_data.base, 'high': bank_data.high,
+        'patches': [[p.index, p.tone, list(p.sources), p.source_count, p.size, p.next_tone, p.name]
+            for p in bank_data.patches]}
+
+def parse_multis(data: bytes) -> dict:
+    multis = multi.MultiBank(data)
+    return {'multis': [{'name': name, 'sections': sections}
+        for name, sections in zip(multis.names, multis.get_section_refs())]}
+
+PARSERS = {'kaa': parse_bank, 'kca': parse_multis, 'kc1': parse_multis}
+
+class ParseCache:
+    """Parsed file structures stored in an SQLite database, with LRU eviction.
+
+    New entries and the times of the hits are kept in memory and written in one
+    transaction every COMMIT_INTERVAL changes, and when the cache is closed.
+    """
+
+    def __init__(self, filename: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+                hash BLOB, kind TEXT, structure TEXT, last_used REAL);
+            CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+        ''')
+        self.total = self.db.execute('SELECT COALESCE(SUM(LENGTH(structure)), 0) FROM entries').fetchone()[0]
+        self.pending = {}  # path: new entry
+        self.pending_used = {}  # path: time of the last hit
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename: str, kind: str) -> dict:
+        """Get the parsed structure of a file of the given kind ('kaa', 'kca' or 'kc1')."""
+        path = os.path.abspath(filename)
+        size, mtime = archive.stat(path)
+        now = time.time()
+
+        entry = self.pending.get(path)
+        if entry is not None:
+            if entry[1:3] == (size, mtime) and entry[4] == kind:
+                self.hits += 1
+                return json.loads(entry[5])
+            old_size = len(entry[5])
+        else:
+            row = self.db.execute('SELECT size, mtime, kind, structure FROM entries WHERE path = ?', (path,)).fetchone()
+            if row is not None and row[:3] == (size, mtime, kind):
+                self.hits += 1
+                self.pending_used[path] = now
+                self.check_pending()
+                return json.loads(row[3])
+            old_size = len(row[3]) if row is not None else 0  # the entry of this path will be replaced
+
+        # The file is new or it has changed, but maybe only the modification time did,
+        # or the same content has been cached under another path.
+        data = archive.read_data(path)
+        content_hash = hashlib.blake2b(data, digest_size=16).digest()
+        row = self.db.execute('SELECT structure FROM entries WHERE hash = ? AND kind = ?',
+            (content_hash, kind)).fetchone()
+        if row is not None:
+            self.hits += 1
+            structure_json = row[0]
+        else:
+            self.misses += 1
+            structure_json = json.dumps(PARSERS[kind](data), separators=(',', ':'))
+
+        self.pending[path] = (path, size, mtime, content_hash, kind, structure_json, now)
+        self.total += len(structure_json) - old_size
+        self.check_pending()
+        return json.loads(structure_json)
+
+    def check_pending(self) -> None:
+        if len(self.pending) + len(self.pending_used) >= COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the new entries and the times of the hits, and evict entries if needed."""
+        if not self.pending and not self.pending_used:
+            return
+        self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', self.pending.values())
+        self.db.executemany('UPDATE entries SET last_used = ? WHERE path = ?',
+            ((used, path) for path, used in self.pending_used.items()))
+        if self.total > self.max_size:
+            self.evict()
+        self.db.commit()
+        self.pending.clear()
+        self.pending_used.clear()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in max_size,
+        with a tenth of it to spare, so that this is not needed again right away."""
+        # Other processes may have added entries too
+        self.total = self.db.execute('SELECT COALESCE(SUM(LENGTH(structure)), 0) FROM entries').fetchone()[0]
+        if self.total <= self.max_size:
+            return
+        rows = self.db.execute('SELECT path, LENGTH(structure) FROM entries ORDER BY last_used').fetchall()
+        for path, size in rows:
+            if self.total <= self.max_size * 9 // 10:
+                break
+            self.db.execute('DELETE FROM entries WHERE path = ?', (path,))
+            self.total -= size
+
+    def close(self) -> None:
+        if self.db is None:
+            return
+        self.flush()
+        self.db.close()
+        self.db = None
+
+_default_cache = None
+_default_cache_pid = None
+
+def get_default_cache() -> ParseCache:
+    """Get the cache for this process, or None if it is disabled."""
+    global _default_cache, _default_cache_pid
+    path = get_default_path()
+    if path is None:
+        return None
+    if _default_cache is None or _default_cache_pid != os.getpid():  # don't share connections with worker processes
+        _default_cache = ParseCache(path)
+        _default_cache_pid = os.getpid()
+        # Write what is pending when the process exits, also in worker processes
+        multiprocessing.util.Finalize(_default_cache, _default_cache.close, exitpriority=10)
+    return _default_cache
+
+def get_structure(filename: str, kind: str) -> dict:
+    parse_cache = get_default_cache()
+    if parse_cache is None:
+        return PARSERS[kind](archive.read_data(filename))
+    return parse_cache.get(filename, kind)
+
+def get_bank(filename: str, verbose: bool = False) -> bank.Bank:
+    """Get the structure of a .KAA bank from the cache, without the patch data."""
+    structure = get_structure(filename, 'kaa')
+    base, high = structure['base'], structure['high']
+    patches = [bank.SinglePatch(index, tone, tuple(sources), source_count, size, next_tone, None, name)
+        for index, tone, sources, source_count, size, next_tone, name in structure['patches']]
+    if verbose:
+        print(f"Pointer table has {len(patches)} pointers")
+        print('high: {}'.format(hex(high + base)))
+        print('base: {}'.format(hex(base)))
+    return bank.Bank(patches, base, high)
+
+@contextlib.contextmanager
+def open_bank(filename: str, verbose: bool = False) -> typing.Iterator[bank.Bank]:
+    """Get a .KAA bank from the cache if it is in use, otherwise from the file mapped into memory.
+
+    The patch data is only valid inside the with block, and it is None if the bank came from the cache.
+    """
+    if get_default_cache() is None:
+        with bank.BankFile(filename) as bank_file:
+            yield bank_file.get_bank(verbose)
+    else:
+        yield get_bank(filename, verbose)
+
+def get_multis(filename: str) -> list[dict]:
+    """Get the names and section references of the multis in a .KCA or .KC1 file."""
+    kind = os.path.splitext(filename)[1].lower()[1:]
+    structure = get_structure(filename, 'kc1' if kind == 'kc1' else 'kca')
+    return [{'name': m['name'], 'sections': [tuple(s) for s in m['sections']]} for m in structure['multis']]
@@ -0,0 +1,171 @@
+# Verify and repair the checksums of Kawai K5000 patches
+#
+# The multi checksum covers everything after the checksum byte. The single checksum
+# (the first byte of the tone common data) covers the rest of the tone common data
+# and the source data, and each ADD kit has a checksum of its own as its first byte.
+# All of them are (sum of the bytes + 0xA5) & 0x7F.
+
+import os
+import io
+import argparse
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import archive
+import bank
+import helpers
+import multi
+import sysex
+
+EXTENSIONS = ['kaa', 'ka1', 'kca', 'kc1', 'syx']
+CHECKSUM_BASE = 0xA5
+
+def get_segment_checksums(data: bytes, segments: list[tuple[int, int]]) -> list[int]:
+    """Compute the checksums of the data in each (start, end) segment at once,
+    from the running sum of the bytes if NumPy is available."""
+    if not segments:
+        return []
+    if np is not None:
+        running = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(data, dtype=np.uint8), out=running[1:])
+        starts, ends = np.array(segments, dtype=np.int64).T
+        return ((running[ends] - running[starts] + CHECKSUM_BASE) & 0x7F).tolist()
+    view = memoryview(data)
+    return [(sum(view[start:end]) + CHECKSUM_BASE) & 0x7F for start, end in segments]
+
+def get_multi_checksums(data: bytes, offset: int = 0, count: int = multi.MULTI_COUNT) -> list[int]:
+    """Compute the checksums of count multis stored one after another, starting at offset."""
+    if np is not None:
+        rows = np.frombuffer(data, dtype=np.uint8, count=count * multi.MULTI_DATA_SIZE, offset=offset)
+        rows = rows.reshape(count, multi.MULTI_DATA_SIZE)
+        return ((rows[:, 1:].sum(axis=1, dtype=np.int64) + CHECKSUM_BASE) & 0x7F).tolist()
+    view = memoryview(data)
+    return [multi.get_checksum(view[start + 1 : start + multi.MULTI_DATA_SIZE])
+        for start in range(offset, offset + count * multi.MULTI_DATA_SIZE, multi.MULTI_DATA_SIZE)]
+
+def get_single_segments(offset: int, source_count: int, kit_offsets: list[int]) -> list[tuple[int, int]]:
+    """Get the checksum segments of a single patch: the tone common and source data
+    first, then each ADD kit. Each segment starts right after its checksum byte."""
+    segments = [(offset + 1, offset + bank.TONE_COMMON_DATA_SIZE + bank.SOURCE_DATA_SIZE * source_count)]
+    segments.extend((kit + 1, kit + bank.ADD_KIT_SIZE) for kit in kit_offsets)
+    return segments
+
+def get_single_data_segments(data: bytes, offset: int, label: str) -> list[tuple[str, int, int]]:
+    """Get the (label, start, end) checksum segments of the single patch at offset,
+    with the ADD kits following the sources."""
+    source_count = data[offset + bank.SOURCE_COUNT_OFFSET]
+    kit_start = offset + bank.TONE_COMMON_DATA_SIZE + bank.SOURCE_DATA_SIZE * source_count
+    kit_count = sum(bank.get_add_sources(data, offset))
+    kits = [kit_start + i * bank.ADD_KIT_SIZE for i in range(kit_count)]
+    return label_segments(label, get_single_segments(offset, source_count, kits))
+
+def label_segments(label: str, segments: list[tuple[int, int]]) -> list[tuple[str, int, int]]:
+    labeled = [(label, *segments[0])]
+    labeled.extend((f'{label} ADD kit {n}', start, end) for n, (start, end) in enumerate(segments[1:], start=1))
+    return labeled
+
+def check_segments(data: bytes, segments: list[tuple[str, int, int]]) -> list[tuple[str, int, int, int]]:
+    checksums = get_segment_checksums(data, [(start, end) for _, start, end in segments])
+    return [(label, start - 1, data[start - 1], computed) for (label, start, end), computed in zip(segments, checksums)]
+
+def check_data(data: bytes, kind: str) -> list[tuple[str, int, int, int]]:
+    """Check all the checksums in the data of a file of the given kind (file extension).
+
+    Returns (label, offset of checksum byte, stored checksum, computed checksum) for each checksum.
+    """
+    if kind == 'kca' or kind == 'kc1':
+        count = len(data) // multi.MULTI_DATA_SIZE
+        computed = get_multi_checksums(data, 0, count)
+        return [(f'M{n + 1:02}', n * multi.MULTI_DATA_SIZE, data[n * multi.MULTI_DATA_SIZE], c) for n, c in enumerate(computed)]
+    elif kind == 'ka1':
+        return check_segments(data, get_single_data_segments(data, 0, 'Single'))
+    elif kind == 'kaa':
+        bank_data = bank.get_bank(data, verbose=False)
+        pool_offset = bank.POINTER_TABLE_SIZE + 4
+        segments = []
+        for patch in sorted(bank_data.patches, key=lambda p: p.index):
+            tone = pool_offset + patch.tone
+            kits = [pool_offset + ptr for ptr in patch.sources if ptr != 0]
+            segments.extend(label_segments(f'{patch.index + 1:03}', get_single_segments(tone, patch.source_count, kits)))
+        return check_segments(data, segments)
+    elif kind == 'syx':
+        # A .syx file can have any number of messages, so check each of them on its own
+        results = []
+        segments = []
+        for start, message in sysex.split_messages(io.BytesIO(data)):
+            multis = sysex.get_multi_offsets(message)
+            if multis:
+                computed = get_multi_checksums(data, start + multis[0][1], len(multis))
+                results.extend((number, start + offset, data[start + offset], c) for (number, offset), c in zip(multis, computed))
+            for slot, offset, size in sysex.get_single_offsets(message):
+                segments.extend(get_single_data_segments(data, start + offset, slot))
+        return results + check_segments(data, segments)
+    return []
+
+def check_file(filename: str) -> list[tuple[str, int, int, int]]:
+    kind = os.path.splitext(filename)[1].lower()[1:]
+    return check_data(helpers.read_file_data(filename), kind)
+
+def get_mismatches(results: list[tuple[str, int, int, int]]) -> list[tuple[str, int, int, int]]:
+    return [r for r in results if r[2] != r[3]]
+
+def repair(data: bytes, mismatches: list[tuple[str, int, int, int]]) -> bytes:
+    repaired = bytearray(data)
+    for label, offset, stored, computed in mismatches:
+        repaired[offset] = computed
+    return bytes(repaired)
+
+def report_mismatches(mismatches: list[tuple[str, int, int, int]]) -> list[str]:
+    return [f'Checksum mismatch in {label}: original={stored:02X}h, computed={computed:02X}h'
+        for label, offset, stored, computed in mismatches]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verify the checksums in Kawai K5000 native and System Exclusive files')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Files, directories or glob patterns')
+    parser.add_argument('-r', dest='repair_dir', action='store', help='Write repaired copies of the files into this directory, mirroring the input tree')
+    parser.add_argument('-q', dest='quiet', action='store_true', help='Only list the files with mismatches')
+    args = parser.parse_args()
+
+    file_count = 0
+    bad_count = 0
+    checksum_count = 0
+    for arg in args.filenames:
+        root = helpers.get_root(arg)
+        for filename in helpers.expand_paths([arg], EXTENSIONS):
+            file_count += 1
+            try:
+                data = archive.read_data(filename)
+                results = check_data(data, os.path.splitext(filename)[1].lower()[1:])
+            except OSError as e:
+                print(f'Unable to read "{filename}": {e.strerror or e}')
+                continue
+            except (ValueError, IndexError, UnicodeDecodeError, struct.error) as e:
+                print(f'Unable to check "{filename}": {e}')
+                continue
+            checksum_count += len(results)
+            mismatches = get_mismatches(results)
+            if not mismatches:
+                if not args.quiet:
+                    print(f'"{filename}": {len(results)} checksums match')
+                continue
+
+            bad_count += 1
+            print(f'"{filename}": {len(mismatches)} of {len(results)} checksums do not match')
+            for line in report_mismatches(mismatches):
+                print(f'    {line}')
+            if args.repair_dir is not None:
+                # Mirror the input tree, so that files with the same name don't overwrite each other
+                out_dir = helpers.get_out_dir(filename, root, args.repair_dir)
+                out_filename = os.path.join(out_dir, archive.get_basename(filename))
+                print(f'    Writing repaired file "{out_filename}"')
+                try:
+                    os.makedirs(out_dir, exist_ok=True)
+                    helpers.write_file_atomic(out_filename, [repair(data, mismatches)])
+                except OSError as e:
+                    print(f'    Unable to write "{out_filename}": {e.strerror or e}')
+
+    print(f'Checked {checksum_count} checksums in {file_count} files, {bad_count} files have mismatches')
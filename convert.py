@@ -0,0 +1,258 @@
+# Convert many Kawai K5000 files at once
+#
+# Native files (.KAA, .KA1, .KCA, .KC1) are converted to System Exclusive format,
+# and System Exclusive files back to native files. The output goes into a directory
+# tree that mirrors the input directories. Files in ZIP and tar archives are read
+# without extracting them, and go into a directory named like the archive.
+
+import io
+import sys
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import argparse
+import functools
+import struct
+
+import archive
+import bank
+import helpers
+import multi
+import sysex
+import ka1tosyx
+import kaatosyx
+import kc1tosyx
+import kcatosyx
+import syxtonative
+
+EXTENSIONS = ['kaa', 'ka1', 'kca', 'kc1', 'syx']
+MANIFEST_NAME = '.k5kmanifest.sqlite'  # kept in the output directory by default
+HASH_BLOCK_SIZE = 1 << 20
+
+class Manifest:
+    """The files converted so far, with their size, modification time, content hash,
+    the converter options and the output files, stored in an SQLite database."""
+
+    def __init__(self, filename: str):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+            hash TEXT, options TEXT, outputs TEXT)''')
+
+    def get_entries(self) -> dict[str, tuple[int, int, str, str, list[str]]]:
+        rows = self.db.execute('SELECT path, size, mtime, hash, options, outputs FROM entries')
+        return {path: (size, mtime, content_hash, options, json.loads(outputs))
+            for path, size, mtime, content_hash, options, outputs in rows}
+
+    def put(self, path: str, size: int, mtime: int, content_hash: str, options: str, outputs: list[str]) -> None:
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+            (path, size, mtime, content_hash, options, json.dumps(outputs)))
+
+    def remove(self, path: str) -> None:
+        self.db.execute('DELETE FROM entries WHERE path = ?', (path,))
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+def get_file_hash(filename: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with archive.open_file(filename) as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+def convert_native(data: bytes, extension: str, options: dict) -> list[bytes]:
+    """Convert the data of a native file into a System Exclusive message.
+    Returns the pieces of the message, to be written one after another."""
+    if extension == 'kaa':
+        bank_data = bank.get_bank(memoryview(data), verbose=False)
+        parts = kaatosyx.get_message_parts(bank_data.patches, options['channel'], options['bank_id'])
+    elif extension == 'ka1':
+        if not bank.check_single_size(len(data)):
+            raise ValueError(f'File size does not appear to be valid (was {len(data)} bytes)')
+        parts = ka1tosyx.get_message_parts(data, options['channel'], options['bank_id'], options['number'])
+    elif extension == 'kc1':
+        if options['number'] > multi.MULTI_COUNT:
+            raise ValueError(f'Multi number must be between 1 and {multi.MULTI_COUNT} (was {options["number"]})')
+        if not multi.check_size(len(data)):
+            raise ValueError(f'File size does not appear to be valid (was {len(data)} bytes)')
+        parts = kc1tosyx.get_message_parts(data, options['channel'], options['number'])
+    else:
+        if len(data) != multi.MULTI_COUNT * multi.MULTI_DATA_SIZE:
+            raise ValueError(f'File size does not appear to be valid (was {len(data)} bytes)')
+        parts = kcatosyx.get_message_parts(data, options['channel'])
+    return parts
+
+def get_outputs(filename: str, options: dict, data: bytes = None) -> list[tuple[str, list[bytes]]]:
+    """Convert a file into the names and pieces of the output files. The file is read
+    (a System Exclusive file one chunk at a time) unless its data is given."""
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    if extension == 'syx':
+        messages = sysex.read_messages(filename) if data is None else sysex.split_messages(io.BytesIO(data))
+        outputs, skipped = syxtonative.decode_messages(messages, filename)
+        if not outputs:
+            raise ValueError(skipped[0] if skipped else 'No K5000 patches in the file')
+        names = syxtonative.get_out_names(filename, outputs)
+        return [(name, [output]) for name, (_, output) in zip(names, outputs)]
+
+    if data is None:
+        data = archive.read_data(filename)
+    # Keep the extension, so that the outputs of BANK.KAA and BANK.KCA are not both BANK.syx
+    name = f'{archive.get_basename(filename)}.syx'
+    return [(name, convert_native(data, extension, options))]
+
+def convert_file(job: tuple[str, str, str], options: dict, incremental: bool = False) -> dict:
+    """Convert one file into out_dir, writing the output files atomically.
+
+    The job is the filename, the output directory and the content hash of the file when it was
+    last converted (or None). If the hash has not changed, nothing is converted and the result
+    has 'unchanged' set. Returns the filename, the output filenames, the input and output sizes,
+    the modification time and (if incremental is True) the hash of the file, and any error.
+    """
+    filename, out_dir, known_hash = job
+    result = {'filename': filename, 'outputs': [], 'size': 0, 'written': 0}
+    try:
+        result['size'], result['mtime'] = archive.stat(filename)
+        if known_hash is not None:
+            result['hash'] = get_file_hash(filename)
+            if result['hash'] == known_hash:
+                result['unchanged'] = True
+                return result
+
+        outputs = get_outputs(filename, options)
+        os.makedirs(out_dir, exist_ok=True)
+        for name, parts in outputs:
+            out_filename = os.path.join(out_dir, name)
+            helpers.write_file_atomic(out_filename, parts)
+            result['outputs'].append(out_filename)
+            result['written'] += sum(len(part) for part in parts)
+        if incremental and 'hash' not in result:
+            result['hash'] = get_file_hash(filename)
+    except OSError as e:
+        result['error'] = e.strerror or str(e)
+    except (ValueError, IndexError, UnicodeDecodeError, struct.error) as e:
+        result['error'] = str(e)
+    return result
+
+def get_jobs(args: list[str], out_dir: str) -> list[tuple[str, str, str]]:
+    """Expand the arguments into (filename, output directory, known hash) jobs, mirroring the input tree."""
+    jobs = []
+    for arg in args:
+        root = helpers.get_root(arg)
+        for filename in helpers.expand_paths([arg], EXTENSIONS, archives=True):
+            jobs.append((filename, helpers.get_out_dir(filename, root, out_dir), None))
+    return jobs
+
+def get_stale_jobs(jobs: list[tuple[str, str, str]], entries: dict, options_key: str) -> list[tuple[str, str, str]]:
+    """Leave out the files that have not changed since they were converted with the same options,
+    judging by their size and modification time. If only those have changed, the job gets the
+    old hash, so that the file is converted again only if its content has changed."""
+    stale = []
+    for filename, out_dir, _ in jobs:
+        entry = entries.get(os.path.abspath(filename))
+        if entry is None or entry[3] != options_key or not all(os.path.exists(out) for out in entry[4]):
+            stale.append((filename, out_dir, None))
+            continue
+        try:
+            size, mtime = archive.stat(filename)
+        except OSError:
+            stale.append((filename, out_dir, None))  # let the conversion report it
+            continue
+        if (size, mtime) != entry[:2]:
+            stale.append((filename, out_dir, entry[2]))
+    return stale
+
+def remove_outputs(outputs: list[str]) -> None:
+    for out_filename in outputs:
+        try:
+            os.unlink(out_filename)
+        except FileNotFoundError:
+            pass
+
+def prune(manifest: Manifest, entries: dict) -> int:
+    """Remove the outputs of the files that no longer exist. Returns the number of files pruned."""
+    pruned = 0
+    for path, entry in entries.items():
+        if not archive.exists(path):
+            remove_outputs(entry[4])
+            manifest.remove(path)
+            pruned += 1
+    return pruned
+
+def format_status(result: dict) -> str:
+    if 'error' in result:
+        return f'FAIL {result["filename"]}: {result["error"]}'
+    return f'OK   {result["filename"]} -> {", ".join(result["outputs"])} ({result["written"]} bytes)'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Kawai K5000 native files to System Exclusive format and back')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-o', dest='out_dir', action='store', required=True, help='Output directory')
+    parser.add_argument('-c', type=int, dest='channel', action='store', default=1, help='MIDI channel (1...16)')
+    parser.add_argument('-b', dest='bank_id', action='store', default='A', help='Bank identifier for .KAA and .KA1 files (A, B, D, E, F)')
+    parser.add_argument('-n', type=int, dest='number', action='store', default=1,
+        help='Tone number for .KA1 files (1...128), or multi number for .KC1 files (1...64)')
+    parser.add_argument('-j', type=int, dest='jobs', action='store', default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-i', dest='incremental', action='store_true',
+        help='Only convert new and changed files, and remove the outputs of deleted files')
+    parser.add_argument('-m', dest='manifest', action='store', help=f'Manifest file for -i (default {MANIFEST_NAME} in the output directory)')
+    args = parser.parse_args()
+
+    if args.channel < 1 or args.channel > 16:
+        print(f'MIDI channel must be between 1 and 16 (was {args.channel})')
+        sys.exit(-1)
+    bank_id = args.bank_id.upper()
+    if bank_id not in sysex.BANK_IDS:
+        print(f'Bank name must be A, B, D, E or F (was {bank_id})')
+        sys.exit(-1)
+    if args.number < 1 or args.number > bank.MAX_PATCH_COUNT:
+        print(f'Number must be between 1 and {bank.MAX_PATCH_COUNT} (was {args.number})')
+        sys.exit(-1)
+
+    options = {'channel': args.channel, 'bank_id': bank_id, 'number': args.number}
+    start_time = time.perf_counter()
+    jobs = get_jobs(args.filenames, args.out_dir)
+    convert = functools.partial(convert_file, options=options, incremental=args.incremental)
+
+    manifest = None
+    skipped_count, pruned_count = 0, 0
+    if args.incremental:
+        os.makedirs(args.out_dir, exist_ok=True)
+        manifest = Manifest(args.manifest or os.path.join(args.out_dir, MANIFEST_NAME))
+        entries = manifest.get_entries()
+        options_key = json.dumps(options, sort_keys=True)
+        pruned_count = prune(manifest, entries)
+        stale_jobs = get_stale_jobs(jobs, entries, options_key)
+        skipped_count = len(jobs) - len(stale_jobs)
+        jobs = stale_jobs
+
+    file_count, failed_count, total_size, total_written = 0, 0, 0, 0
+    for result in helpers.map_parallel(convert, jobs, args.jobs):
+        if manifest is not None and 'error' not in result:
+            path = os.path.abspath(result['filename'])
+            if result.get('unchanged'):
+                # Only touched, so keep the outputs
+                entry = entries[path]
+                manifest.put(path, result['size'], result['mtime'], result['hash'], options_key, entry[4])
+                skipped_count += 1
+                continue
+            if path in entries:
+                remove_outputs(set(entries[path][4]) - set(result['outputs']))
+            manifest.put(path, result['size'], result['mtime'], result['hash'], options_key, result['outputs'])
+        print(format_status(result))
+        file_count += 1
+        total_size += result['size']
+        total_written += result['written']
+        if 'error' in result:
+            failed_count += 1
+    if manifest is not None:
+        manifest.close()
+
+    seconds = time.perf_counter() - start_time
+    incremental_info = f', {skipped_count} up to date, {pruned_count} removed' if args.incremental else ''
+    print(f'Converted {file_count - failed_count} of {file_count} files, {failed_count} failed{incremental_info}, '
+        f'in {seconds:.2f} seconds ({file_count / seconds:.0f} files/s, {total_size / seconds / 1e6:.1f} MB/s read, '
+        f'{total_written / seconds / 1e6:.1f} MB/s written)', file=sys.stderr)
+    sys.exit(1 if failed_count else 0)
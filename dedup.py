@@ -0,0 +1,112 @@
+# Find duplicate single patches across .KAA banks, .KA1 files and System Exclusive dumps
+
+import os
+import argparse
+import hashlib
+
+import bank
+import fileindex
+import helpers
+import sysex
+
+EXTENSIONS = ['kaa', 'ka1', 'syx']
+INDEX_VERSION = 2  # version 1 read only the first message of a .syx file
+
+def fingerprint(data: bytes, ignore_name: bool = False) -> bytes:
+    """Get a hash of the patch data. If ignore_name is True, the name is left out,
+    and so is the checksum, since it depends on the name."""
+    h = hashlib.blake2b(digest_size=16)
+    if ignore_name:
+        h.update(data[1 : bank.NAME_OFFSET])
+        h.update(data[bank.NAME_OFFSET + bank.NAME_LENGTH :])
+    else:
+        h.update(data)
+    return h.digest()
+
+def get_patch_name(data: bytes) -> str:
+    name = bytes(data[bank.NAME_OFFSET : bank.NAME_OFFSET + bank.NAME_LENGTH])
+    return name.decode('ascii', errors='replace').rstrip('\x7f')
+
+def get_file_patches(filename: str, ignore_name: bool = False) -> list[tuple[str, bytes, str]]:
+    """Get the (slot, fingerprint, name) of every single patch in a file."""
+    patches = []
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    if extension == 'kaa':
+        with bank.BankFile(filename) as bank_file:
+            for patch in bank_file.get_bank(verbose=False).patches:
+                patches.append((f'{patch.index + 1:03}', fingerprint(patch.data, ignore_name), patch.name))
+    elif extension == 'ka1':
+        data = helpers.read_file_data(filename)
+        if bank.check_single_size(len(data)):
+            patches.append(('', fingerprint(data, ignore_name), get_patch_name(data)))
+    elif extension == 'syx':
+        for slot, patch_data in sysex.read_singles(filename):
+            patches.append((slot, fingerprint(patch_data, ignore_name), get_patch_name(patch_data)))
+    return patches
+
+class DedupIndex(fileindex.FileIndex):
+    """An on-disk index of patch fingerprints and their locations.
+
+    Files are only reparsed when their size or modification time has changed.
+    """
+
+    def __init__(self, filename: str, ignore_name: bool = False):
+        super().__init__(filename)
+        self.ignore_name = ignore_name
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS patches (hash BLOB, path TEXT, slot TEXT, name TEXT);
+            CREATE INDEX IF NOT EXISTS patches_hash ON patches (hash);
+            CREATE INDEX IF NOT EXISTS patches_path ON patches (path);
+        ''')
+        meta = dict(self.db.execute('SELECT key, value FROM meta').fetchall())
+        if meta.get('ignore_name') != str(ignore_name) or meta.get('version') != str(INDEX_VERSION):
+            # The fingerprints depend on this setting, so start over if it has changed
+            self.db.execute('DELETE FROM files')
+            self.db.execute('DELETE FROM patches')
+            self.db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                [('ignore_name', str(ignore_name)), ('version', str(INDEX_VERSION))])
+            self.db.commit()
+
+    def add_file(self, path: str) -> None:
+        patches = get_file_patches(path, self.ignore_name)
+        self.db.executemany('INSERT INTO patches VALUES (?, ?, ?, ?)',
+            ((h, path, slot, name) for slot, h, name in patches))
+
+    def remove_file(self, path: str) -> None:
+        self.db.execute('DELETE FROM patches WHERE path = ?', (path,))
+        super().remove_file(path)
+
+    def get_patch_count(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM patches').fetchone()[0]
+
+    def get_clusters(self, min_count: int = 2):
+        """Generate the (hash, locations) of each patch found at least min_count times,
+        most duplicated first. The locations are (path, slot, name) tuples."""
+        hashes = self.db.execute('''SELECT hash FROM patches GROUP BY hash HAVING COUNT(*) >= ?
+            ORDER BY COUNT(*) DESC, hash''', (min_count,))
+        for (h,) in hashes:
+            locations = self.db.execute('SELECT path, slot, name FROM patches WHERE hash = ? ORDER BY path, slot', (h,))
+            yield h, locations.fetchall()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find duplicate Kawai K5000 single patches in .KAA, .KA1 and .syx files')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Files, directories or glob patterns')
+    parser.add_argument('-i', dest='index', action='store', default='k5kdedup.sqlite', help='Index file (default k5kdedup.sqlite)')
+    parser.add_argument('-n', dest='ignore_name', action='store_true', help='Ignore patch names when comparing')
+    args = parser.parse_args()
+
+    index = DedupIndex(args.index, args.ignore_name)
+    indexed, removed = index.update(helpers.expand_paths(args.filenames, EXTENSIONS))
+    print(f'Indexed {indexed} new or changed files, removed {removed} missing files')
+    print(f'Index contains {index.get_patch_count()} patches')
+
+    cluster_count = 0
+    for h, locations in index.get_clusters():
+        cluster_count += 1
+        print(f'{h.hex()}: {len(locations)} copies')
+        for path, slot, name in locations:
+            location = f'{path} {slot}' if slot else path
+            print(f'    {location}  "{name}"')
+    print(f'{cluster_count} patches have duplicates')
+    index.close()
@@ -0,0 +1,69 @@
+# Keep an SQLite index of library files up to date
+#
+# The indexes of dedup.py, nameindex.py and resolve.py all remember the size and
+# modification time of each file they have read, and only read a file again when
+# either of them has changed.
+
+import sys
+import os
+import sqlite3
+import struct
+
+COMMIT_INTERVAL = 500  # files
+
+class FileIndex:
+    """An index of files in an SQLite database, with the size and modification time of each file.
+
+    Subclasses store what they get from a file in add_file(), and delete it in remove_file().
+    """
+
+    def __init__(self, filename: str):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)')
+
+    def add_file(self, path: str) -> None:
+        raise NotImplementedError
+
+    def remove_file(self, path: str) -> None:
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def update(self, filenames: list[str], prune: bool = True) -> tuple[int, int]:
+        """Index new and changed files, and (if prune is True) forget the ones that no longer exist.
+        Returns the number of files indexed and removed."""
+        indexed = 0
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                print(f'Unable to read "{filename}": {e.strerror}', file=sys.stderr)
+                continue
+            row = self.db.execute('SELECT size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None and row == (st.st_size, st.st_mtime_ns):
+                continue
+
+            self.remove_file(path)
+            try:
+                self.add_file(path)
+            except (OSError, ValueError, IndexError, UnicodeDecodeError, struct.error) as e:
+                # Remember the file anyway, so that it is not read again until it changes
+                print(f'Unable to read "{filename}": {e}', file=sys.stderr)
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, st.st_size, st.st_mtime_ns))
+            indexed += 1
+            if indexed % COMMIT_INTERVAL == 0:
+                self.db.commit()
+
+        removed = 0
+        if prune:
+            for (path,) in self.db.execute('SELECT path FROM files').fetchall():
+                if not os.path.exists(path):
+                    self.remove_file(path)
+                    removed += 1
+        self.db.commit()
+        return indexed, removed
+
+    def close(self) -> None:
+        self.db.close()
@@ -3,7 +3,7 @@
 import os
 import sys
 import wx
-import bank
+import cache
 import helpers
 
 class MainFrame(wx.Frame):
@@ -104,11 +104,11 @@ class MainFrame(wx.Frame):
                 patch_names = []
                 if file_kind == 'kaa':
                     kind_value = 'Bank of single patches'
-                    bank_data = bank.get_bank(self.file_data)
-                    patches = sorted(bank_data['patches'], key=lambda x: x['index'])
-                    for ix, patch in enumerate(patches):
-                        patch_count += 1
-                        patch_names.append(patch['name'])
+                    with cache.open_bank(pathname) as bank_data:
+                        patches = sorted(bank_data['patches'], key=lambda x: x['index'])
+                        for ix, patch in enumerate(patches):
+                            patch_count += 1
+                            patch_names.append(patch['name'])
                 elif file_kind == 'ka1':
                     kind_value = 'One single patch'
                     patch_count = 1
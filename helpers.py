@@ -1,8 +1,20 @@
+import glob
+import os
 import sys
+import secrets
+import collections
+import concurrent.futures
+import typing
+
+import archive
+
+# The most buffers one writev() call takes
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') and 'SC_IOV_MAX' in os.sysconf_names else 1024
 
 def read_file_data(filename: str) -> bytes:
+    """Read a file, which can also be a member of an archive (see archive.py)."""
     try:
-        with open(filename, 'rb') as f:
+        with archive.open_file(filename) as f:
             data = f.read()
             #print('Read {} bytes from file {}'.format(len(data), filename))
             return data
@@ -18,8 +30,138 @@ def write_file_data(filename: str, data: bytes) -> None:
         print(f'File exists: {filename}')
         sys.exit(-1)
 
+def write_parts(fd: int, parts: list[bytes]) -> int:
+    """Write the buffers one after another straight to a file descriptor, without joining
+    them first: with os.writev() where available (IOV_MAX buffers at a time), otherwise
+    one by one. Returns the number of bytes written."""
+    views = collections.deque(memoryview(part).cast('B') for part in parts if len(part) > 0)
+    total = 0
+    while views:
+        if hasattr(os, 'writev'):
+            written = os.writev(fd, [views[i] for i in range(min(len(views), IOV_MAX))])
+        else:
+            written = os.write(fd, views[0])
+        total += written
+        # Drop what was written, which may end in the middle of a buffer
+        while written > 0:
+            if written >= len(views[0]):
+                written -= len(views.popleft())
+            else:
+                views[0] = views[0][written:]
+                written = 0
+    return total
+
+def write_file_parts(filename: str, parts: list[bytes]) -> None:
+    """Write the buffers into a file, like write_file_data but without joining them first."""
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        write_parts(fd, parts)
+    finally:
+        os.close(fd)
+
+def create_temp_file(filename: str) -> tuple[int, str]:
+    """Create a new temporary file in the same directory as filename. Unlike with tempfile,
+    the file gets the usual permissions of a new file (0666 minus the umask).
+    Returns the file descriptor and the name of the file."""
+    directory = os.path.dirname(filename) or '.'
+    while True:
+        temp_filename = os.path.join(directory, f'.{os.path.basename(filename)}.{secrets.token_hex(4)}.tmp')
+        try:
+            fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            return fd, temp_filename
+        except FileExistsError:
+            continue
+
+def write_file_atomic(filename: str, parts: list[bytes]) -> None:
+    """Write the buffers into a file so that it is either completely written or not there
+    at all: write a temporary file in the same directory, then rename it. The file gets
+    the permissions of the file it replaces, or the usual ones for a new file."""
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+    fd, temp_filename = create_temp_file(filename)
+    try:
+        try:
+            write_parts(fd, parts)
+            if mode is not None and hasattr(os, 'fchmod'):
+                os.fchmod(fd, mode)
+        finally:
+            os.close(fd)
+        if mode is not None and not hasattr(os, 'fchmod'):
+            os.chmod(temp_filename, mode)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+def map_parallel(function: typing.Callable, items: list, jobs: int) -> typing.Iterator:
+    """Call function on each of the items in jobs worker processes, and yield the results
+    in the order of the items. With one job (or item), no processes are started."""
+    jobs = max(1, jobs or 1)
+    if jobs == 1 or len(items) <= 1:
+        yield from map(function, items)
+        return
+    # Hand out the items in chunks, but small enough to keep all the workers busy
+    chunk_size = max(1, min(64, len(items) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(function, items, chunksize=chunk_size)
+
 def hexdump(data: bytes) -> str:
     result = ''
     for b in data:
         result += f'{b:02X} '
     return result
+
+def expand_paths(args: list[str], extensions: list[str], archives: bool = False) -> list[str]:
+    """Expand directories (recursively) and glob patterns into a sorted list of files.
+
+    Files found in directories or with globs are only included if their extension
+    (without the dot, case-insensitive) is in extensions. Plain filenames are kept as is.
+    If archives is True, ZIP and tar archives (given or found) are replaced by the paths
+    of their members with those extensions, like "Library.zip!Banks/BANK01.KAA".
+    """
+    filenames = []
+    for arg in args:
+        if os.path.isdir(arg):
+            found = []
+            for dirpath, dirnames, files in os.walk(arg):
+                found.extend(os.path.join(dirpath, name) for name in files)
+        elif any(c in arg for c in '*?['):
+            found = glob.glob(arg, recursive=True)
+        elif archives and archive.is_archive(arg) and os.path.isfile(arg):
+            found = [arg]
+        else:
+            filenames.append(arg)
+            continue
+        for name in sorted(found):
+            if archives and archive.is_archive(name) and os.path.isfile(name):
+                try:
+                    filenames.extend(archive.list_members(name, extensions))
+                except OSError as e:
+                    print(f'Unable to read "{name}": {e.strerror}', file=sys.stderr)
+            elif os.path.splitext(name)[1].lower()[1:] in extensions and os.path.isfile(name):
+                filenames.append(name)
+    return filenames
+
+def get_root(arg: str) -> str:
+    """Get the directory that the files found with arg are relative to in the output tree."""
+    arg = archive.split_path(arg)[0]
+    if os.path.isdir(arg):
+        return arg
+    magic = [i for i, c in enumerate(arg) if c in '*?[']
+    static = arg[: magic[0]] if magic else arg
+    return os.path.dirname(static)
+
+def get_out_dir(filename: str, root: str, out_dir: str) -> str:
+    """Get the output directory of a file found under root. The members of an archive go into
+    a directory with the name of the archive (like "Library.zip"), like it was extracted there.
+    The extension is kept, so that the output does not mix with a "Library" directory."""
+    archive_filename, member = archive.split_path(filename)
+    directory = os.path.dirname(archive_filename)
+    relative = os.path.relpath(directory, root) if root else directory
+    if member is not None:
+        # Keep the member inside the output directory, whatever its name is
+        parts = [part for part in os.path.dirname(member).split('/') if part not in ['', '.', '..']]
+        relative = os.path.join(relative, os.path.basename(archive_filename), *parts)
+    return os.path.normpath(os.path.join(out_dir, relative))
@@ -3,168 +3,244 @@
 
 import sys
 import os
+import json
+import argparse
+import concurrent.futures
+import typing
 
+import archive
 import bank
+import cache
+import checksum
 import helpers
 import multi
+import sysex
+import tonemap
 
 
 def is_sysex(data: bytes) -> bool:
     return data[0] == 0xf0 and data[-1] == 0xf7
 
 def is_kawai(data: bytes) -> bool:
-    return data[1] == 0x40
-
-def get_tone_map(data: bytes) -> list[bool]:
-    tone_data = data[8 : 8 + 19]
-    bit_str = ''
-    for b in tone_data:
-        b_str = '{0:07b}'.format(b)  # exactly seven bits each
-        bit_str += b_str[::-1] # reverse it
-    flags = []
-    flag_str = bit_str[:128] # cut the spurious bits from the last byte
-    for bit in flag_str:
-        flags.append(True if bit == '1' else False)
-    #print(flag_str[:128])
-    #print(len(flag_str))
-    return flags
+    return data[1] == sysex.KAWAI_ID
+
+# Enough bytes for the System Exclusive header and the tone map of a block single dump
+HEADER_READ_SIZE = sysex.HEADER_SIZE + sysex.TONE_MAP_SIZE
+
+CARDINALITIES = {sysex.ONE: 'one', sysex.BLOCK: 'block'}
+KINDS = {0x00: 'single', 0x10: 'drumkit', 0x11: 'druminstrument', 0x20: 'combi/multi'}  # multi on K5000S/R
+NATIVE_KINDS = {'kaa': 'Single bank', 'ka1': 'One single patch', 'kca': 'Combi/multi bank',
+    'kc1': 'One combi/multi patch', 'kra': 'Arpeggiator settings'}
+EXTENSIONS = ['syx'] + list(NATIVE_KINDS)
+SCAN_BATCH_SIZE = 1000  # files handed to the thread pool at a time
+
+def read_header(filename: str) -> tuple[int, bytes, bytes]:
+    """Read only what is needed to identify a System Exclusive file:
+    the size, the first HEADER_READ_SIZE bytes and the last byte.
+    (For a compressed archive member, getting to the last byte means decompressing it.)"""
+    size = archive.stat(filename)[0]
+    with archive.open_file(filename) as f:
+        head = f.read(HEADER_READ_SIZE)
+        if size > len(head):
+            f.seek(size - 1)
+            last = f.read(1)
+        else:
+            last = head[-1:]
+    return size, head, last
 
-def identify_sysex(filename: str) -> list[str]:
-    lines = []
+def get_sysex_info(head: bytes) -> dict:
+    """Get the channel, cardinality, kind and location of a K5000 System Exclusive message
+    from its first bytes, and the number of tones if it is a block single dump."""
+    info = {'channel': head[2] + 1, 'cardinality': CARDINALITIES.get(head[3]), 'kind': KINDS.get(head[6])}
 
-    lines.append(f'Treating "{filename}" as MIDI System Exclusive file')
+    # head[4] should always be 00h
+    # head[5] should always be 0Ah
 
-    data = helpers.read_file_data(filename)
-    print(f'Read {len(data)} bytes from file')
+    if info['kind'] == 'combi/multi':
+        if info['cardinality'] == 'one':
+            info['number'] = head[7] + 1
+        return info  # no location for combi/multi (block dumps don't even have the byte)
 
-    is_valid = is_sysex(data) and is_kawai(data)
-    if not is_valid:
-        lines.append('This file does not contain a System Exclusive message for Kawai')
-        return []
-
-    channel = data[2] + 1
-    lines.append(f'MIDI channel: {channel}')
-
-    # Collect the cardinality, kind and location information from the header:
-
-    cardinality = None
-    if data[3] == 0x20:
-        cardinality = 'one'
-    elif data[3] == 0x21:
-        cardinality = 'block'
-
-    # data[4] should always be 00h
-    # data[5] should always be 0Ah
-
-    kind = None
-    if data[6] == 0x00:
-        kind = 'single'
-    elif data[6] == 0x10:
-        kind = 'drumkit'
-    elif data[6] == 0x11:
-        kind = 'druminstrument'
-    elif data[6] == 0x20:
-        kind = 'combi/multi'  # multi on K5000S/R
-
-    location = None  # and remains so for combi/multi and drums
-    if data[7] == 0x00:
-        location = 'A'
-    elif data[7] == 0x01:
-        location = 'B'
     # there is no bank C!
-    elif data[7] == 0x02:
-        location = 'D'
-    elif data[7] == 0x03:
-        location = 'E'
-    elif data[7] == 0x04:
-        location = 'F'
+    info['location'] = sysex.BANK_IDS[head[7]] if head[7] < len(sysex.BANK_IDS) else None
+    if info['kind'] == 'single':
+        if info['cardinality'] == 'block' and len(head) >= HEADER_READ_SIZE:
+            info['tone_count'] = tonemap.count(head[sysex.HEADER_SIZE : HEADER_READ_SIZE])
+        elif info['cardinality'] == 'one' and len(head) > sysex.HEADER_SIZE:
+            info['number'] = head[sysex.HEADER_SIZE] + 1
+    return info
+
+def get_native_info(extension: str, size: int) -> dict:
+    """Get what the size of a native file tells about it."""
+    info = {'kind': NATIVE_KINDS.get(extension)}
+    if extension == 'kaa':
+        info['valid'] = bank.POINTER_TABLE_SIZE + 4 < size <= bank.BANK_SIZE
+    elif extension == 'ka1':
+        info['valid'] = bank.check_single_size(size)
+        if info['valid']:
+            info['pcm_sources'], info['add_sources'] = bank.SINGLE_INFO[size]
+    elif extension == 'kc1':
+        info['valid'] = multi.check_size(size)
+    elif extension == 'kca':
+        info['valid'] = size == multi.MULTI_COUNT * multi.MULTI_DATA_SIZE
+    return info
+
+def classify(filename: str) -> dict:
+    """Identify a file from its size and, for System Exclusive files, its first and last bytes,
+    without reading the rest of it."""
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    record = {'path': filename, 'format': extension}
+    try:
+        if extension == 'syx':
+            size, head, last = read_header(filename)
+            record['size'] = size
+            record['valid'] = len(head) >= sysex.HEADER_SIZE and is_sysex(head[:1] + last) and is_kawai(head)
+            if record['valid']:
+                record.update(get_sysex_info(head))
+        else:
+            record['size'] = archive.stat(filename)[0]
+            record.update(get_native_info(extension, record['size']))
+    except OSError as e:
+        record['error'] = e.strerror
+    return record
+
+def classify_messages(filename: str) -> list[dict]:
+    """Identify each System Exclusive message in a file, with its offset and size.
+    The whole file is read, but only one chunk at a time. Other files are identified
+    like with classify."""
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    if extension != 'syx':
+        return [classify(filename)]
+
+    records = []
+    try:
+        for offset, message in sysex.read_messages(filename):
+            record = {'path': filename, 'format': extension, 'offset': offset, 'size': len(message)}
+            record['valid'] = len(message) >= sysex.HEADER_SIZE and is_kawai(message)
+            if record['valid']:
+                record.update(get_sysex_info(bytes(message[:HEADER_READ_SIZE])))
+            records.append(record)
+    except OSError as e:
+        records.append({'path': filename, 'format': extension, 'error': e.strerror})
+    return records
+
+def scan(filenames: list[str], jobs: int, messages: bool = False) -> typing.Iterator[dict]:
+    """Classify the files (or with messages=True, every message in the System Exclusive files)
+    on a thread pool, in order. The work is mostly waiting for the file system, so there can be
+    many more threads than processors."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for start in range(0, len(filenames), SCAN_BATCH_SIZE):
+            batch = filenames[start : start + SCAN_BATCH_SIZE]
+            if messages:
+                for records in executor.map(classify_messages, batch):
+                    yield from records
+            else:
+                yield from executor.map(classify, batch)
+
+def report_message(message: bytes, filename: str) -> list[str]:
+    lines = []
+
+    info = get_sysex_info(message[:HEADER_READ_SIZE])
+    lines.append(f'MIDI channel: {info["channel"]}')
+
+    kind, location = info['kind'], info.get('location')
 
     # Construct information lines from the collected info:
-    if cardinality == 'block':
+    if info['cardinality'] == 'block':
         if kind == 'single':
-            tone_map = get_tone_map(data)
-            tone_count = 0
-            for tone in tone_map:
-                if tone:
-                    tone_count += 1
-            line = f'Contains {tone_count} {kind} tones'
+            line = f'Contains {info.get("tone_count", 0)} {kind} tones'
             if location is not None:
                 line += f' for bank {location}'
             lines.append(line)
+            lines.extend(report_checksums(checksum.check_data(message, 'syx'), filename))
         elif kind == 'combi/multi':
             line = f'Contains {multi.MULTI_COUNT} {kind} patches'
             lines.append(line)
+            lines.extend(report_checksums(checksum.check_data(message, 'syx'), filename))
 
-    elif cardinality == 'one':
+    elif info['cardinality'] == 'one':
         #lines.append(f'Kind: {kind}')
         if kind == 'combi/multi':
-            number = data[7] + 1
-            lines.append(f'Contains {kind} patch M{number:02}')
-            lines.extend(report_multi(data[8:-1]))
+            lines.append(f'Contains {kind} patch M{info["number"]:02}')
+            lines.extend(report_multi(message[sysex.HEADER_SIZE : -1]))
         elif kind == 'single':
-            tone_num = data[8] + 1
-            lines.append(f'Contains {kind} patch {location}{tone_num:03}')
+            lines.append(f'Contains {kind} patch {location}{info.get("number", 0):03}')
+            lines.extend(report_checksums(checksum.check_data(message, 'syx'), filename))
     else:
         lines.append('Unable to determine patch information')
 
     return lines
 
-def report_multi(data: bytes) -> list[str]:
+def identify_sysex(filename: str) -> list[str]:
     lines = []
 
-    #checksum = data[0]
-    mute_byte = data[48] & 0x0f  # mask off top 4 bits in case there is junk
-    mute_bits = bin(mute_byte)[2:].zfill(4)  # strip off the '0b' prefix, pad left with zeros to four bits
-    #print(f'mute_bits = {mute_bits}')
-
-    sections = []
-    for i in range(0, 4):
-        sections.append({'number': i + 1})
-
-    section_num = 1
-    for mb in reversed(mute_bits):  # reversed to get natural section order
-        sections[section_num - 1]['mute'] = False if mb == '1' else True # 0=mute, 1=active
-        section_num += 1
-
-    section_data = data[55:]
-    #print(section_data)
-    #print(len(section_data))
-
-    section_chunks = [section_data[i:i + 12] for i in range(0, len(section_data), 12)]
-    #print(section_chunks)
-    #for chunk in section_chunks:
-    #    print(helpers.hexdump(chunk))
-    section_num = 1
-    for chunk in section_chunks:
-        # Combine the MSB and LSB into a 9-bit value
-        msb = bin(chunk[0])[2:].zfill(2) # strip off the '0b' prefix, pad left to two bits
-        lsb = bin(chunk[1])[2:].zfill(7)
-        single_number = int(msb + lsb, 2) # convert the combined msb + lsb bit string into a number
-        sections[section_num - 1]['single'] = single_number
-        section_num += 1
-
-    for section in sections:
-        if not section['mute']:
-            lines.append(f'Section {section["number"]}: {bank.get_single_name(section["single"])}')
-
-    #computed_checksum = multi.get_checksum(data)
-    #if computed_checksum == checksum:
-    #    lines.append(f'Checksum {checksum:02X}h matches')
-    #else:
-    #    lines.append(f'Checksum mismatch: original={checksum:02X}, computed={computed_checksum:02X}h')
+    lines.append(f'Treating "{filename}" as MIDI System Exclusive file')
+    lines.append(f'File size: {archive.stat(filename)[0]} bytes')
+
+    # The file may have any number of messages, so go through it one message at a time
+    reports = []
+    other_count = 0
+    for offset, message in sysex.read_messages(filename):
+        if len(message) < sysex.HEADER_SIZE or not is_kawai(message):
+            other_count += 1
+            continue
+        reports.append((offset, len(message), report_message(message, filename)))
+
+    if not reports:
+        lines.append('This file does not contain a System Exclusive message for Kawai')
+        return lines
+
+    if len(reports) == 1 and other_count == 0:
+        lines.extend(reports[0][2])
+        return lines
+
+    lines.append(f'Contains {len(reports)} messages for Kawai and {other_count} other messages')
+    for number, (offset, size, report) in enumerate(reports, start=1):
+        lines.append(f'Message {number} at offset {offset} ({size} bytes):')
+        lines.extend(f'    {line}' for line in report)
 
     return lines
 
-def report_multi_block(data: bytes) -> list[str]:
+def report_sections(sections: list[tuple[bool, int]]) -> list[str]:
     lines = []
+    for number, (mute, single) in enumerate(sections, start=1):
+        if not mute:
+            lines.append(f'Section {number}: {bank.get_single_name(single)}')
+    return lines
 
-    multi_chunks = [data[i:i + multi.MULTI_DATA_SIZE] for i in range(0, len(data), multi.MULTI_DATA_SIZE)]
-    multi_number = 1
-    for mc in multi_chunks:
+def report_multi(data: bytes) -> list[str]:
+    checksum = data[0]
+    lines = report_sections(multi.get_section_refs(data))
+
+    computed_checksum = multi.get_checksum(data[1:])
+    if computed_checksum == checksum:
+        lines.append(f'Checksum {checksum:02X}h matches')
+    else:
+        lines.append(f'Checksum mismatch: original={checksum:02X}h, computed={computed_checksum:02X}h')
+
+    return lines
+
+def get_repair_command(filename: str) -> str:
+    if os.path.splitext(filename)[1].lower() == '.kca':
+        return f'python3 kcaanalyz.py "{filename}" --repair <outfile>'
+    return f'python3 checksum.py "{filename}" -r <directory>'
+
+def report_checksums(results: list[tuple[str, int, int, int]], filename: str) -> list[str]:
+    mismatches = checksum.get_mismatches(results)
+    if not mismatches:
+        return [f'All {len(results)} checksums match']
+    lines = [f'{len(mismatches)} of {len(results)} checksums do not match, to repair them use:',
+        f'    {get_repair_command(filename)}']
+    lines.extend(checksum.report_mismatches(mismatches))
+    return lines
+
+def report_multi_block(multis: list[dict]) -> list[str]:
+    lines = []
+
+    for multi_number, m in enumerate(multis, start=1):
         lines.append(f'Multi M{multi_number:02}')
-        lines.extend(report_multi(mc))
+        lines.extend(report_sections(m['sections']))
         lines.append('')
-        multi_number += 1
 
     return lines
 
@@ -173,46 +249,43 @@ def identify_native(filename: str, extension: str) -> list[str]:
 
     lines.append(f'Treating "{filename}" as native K5000 file')
 
-    data = helpers.read_file_data(filename)
-    #print(f'Read {len(data)} bytes from file')
+    if not archive.exists(filename):
+        print(f'File not found: {filename}')
+        sys.exit(-1)
+    size = archive.stat(filename)[0]  # the parsed structures come from the cache
 
     kind_line = f'Extension .{extension}: '
-    if extension == 'kaa':
-        kind_line += 'Single bank'
-    elif extension == 'ka1':
-        kind_line += 'One single patch'
-    elif extension == 'kca':
-        kind_line += 'Combi/multi bank'
-    elif extension == 'kc1':
-        kind_line += 'One combi/multi patch'
-    elif extension == 'kra':
-        kind_line += 'Arpeggiator settings'
-    else:
-        pass
-
+    kind_line += NATIVE_KINDS.get(extension, '')
     lines.append(kind_line)
 
-    lines.append(f'File size: {len(data)} bytes')
+    lines.append(f'File size: {size} bytes')
 
     source_line = ''
     if extension == 'kaa':
+        with cache.open_bank(filename) as bank_data:
+            lines.append(f'Contains {len(bank_data.patches)} single patches')
+        lines.extend(report_checksums(checksum.check_file(filename), filename))
         lines.append('Use kaanalyz.py to get more information about this bank')
     elif extension == 'ka1':
-        if bank.check_single_size(len(data)):
-            counts = bank.SINGLE_INFO[len(data)]
+        if bank.check_single_size(size):
+            counts = bank.SINGLE_INFO[size]
             source_line = f'{counts[0]} PCM, {counts[1]} ADD sources'
         else:
             source_line = 'Does not match any valid KA1 file'
         lines.append(source_line)
+        if bank.check_single_size(size):
+            lines.extend(report_checksums(checksum.check_file(filename), filename))
     elif extension == 'kc1':
-        if multi.check_size(len(data)):
-            lines.extend(report_multi(data))
+        if multi.check_size(size):
+            lines.extend(report_sections(cache.get_multis(filename)[0]['sections']))
+            lines.extend(report_checksums(checksum.check_file(filename), filename))
         else:
             source_line = 'Does not look like a valid combi/multi KC1 file'
             lines.append(source_line)
     elif extension == 'kca':
-        if multi.check_size(int(len(data) / multi.MULTI_COUNT)):
-            lines.extend(report_multi_block(data))
+        if multi.check_size(int(size / multi.MULTI_COUNT)):
+            lines.extend(report_multi_block(cache.get_multis(filename)))
+            lines.extend(report_checksums(checksum.check_file(filename), filename))
         else:
             source_line = 'Does not look like a valid KCA bank of combis/multis'
             lines.append(source_line)
@@ -220,16 +293,30 @@ def identify_native(filename: str, extension: str) -> list[str]:
     return lines
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    pathname, ext = os.path.splitext(filename)
-
-    lines = []
-
-    extension = ext.lower()[1:]
-    if extension == 'syx':
-        lines = identify_sysex(filename)
-    elif extension in ['kaa', 'ka1', 'kca', 'kc1', 'kra']:
-        lines = identify_native(filename, extension)
-
-    for line in lines:
-        print(line)
+    parser = argparse.ArgumentParser(description='Identify Kawai K5000 patch files (native or System Exclusive)')
+    parser.add_argument(dest='paths', metavar='path', nargs='+', help='Files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-j', dest='jobs', type=int, action='store', default=32, help='Number of threads for scanning (default 32)')
+    parser.add_argument('--json', dest='json', action='store_true', help='Output one JSON object per file, even for a single file')
+    parser.add_argument('-m', dest='messages', action='store_true',
+        help='Identify every message in System Exclusive files, not just the first one (reads the whole files)')
+    args = parser.parse_args()
+
+    is_file = os.path.isfile(args.paths[0]) and not archive.is_archive(args.paths[0]) or archive.is_member(args.paths[0])
+    if len(args.paths) == 1 and is_file and not args.json:
+        filename = args.paths[0]
+        pathname, ext = os.path.splitext(filename)
+
+        lines = []
+
+        extension = ext.lower()[1:]
+        if extension == 'syx':
+            lines = identify_sysex(filename)
+        elif extension in NATIVE_KINDS:
+            lines = identify_native(filename, extension)
+
+        for line in lines:
+            print(line)
+    else:
+        # Identify everything from the sizes and headers only, and output NDJSON
+        for record in scan(helpers.expand_paths(args.paths, EXTENSIONS, archives=True), args.jobs, args.messages):
+            print(json.dumps(record))
@@ -4,6 +4,7 @@ import argparse
 
 import bank
 import helpers
+import sysex
 
 def parse_tone_number(s: str) -> tuple[str, int]:
     name = s[0].upper()
@@ -14,6 +15,16 @@ def parse_tone_number(s: str) -> tuple[str, int]:
         number = None
     return (name, number)
 
+def get_message_parts(data: bytes, channel: int, bank_id: str, tone_number: int) -> list[bytes]:
+    """Get the pieces of a one single dump of the data of a .KA1 file, for tone number
+    1...128 in bank A, B, D, E or F: the header, the data (as is) and the terminator."""
+    header = sysex.get_header(channel, sysex.ONE, sysex.SINGLE, sysex.BANK_IDS.index(bank_id))
+    return [header + bytes([tone_number - 1]), data, b'\xf7']  # tone numbers are zero-based
+
+def make_message(data: bytes, channel: int, bank_id: str, tone_number: int) -> bytes:
+    """Make a one single dump of the data of a .KA1 file, for tone number 1...128 in bank A, B, D, E or F."""
+    return b''.join(get_message_parts(data, channel, bank_id, tone_number))
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert Kawai K5000 .KA1 files to MIDI System Exclusive format')
     parser.add_argument(dest='filenames', metavar='filename', nargs='*')
@@ -45,36 +56,16 @@ if __name__ == '__main__':
         sys.exit(-1)
     print(f'Tone number: {bank_id}{tone_number:03}')
 
-    header = bytearray([0xF0, 0x40, 0x00, 0x20, 0x00, 0x0A, 0x00, 0x00, 0x00])
-
-    message = bytearray()
-
-    header[2] = channel - 1  # adjust channel to 0...15
-    if bank_id == 'A':
-        header[7] = 0x00
-    elif bank_id == 'B':
-        header[7] = 0x01
-    elif bank_id == 'D':
-        header[7] = 0x02
-    elif bank_id == 'E':
-        header[7] == 0x03
-    elif bank_id == 'F':
-        header[7] == 0x04
-
-    header[8] = tone_number - 1  # tone numbers are zero-based
-
     data = helpers.read_file_data(filename)
     if not bank.check_single_size(len(data)):
         print(f'File size does not appear to be valid (was {len(data)} bytes)')
         sys.exit(-1)
 
-    message += header
-    message += data
-    message += bytes([0xf7])
+    parts = get_message_parts(data, channel, bank_id, tone_number)
 
     pathname, extension = os.path.splitext(filename)
     out_filename = pathname.split('/')[-1] + '.syx'
     if args.outfile is not None:
         out_filename = args.outfile
-    print(f'Writing {len(message)} bytes to "{out_filename}"')
-    helpers.write_file_data(out_filename, message)
+    print(f'Writing {sum(len(part) for part in parts)} bytes to "{out_filename}"')
+    helpers.write_file_parts(out_filename, parts)
@@ -1,31 +1,42 @@
 import sys
+import os
+import argparse
+import functools
+import struct
 
 import bank
+import cache
 import helpers
 
 def percentage(part: int, whole: int) -> str:
     result = 100 * float(part)/float(whole)
     return f'{result:.2f}%'
 
-if __name__ == '__main__':
-    filename = sys.argv[1]
-
-    format = 'text'
+def analyze_bank(filename: str, format: str = 'text', verbose: bool = False, with_filename: bool = False) -> dict:
+    """Analyze one bank and return the report lines and some statistics about it.
 
-    data = helpers.read_file_data(filename)
+    If with_filename is True, the CSV lines start with the filename.
+    """
+    try:
+        with cache.open_bank(filename, verbose) as bank_data:
+            lines = report_bank(filename, bank_data, format, with_filename)
+        return {'filename': filename, 'lines': lines, 'patch_count': len(bank_data.patches),
+            'size': sum(patch.size for patch in bank_data.patches),
+            'padding': sum(patch.padding for patch in bank_data.patches)}
+    except (ValueError, IndexError, UnicodeDecodeError, OSError, struct.error) as e:
+        return {'filename': filename, 'lines': [], 'error': str(e)}
 
-    bank_data = bank.get_bank(data)
-    #print_bank(bank_data)
+def report_bank(filename: str, bank_data: bank.Bank, format: str, with_filename: bool = False) -> list[str]:
+    lines = []
 
     final_patches = sorted(bank_data['patches'], key=lambda x: x['index'])
     total_size = sum(x['size'] for x in final_patches)
 
     if format == 'text':
-        print(f'"{filename}" contains {len(final_patches)} patches using {total_size} bytes ({percentage(total_size, bank.POOL_SIZE)} of memory).'.format(filename, len(final_patches),
-            total_size, percentage(total_size, bank.POOL_SIZE)))
-        print('{} bytes ({} of memory) free.'.format(bank.POOL_SIZE - total_size, percentage(bank.POOL_SIZE - total_size, bank.POOL_SIZE)))
-        print(f'Base address = 0x{bank_data["base"]:08X}.  Patches:')
-        print('number name      sources size  pointer  padding')
+        lines.append(f'"{filename}" contains {len(final_patches)} patches using {total_size} bytes ({percentage(total_size, bank.POOL_SIZE)} of memory).')
+        lines.append('{} bytes ({} of memory) free.'.format(bank.POOL_SIZE - total_size, percentage(bank.POOL_SIZE - total_size, bank.POOL_SIZE)))
+        lines.append(f'Base address = 0x{bank_data["base"]:08X}.  Patches:')
+        lines.append('number name      sources size  pointer  padding')
     for ix, patch in enumerate(final_patches):
         add_count = 0
         pcm_count = 0
@@ -42,6 +53,77 @@ if __name__ == '__main__':
         source_str += '-' * (bank.MAX_SOURCE_COUNT - patch['source_count'])
 
         if format == 'text':
-            print(f' {patch["index"]+1:>4d}  {patch["name"]:8}  {source_str}  {patch["size"]:>4}  0x{patch["tone"]:06X}   {patch["padding"]:>5}')
+            lines.append(f' {patch["index"]+1:>4d}  {patch["name"]:8}  {source_str}  {patch["size"]:>4}  0x{patch["tone"]:06X}   {patch["padding"]:>5}')
         elif format == 'csv':
-            print(f'{patch["index"]+1},"{patch["name"]}",{source_str},{patch["size"]},0x{patch["tone"]:06X},{patch["padding"]}')
+            prefix = f'"{filename}",' if with_filename else ''
+            lines.append(f'{prefix}{patch["index"]+1},"{patch["name"]}",{source_str},{patch["size"]},0x{patch["tone"]:06X},{patch["padding"]}')
+
+    return lines
+
+def get_empty_summary() -> dict:
+    return {'analyzed': 0, 'failed': 0, 'patch_count': 0, 'size': 0, 'padding': 0, 'buckets': [0] * 10}
+
+def add_to_summary(summary: dict, result: dict) -> None:
+    """Count the statistics of one bank into the summary, so that the results
+    of the banks don't need to be kept until the end."""
+    if 'error' in result:
+        summary['failed'] += 1
+        return
+    summary['analyzed'] += 1
+    summary['patch_count'] += result['patch_count']
+    summary['size'] += result['size']
+    summary['padding'] += result['padding']
+    # Distribution of pool usage in steps of 10%
+    summary['buckets'][min(result['size'] * 10 // bank.POOL_SIZE, 9)] += 1
+
+def report_summary(summary: dict) -> list[str]:
+    lines = []
+
+    pool_size = bank.POOL_SIZE * summary['analyzed']
+    lines.append(f'{summary["analyzed"]} banks analyzed, {summary["failed"]} failed.')
+    if not summary['analyzed']:
+        return lines
+    lines.append(f'{summary["patch_count"]} patches using {summary["size"]} bytes ({percentage(summary["size"], pool_size)} of memory).')
+    lines.append(f'{summary["padding"]} bytes ({percentage(summary["padding"], pool_size)} of memory) wasted in padding.')
+
+    lines.append('pool usage  banks')
+    for i, count in enumerate(summary['buckets']):
+        lines.append(f'{i * 10:>3}-{i * 10 + 10:>3}%  {count:>6}')
+
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report information about Kawai K5000 .KAA files')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Bank files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-f', dest='format', action='store', choices=['text', 'csv'], default='text', help='Output format')
+    parser.add_argument('-j', type=int, dest='jobs', action='store', default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-s', dest='summary', action='store_true', help='Print a summary over all banks')
+    args = parser.parse_args()
+
+    filenames = helpers.expand_paths(args.filenames, ['kaa'], archives=True)
+    if len(filenames) == 1 and not args.summary:
+        # Just one bank, report it like the original kaanalyz
+        try:
+            with cache.open_bank(filenames[0], verbose=True) as bank_data:
+                lines = report_bank(filenames[0], bank_data, args.format)
+        except FileNotFoundError:
+            print(f'File not found: {filenames[0]}')
+            sys.exit(-1)
+        for line in lines:
+            print(line)
+        sys.exit(0)
+
+    analyze = functools.partial(analyze_bank, format=args.format, with_filename=True)
+    summary = get_empty_summary()
+    for result in helpers.map_parallel(analyze, filenames, args.jobs):
+        add_to_summary(summary, result)
+        if 'error' in result:
+            print(f'Unable to analyze "{result["filename"]}": {result["error"]}', file=sys.stderr)
+        for line in result['lines']:
+            print(line)
+
+    if args.summary or args.format == 'text':
+        if args.format == 'text':
+            print()
+        for line in report_summary(summary):
+            print(line, file=sys.stdout if args.format == 'text' else sys.stderr)
@@ -0,0 +1,104 @@
+# Split Kawai K5000 .KAA banks into .KA1 files, one for each used slot
+#
+# The files are named by the slot number and the patch name, like "001_PIANO_1.KA1".
+# With many banks, each bank gets its own directory in a tree that mirrors the input
+# directories, like with convert.py.
+
+import sys
+import os
+import re
+import time
+import argparse
+import struct
+
+import archive
+import bank
+import helpers
+
+UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9_+\-.]+')
+
+def get_ka1_name(patch: bank.SinglePatch) -> str:
+    """Name the .KA1 file of a patch by its slot and name, leaving out the characters
+    that are not safe in filenames on all systems."""
+    try:
+        name = UNSAFE_CHARACTERS.sub('_', patch.name.strip()).strip('_.')
+    except UnicodeDecodeError:
+        name = ''
+    return f'{patch.index + 1:03}_{name or "NONAME"}.KA1'
+
+def check_patch(patch: bank.SinglePatch) -> str:
+    """Check the size of a patch against the sizes of valid .KA1 files.
+    Returns the reason why it is not valid, or None if it is."""
+    add_count = sum(ptr != 0 for ptr in patch.sources)
+    counts = (patch.source_count - add_count, add_count)
+    if len(patch.data) != patch.size or not bank.check_single_size(patch.size):
+        return f'size {len(patch.data)} bytes is not valid for a single patch'
+    if bank.SINGLE_INFO[patch.size] != counts:
+        return f'size {patch.size} bytes does not match {counts[0]} PCM and {counts[1]} ADD sources'
+    return None
+
+def split_bank(job: tuple[str, str]) -> dict:
+    """Write each used slot of a bank into a .KA1 file in out_dir, straight from the bank data,
+    which is only held while the bank is being split. Returns the number of files and bytes
+    written, and lines about the patches that were skipped."""
+    filename, out_dir = job
+    result = {'filename': filename, 'out_dir': out_dir, 'count': 0, 'written': 0, 'lines': []}
+    if not archive.exists(filename):
+        result['error'] = 'File not found'
+        return result
+    try:
+        with bank.BankFile(filename) as bank_file:
+            bank_data = bank_file.get_bank(verbose=False)
+            os.makedirs(out_dir, exist_ok=True)
+            for patch in sorted(bank_data.patches, key=lambda p: p.index):
+                problem = check_patch(patch)
+                if problem is not None:
+                    result['lines'].append(f'Skipping slot {patch.index + 1} of "{filename}": {problem}')
+                    continue
+                helpers.write_file_parts(os.path.join(out_dir, get_ka1_name(patch)), [patch.data])
+                result['count'] += 1
+                result['written'] += patch.size
+    except OSError as e:
+        result['error'] = e.strerror or str(e)
+    except (ValueError, IndexError, struct.error) as e:
+        result['error'] = str(e)
+    return result
+
+def get_jobs(args: list[str], out_dir: str) -> list[tuple[str, str]]:
+    """Expand the arguments into (filename, output directory) pairs. Each bank gets a directory
+    named after it, in a tree that mirrors the input directories (and archives)."""
+    jobs = []
+    for arg in args:
+        root = helpers.get_root(arg)
+        for filename in helpers.expand_paths([arg], ['kaa'], archives=True):
+            stem = os.path.splitext(archive.get_basename(filename))[0]
+            jobs.append((filename, os.path.join(helpers.get_out_dir(filename, root, out_dir), stem)))
+    return jobs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split Kawai K5000 .KAA banks into .KA1 files')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Bank files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-o', dest='out_dir', action='store', default='.', help='Output directory (default is the current directory)')
+    parser.add_argument('-j', type=int, dest='jobs', action='store', default=os.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    jobs = get_jobs(args.filenames, args.out_dir)
+    start_time = time.perf_counter()
+    bank_count, failed_count, file_count, total_written = 0, 0, 0, 0
+    for result in helpers.map_parallel(split_bank, jobs, args.jobs):
+        bank_count += 1
+        for line in result['lines']:
+            print(line, file=sys.stderr)
+        if 'error' in result:
+            failed_count += 1
+            print(f'Unable to split "{result["filename"]}": {result["error"]}', file=sys.stderr)
+            continue
+        print(f'Wrote {result["count"]} patches from "{result["filename"]}" to "{result["out_dir"]}"')
+        file_count += result['count']
+        total_written += result['written']
+
+    seconds = time.perf_counter() - start_time
+    print(f'Split {bank_count - failed_count} of {bank_count} banks into {file_count} files, {failed_count} failed, '
+        f'in {seconds:.2f} seconds ({file_count / seconds:.0f} files/s, {total_written / seconds / 1e6:.1f} MB/s written)',
+        file=sys.stderr)
+    sys.exit(1 if failed_count else 0)
@@ -5,32 +5,25 @@ import typing
 
 import bank
 import helpers
+import sysex
+import tonemap
 
 def get_tone_map(patches: list[dict[str, typing.Any]]) -> bytes:
-    tone_bits = ['0'] * 128
-    for patch in patches:
-        number = patch['index']
-        #print(f'patch number = {number}')
-        tone_bits[number] = '1'
-    #print('tone map: ', tone_bits)
+    return tonemap.encode(patch['index'] for patch in patches)
 
-    # Split the bits into groups of seven:
-    groups = [tone_bits[i:i + 7] for i in range(0, len(tone_bits), 7)]
-    #print(f'number of groups = {len(groups)}')
+def get_message_parts(patches: list[bank.SinglePatch], channel: int, bank_id: str) -> list[bytes]:
+    """Get the pieces of a block single dump of the patches for bank A, B, D, E or F:
+    the header, the tone map, the data of each patch (as is, not copied) and the terminator."""
+    final_patches = sorted(patches, key=lambda x: x['index'])
+    parts = [sysex.get_header(channel, sysex.BLOCK, sysex.SINGLE, sysex.BANK_IDS.index(bank_id)),
+        get_tone_map(final_patches)]
+    parts.extend(patch['data'] for patch in final_patches)
+    parts.append(b'\xf7')
+    return parts
 
-    buf = bytearray()
-    byte_num = 1
-    for group in groups:
-        bits = ''
-        for b in reversed(group):  # need to reverse because bit0 = A001, bit1 = A002 etc.
-            bits += b
-        #print(f'bits for byte number {byte_num}: {bits}')
-        by = int(bits, 2)
-        #print(f'byte = {by:02X}')
-        buf += bytes([by])
-        byte_num += 1
-
-    return bytes(buf)
+def make_message(patches: list[bank.SinglePatch], channel: int, bank_id: str) -> bytes:
+    """Make a block single dump of the patches for bank A, B, D, E or F."""
+    return b''.join(get_message_parts(patches, channel, bank_id))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert Kawai K5000 .KAA files to MIDI System Exclusive format')
@@ -50,46 +43,27 @@ if __name__ == '__main__':
     else:
         print(f'MIDI channel: {channel}')
 
-    data = helpers.read_file_data(filename)
-
     bank_id = args.bank_id.upper()
     if not bank_id in ['A', 'B', 'D', 'E', 'F']:
         print(f'Bank name must be A, B, D, E or F (was {bank_id})')
         sys.exit(-1)
     print(f'Bank identifier: {bank_id}')
 
-    bank_data = bank.get_bank(data)
-    final_patches = sorted(bank_data['patches'], key=lambda x: x['index'])
-
-    patch_data = bytearray()
-    for patch in final_patches:
-        print(f'{patch["index"]} {patch["name"]}  {hex(patch["tone"])}')
-        patch_data += patch['data']
-
-    header = bytearray([0xF0, 0x40, 0x00, 0x21, 0x00, 0x0A, 0x00, 0x00])
-    header[2] = channel - 1  # adjust channel to 0...15
-    if bank_id == 'A':
-        header[7] = 0x00
-    elif bank_id == 'B':
-        header[7] = 0x01
-    elif bank_id == 'D':
-        header[7] = 0x02
-    elif bank_id == 'E':
-        header[7] == 0x03
-    elif bank_id == 'F':
-        header[7] == 0x04
-
-    message = bytearray()
-    message += header
-    tone_map = get_tone_map(final_patches)
-    #print(f'tone map = {tone_map}, length = {len(tone_map)}')
-    message += tone_map
-    message += patch_data
-    message += bytes([0xf7])
+    try:
+        bank_file = bank.BankFile(filename)
+    except FileNotFoundError:
+        print(f'File not found: {filename}')
+        sys.exit(-1)
+    with bank_file:
+        bank_data = bank_file.get_bank()
+        for patch in sorted(bank_data['patches'], key=lambda x: x['index']):
+            print(f'{patch["index"]} {patch["name"]}  {hex(patch["tone"])}')
 
-    pathname, extension = os.path.splitext(filename)
-    out_filename = pathname.split('/')[-1] + '.syx'
-    if args.outfile is not None:
-        out_filename = args.outfile
-    print(f'Writing {len(message)} bytes to "{out_filename}"')
-    helpers.write_file_data(out_filename, message)
+        # Write the patch data straight from the bank file
+        parts = get_message_parts(bank_data['patches'], channel, bank_id)
+        pathname, extension = os.path.splitext(filename)
+        out_filename = pathname.split('/')[-1] + '.syx'
+        if args.outfile is not None:
+            out_filename = args.outfile
+        print(f'Writing {sum(len(part) for part in parts)} bytes to "{out_filename}"')
+        helpers.write_file_parts(out_filename, parts)
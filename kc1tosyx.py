@@ -4,6 +4,16 @@ import argparse
 
 import helpers
 import multi
+import sysex
+
+def get_message_parts(data: bytes, channel: int, number: int) -> list[bytes]:
+    """Get the pieces of a one combi/multi dump of the data of a .KC1 file, for multi
+    number 1...64: the header, the data (as is) and the terminator."""
+    return [sysex.get_header(channel, sysex.ONE, sysex.MULTI, number - 1), data, b'\xf7']  # adjust multi number to 0...63
+
+def make_message(data: bytes, channel: int, number: int) -> bytes:
+    """Make a one combi/multi dump of the data of a .KC1 file, for multi number 1...64."""
+    return b''.join(get_message_parts(data, channel, number))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert Kawai K5000 .KC1 files to MIDI System Exclusive format')
@@ -30,25 +40,16 @@ if __name__ == '__main__':
     else:
         print(f'Multi/combi number: {number}')
 
-    header = bytearray([0xF0, 0x40, 0x00, 0x20, 0x00, 0x0A, 0x20, 0x00])
-    header[2] = channel - 1  # adjust channel to 0...15
-    header[7] = number - 1 # adjust multi number to 0...63
-
-    message = bytearray()
-
     data = helpers.read_file_data(filename)
     if not multi.check_size(len(data)):
         print(f'File size does not appear to be valid (was {len(data)} bytes)')
         sys.exit(-1)
 
-    message += header
-    message += data
-    message += bytes([0xf7])
+    parts = get_message_parts(data, channel, number)
 
     pathname, extension = os.path.splitext(filename)
     out_filename = pathname.split('/')[-1] + '.syx'
     if args.outfile is not None:
         out_filename = args.outfile
-    print(f'Writing {len(message)} bytes to "{out_filename}"')
-    with open(out_filename, 'wb') as out_file:
-        out_file.write(bytes(message))
+    print(f'Writing {sum(len(part) for part in parts)} bytes to "{out_filename}"')
+    helpers.write_file_parts(out_filename, parts)
@@ -2,77 +2,111 @@ import os
 import sys
 import argparse
 
+import cache
+import checksum
 import helpers
 import multi
 import bank
+import resolve
 
-def report_multi(data: bytes) -> list[str]:
+def report_sections(sections: list[tuple[bool, int]], names: dict[int, str] = None) -> list[str]:
     lines = []
-
-    #checksum = data[0]
-    mute_byte = data[48] & 0x0f  # mask off top 4 bits in case there is junk
-    mute_bits = bin(mute_byte)[2:].zfill(4)  # strip off the '0b' prefix, pad left with zeros to four bits
-    #print(f'mute_bits = {mute_bits}')
-
-    sections = []
-    for i in range(4):
-        sections.append({'number': i + 1})
-
-    section_num = 1
-    for mb in reversed(mute_bits):  # reversed to get natural section order
-        sections[section_num - 1]['mute'] = False if mb == '1' else True # 0=mute, 1=active
-        section_num += 1
-
-    section_data = data[55:]
-    section_chunks = [section_data[i:i + 12] for i in range(0, len(section_data), 12)]
-    section_num = 1
-    for chunk in section_chunks:
-        # Combine the MSB and LSB into a 9-bit value
-        msb = bin(chunk[0])[2:].zfill(2) # strip off the '0b' prefix, pad left to two bits
-        lsb = bin(chunk[1])[2:].zfill(7)
-        single_number = int(msb + lsb, 2) # convert the combined msb + lsb bit string into a number
-        sections[section_num - 1]['single'] = single_number
-        section_num += 1
-
-    for section in sections:
-        if not section['mute']:
-            lines.append(f'Section {section["number"]}: {bank.get_single_name(section["single"])}')
-
-    #computed_checksum = multi.get_checksum(data)
-    #if computed_checksum == checksum:
-    #    lines.append(f'Checksum {checksum:02X}h matches')
-    #else:
-    #    lines.append(f'Checksum mismatch: original={checksum:02X}, computed={computed_checksum:02X}h')
-
+    names = names or {}
+    for number, (mute, single) in enumerate(sections, start=1):
+        if not mute:
+            line = f'Section {number}: {bank.get_single_name(single)}'
+            if number in names:
+                line += f' {names[number]}'
+            lines.append(line)
     return lines
 
-def report_multi_block(data: bytes) -> list[str]:
+def report_multi_block(multis: list[dict], names: dict[tuple[int, int], str] = None) -> list[str]:
+    """Report the active sections of the multis. If names are given for (multi number,
+    section number), they are shown after the single numbers."""
     lines = []
+    names = names or {}
 
-    multi_chunks = [data[i:i + multi.MULTI_DATA_SIZE] for i in range(0, len(data), multi.MULTI_DATA_SIZE)]
-    print(f'multi chunk count = {len(multi_chunks)}')
-    multi_number = 1
-    for mc in multi_chunks:
+    print(f'multi chunk count = {len(multis)}')
+    for multi_number, m in enumerate(multis, start=1):
         lines.append(f'Multi M{multi_number:02}')
-        lines.extend(report_multi(mc))
+        lines.extend(report_sections(m['sections'],
+            {section: name for (number, section), name in names.items() if number == multi_number}))
         lines.append('')
-        multi_number += 1
+
+    return lines
+
+def report_statistics(multis: multi.MultiBank) -> list[str]:
+    lines = []
+
+    lines.append('Reverb types: ' + ', '.join(f'{t}={n}' for t, n in multis.get_effect_type_counts(0).items()))
+    for effect in range(1, 5):
+        counts = multis.get_effect_type_counts(effect)
+        lines.append(f'Effect {effect} types: ' + ', '.join(f'{t}={n}' for t, n in counts.items()))
+
+    counts = sorted(multis.get_instrument_counts().items(), key=lambda item: (-item[1], item[0]))
+    lines.append('Most used singles: ' + ', '.join(f'{bank.get_single_name(s)}={n}' for s, n in counts[:10]))
+
+    histogram = multis.get_zone_histogram()
+    lines.append('Sections covering each octave: ' + ' '.join(str(n) for n in histogram))
 
     return lines
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Report information about a Kawai K5000 .KCA file')
     parser.add_argument(dest='filenames', metavar='filename', nargs='*')
+    parser.add_argument('--verify', action='store_true', help='Verify the checksums of all the multis')
+    parser.add_argument('--repair', dest='repair_filename', metavar='outfile', action='store',
+        help='Write a copy of the bank with the checksums fixed')
+    parser.add_argument('--stats', action='store_true', help='Report the effect types, singles and key zones used')
+    parser.add_argument('--reverb', dest='reverb_type', type=int, action='store',
+        help='List the multis that use this reverb type')
+    parser.add_argument('-c', dest='config', action='store',
+        help='Device configuration file (see resolve.py), to show the names of the singles')
+    parser.add_argument('-i', dest='index', action='store', default=os.path.join(cache.get_cache_dir(), resolve.DEFAULT_INDEX),
+        help='Index file for -c (default is in the k5ktools cache directory)')
     args = parser.parse_args()
 
     filename = args.filenames[0]
 
-    data = helpers.read_file_data(filename)
-    if not multi.check_size(int(len(data) / multi.MULTI_COUNT)):
-        print(f'File size does not appear to be valid (was {len(data)} bytes)')
+    if not os.path.isfile(filename):
+        print(f'File not found: {filename}')
+        sys.exit(-1)
+    size = os.path.getsize(filename)
+    if not multi.check_size(int(size / multi.MULTI_COUNT)):
+        print(f'File size does not appear to be valid (was {size} bytes)')
         sys.exit(-1)
 
-    lines = report_multi_block(data)
+    if args.verify or args.repair_filename is not None:
+        data = helpers.read_file_data(filename)
+        mismatches = checksum.get_mismatches(checksum.check_data(data, 'kca'))
+        if mismatches:
+            for line in checksum.report_mismatches(mismatches):
+                print(line)
+        else:
+            print(f'All {multi.MULTI_COUNT} checksums match')
+        if args.repair_filename is not None:
+            if mismatches:
+                helpers.write_file_atomic(args.repair_filename, [checksum.repair(data, mismatches)])
+                print(f'Wrote "{args.repair_filename}" with {len(mismatches)} checksums repaired')
+            else:
+                print('Nothing to repair')
+        sys.exit(1 if mismatches and args.repair_filename is None else 0)
+
+    if args.stats or args.reverb_type is not None:
+        multis = multi.MultiBank(helpers.read_file_data(filename))
+        lines = report_statistics(multis) if args.stats else []
+        if args.reverb_type is not None:
+            names = multis.names
+            lines.extend(f'M{i + 1:02} {names[i]}' for i in multis.find_reverb_type(args.reverb_type))
+    else:
+        names = {}
+        if args.config is not None:
+            index = resolve.ResolveIndex(args.index)
+            index.set_config(resolve.read_config(args.config))
+            names = {(number, section): single_name
+                for _, number, _, section, _, single_name, _ in index.resolve([filename]) if single_name is not None}
+            index.close()
+        lines = report_multi_block(cache.get_multis(filename), names)
     for line in lines:
         print(line)
 
@@ -4,6 +4,16 @@ import argparse
 
 import helpers
 import multi
+import sysex
+
+def get_message_parts(data: bytes, channel: int) -> list[bytes]:
+    """Get the pieces of a block combi/multi dump of the data of a .KCA file:
+    the header, the data (as is) and the terminator."""
+    return [sysex.get_header(channel, sysex.BLOCK, sysex.MULTI), data, b'\xf7']
+
+def make_message(data: bytes, channel: int) -> bytes:
+    """Make a block combi/multi dump of the data of a .KCA file."""
+    return b''.join(get_message_parts(data, channel))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert Kawai K5000 .KCA files to MIDI System Exclusive format')
@@ -22,24 +32,16 @@ if __name__ == '__main__':
     else:
         print(f'MIDI channel: {channel}')
 
-    header = bytearray([0xF0, 0x40, 0x00, 0x21, 0x00, 0x0A, 0x20])
-    header[2] = channel - 1  # adjust channel to 0...15
-
-    message = bytearray()
-
     data = helpers.read_file_data(filename)
     if not multi.check_size(int(len(data) / multi.MULTI_COUNT)):
         print(f'File size does not appear to be valid (was {len(data)} bytes)')
         sys.exit(-1)
 
-    message += header
-    message += data
-    message += bytes([0xf7])
+    parts = get_message_parts(data, channel)
 
     pathname, extension = os.path.splitext(filename)
     out_filename = pathname.split('/')[-1] + '.syx'
     if args.outfile is not None:
         out_filename = args.outfile
-    print(f'Writing {len(message)} bytes to "{out_filename}"')
-    with open(out_filename, 'wb') as out_file:
-        out_file.write(bytes(message))
+    print(f'Writing {sum(len(part) for part in parts)} bytes to "{out_filename}"')
+    helpers.write_file_parts(out_filename, parts)
@@ -0,0 +1,71 @@
+import sys
+import os
+import argparse
+
+import bank
+import helpers
+
+def compact_bank(filename: str, out_filename: str) -> int:
+    """Rewrite a bank with its patches packed together. Returns the number of bytes reclaimed."""
+    with bank.BankFile(filename) as bank_file:
+        bank_data = bank_file.get_bank(verbose=False)
+        padding = sum(patch.padding for patch in bank_data.patches)
+        data = bank.write_bank(bank_data.patches, bank_data.base)
+    helpers.write_file_atomic(out_filename, [data])
+    return padding
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make a Kawai K5000 .KAA bank from .KA1 files, or compact existing banks')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='.KA1 files, or .KAA files with --compact')
+    parser.add_argument('-o', dest='outfile', action='store', help='Output file, or output directory with --compact')
+    parser.add_argument('-s', type=int, dest='start', action='store', default=1, help='Slot number of the first patch (1...128)')
+    parser.add_argument('--compact', dest='compact', action='store_true', help='Remove the padding between the patches of existing banks')
+    args = parser.parse_args()
+
+    if args.compact:
+        if args.outfile is not None:
+            os.makedirs(args.outfile, exist_ok=True)
+        total = 0
+        for filename in helpers.expand_paths(args.filenames, ['kaa']):
+            out_filename = filename
+            if args.outfile is not None:
+                out_filename = os.path.join(args.outfile, os.path.basename(filename))
+            try:
+                reclaimed = compact_bank(filename, out_filename)
+            except (OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+                print(f'Unable to compact "{filename}": {e}')
+                continue
+            print(f'Wrote "{out_filename}", reclaimed {reclaimed} bytes')
+            total += reclaimed
+        print(f'Reclaimed {total} bytes in total')
+        sys.exit(0)
+
+    if args.outfile is None:
+        print('Output file must be specified with -o')
+        sys.exit(-1)
+
+    start = args.start
+    if start < 1 or start + len(args.filenames) - 1 > bank.MAX_PATCH_COUNT:
+        print(f'Patches must go to slots 1...{bank.MAX_PATCH_COUNT} (was {start}...{start + len(args.filenames) - 1})')
+        sys.exit(-1)
+
+    patches = []
+    for index, filename in enumerate(args.filenames, start=start - 1):
+        data = helpers.read_file_data(filename)
+        if not bank.check_single_size(len(data)):
+            print(f'File size of "{filename}" does not appear to be valid (was {len(data)} bytes)')
+            sys.exit(-1)
+        patch = bank.make_single_patch(index, data)
+        if patch.size != len(data):
+            print(f'Source data of "{filename}" does not match its size ({len(data)} bytes)')
+            sys.exit(-1)
+        print(f'{index + 1:>3}  {patch.name:8}  {patch.size:>4} bytes')
+        patches.append(patch)
+
+    try:
+        data = bank.write_bank(patches)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+    print(f'Writing {len(data)} bytes to "{args.outfile}"')
+    helpers.write_file_atomic(args.outfile, [data])
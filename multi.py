@@ -1,32 +1,59 @@
+import struct
 from dataclasses import dataclass
 from typing import List, Tuple
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 MULTI_COUNT = 64  # number of multis in a KCA bank
 SECTION_COUNT = 4
 MULTI_DATA_SIZE = 103
+NAME_OFFSET = 39  # common data starts after the checksum and the effect settings
+NAME_LENGTH = 8
+MUTE_OFFSET = 48
+SECTION_OFFSET = 55
+SECTION_DATA_SIZE = 12
+VOLUME_OFFSET = 47
+ALGORITHM_OFFSET = 1
+REVERB_TYPE_OFFSET = 2
+EFFECT_TYPE_OFFSETS = [8, 14, 20, 26]
+
+# The whole multi in one go: checksum, effect algorithm, reverb, four effects and GEQ
+# (39 bytes), the name, then volume, mutes, two controls and four sections (56 bytes).
+MULTI_STRUCT = struct.Struct('>39B8s56B')
 
 def check_size(length: int) -> bool:
     return length == MULTI_DATA_SIZE
 
 def get_checksum(data: bytes) -> int:
-    # The multi checksum is [(common data sum) + (section data sum) + 0xa5] & 0x7f
-    common_data = data[:54]
-    common_sum = 0
-    for cd in common_data:
-        common_sum += cd
-
-    section_data = data[54:]
-    section_sum = 0
-    for sd in section_data:
-        section_sum += sd
-
-    return (common_sum + section_sum + 0xA5) & 0x7F
+    # The multi checksum is [(common data sum) + (section data sum) + 0xa5] & 0x7f,
+    # where data is everything after the checksum byte
+    return (sum(data) + 0xA5) & 0x7F
+
+def get_name(data: bytes) -> str:
+    return bytes(data[NAME_OFFSET : NAME_OFFSET + NAME_LENGTH]).decode('ascii', errors='replace')
+
+def get_section_refs(data: bytes) -> list[tuple[bool, int]]:
+    """Get the mute flag and the instrument (single number) of each section of a multi."""
+    mute_byte = data[MUTE_OFFSET]
+    refs = []
+    for i in range(SECTION_COUNT):
+        offset = SECTION_OFFSET + i * SECTION_DATA_SIZE
+        # Combine the MSB and LSB into a 9-bit value
+        instrument = (data[offset] << 7) | data[offset + 1]
+        refs.append((mute_byte & (1 << i) == 0, instrument))  # 0=mute, 1=active
+    return refs
 
 @dataclass
 class VelocitySwitching:
     sw_type: int # 0=off, 1=loud, 2=soft
     amount: int # 1...127
 
+    def as_data(self) -> bytes:
+        return bytes([self.sw_type, self.amount])
+
     @classmethod
     def from_data(cls, data: bytes):
         return cls(
@@ -48,12 +75,8 @@ class Section:
 
     @classmethod
     def from_data(cls, data: bytes):
-        msb = bin(data[0])[2:].zfill(2) # strip off the '0b' prefix, pad left to two bits
-        lsb = bin(data[1])[2:].zfill(7)
-        single_number = int(msb + lsb, 2) # convert the combined msb + lsb bit string into a number
-
         return cls(
-            instrument=single_number,
+            instrument=(data[0] << 7) | data[1],  # combine the MSB and LSB into a 9-bit value
             volume=data[2],
             pan=data[3],
             effect_path=data[4],
@@ -64,10 +87,13 @@ class Section:
             receive_channel=data[11]
         )
 
-    def as_data(self) -> bytes:
-        data = bytearray()
+    def as_fields(self) -> tuple:
+        return (self.instrument >> 7, self.instrument & 0x7f, self.volume, self.pan, self.effect_path,
+            self.transpose, self.tune, self.zone[0], self.zone[1], self.vel_sw.sw_type, self.vel_sw.amount,
+            self.receive_channel)
 
-        return data
+    def as_data(self) -> bytes:
+        return bytes(self.as_fields())
 
 @dataclass
 class Control:
@@ -91,6 +117,23 @@ class Control:
             depth=data[2]
         )
 
+def get_mute_byte(mutes: List[bool]) -> int:
+    mute_byte = 0
+    for i, mute in enumerate(mutes):
+        if not mute:  # 0=mute, 1=active
+            mute_byte |= 1 << i
+    return mute_byte
+
+# Section mute flags for each value of the mute byte
+MUTES = [tuple(b & (1 << i) == 0 for i in range(SECTION_COUNT)) for b in range(16)]
+
+def get_mutes(mute_byte: int) -> List[bool]:
+    return list(MUTES[mute_byte & 0x0f])  # mask off top 4 bits in case there is junk
+
+def get_name_data(name: str) -> bytes:
+    # Pad with spaces from the right if less than eight characters
+    return name.encode('ascii')[:NAME_LENGTH].ljust(NAME_LENGTH, b' ')
+
 @dataclass
 class Common:
     name: str
@@ -98,17 +141,14 @@ class Common:
     mutes: List[bool]  # 0=mute for sections 1...4
     control1: Control
     control2: Control
+    mute_bits: int = 0  # the unused top bits of the mute byte, kept as they were
 
     def as_data(self) -> bytes:
         data = bytearray()
 
-        # TODO: get the bytes of the characters in name,
-        # pad with spaces from right if less than eight characters
-
+        data.extend(get_name_data(self.name))
         data.append(self.volume)
-
-        # TODO: Append section mutes
-
+        data.append(get_mute_byte(self.mutes) | self.mute_bits)
         data.extend(self.control1.as_data())
         data.extend(self.control2.as_data())
 
@@ -116,18 +156,13 @@ class Common:
 
     @classmethod
     def from_data(cls, data: bytes):
-        mute_byte = data[9] & 0x0f  # mask off top 4 bits in case there is junk
-        mute_bits = bin(mute_byte)[2:].zfill(4)  # strip off the '0b' prefix, pad left with zeros to four bits
-        m = []
-        for mb in reversed(mute_bits):  # reversed to get natural section order
-            m.append(False if mb == '1' else True) # 0=mute, 1=active
-
         return cls(
             name=data[0:8].decode(encoding='ascii'),
             volume=data[8],
-            mutes=m,  # collected from data[9]
+            mutes=get_mutes(data[9]),
             control1=Control.from_data(data[10:13]),
-            control2=Control.from_data(data[13:16])
+            control2=Control.from_data(data[13:16]),
+            mute_bits=data[9] & 0xf0
         )
 
 @dataclass
@@ -140,14 +175,14 @@ class Reverb:
     param4: int
 
     def as_data(self) -> bytes:
-        data = bytearray(
+        data = bytearray([
             self.reverb_type,
             self.dry_wet1,
             self.dry_wet2,
             self.param2,
             self.param3,
             self.param4
-        )
+        ])
         return bytes(data)
 
     @classmethod
@@ -171,14 +206,14 @@ class Effect:
     param4: int
 
     def as_data(self) -> bytes:
-        data = bytearray(
+        data = bytearray([
             self.effect_type,
             self.dry_wet,
             self.param1,
             self.param2,
             self.param3,
             self.param4
-        )
+        ])
         return bytes(data)
 
     @classmethod
@@ -194,7 +229,7 @@ class Effect:
 
 @dataclass
 class EffectSettings:
-    algorithm: int  # 1...4
+    algorithm: int  # 0...3 for algorithms 1...4
     reverb: Reverb
     effect1: Effect
     effect2: Effect
@@ -205,10 +240,11 @@ class EffectSettings:
     def as_data(self) -> bytes:
         data = bytearray()
 
-        data.append(self.algorithm + 1)
-
-        for b in self.geq:
-            data.append(b)
+        data.append(self.algorithm)
+        data.extend(self.reverb.as_data())
+        for effect in [self.effect1, self.effect2, self.effect3, self.effect4]:
+            data.extend(effect.as_data())
+        data.extend(self.geq)
 
         return bytes(data)
 
@@ -221,38 +257,257 @@ class EffectSettings:
             effect2=Effect.from_data(data[13:19]),
             effect3=Effect.from_data(data[19:25]),
             effect4=Effect.from_data(data[25:31]),
-            geq=data[31:38]
+            geq=list(data[31:38])
         )
 
-@dataclass
 class MultiPatch:
-    checksum: int
-    effect: EffectSettings
-    common: Common
-    sections: List[Section]
+    """A multi patch: the checksum, effect settings, common data and sections.
 
-    @classmethod
-    def from_data(cls, data: bytes):
-        e = EffectSettings.from_data(data[:39])
-        c = Common.from_data(data[39:55])
+    A decoded multi keeps the fields unpacked with MULTI_STRUCT, and makes the
+    effect settings, common data and sections out of them only when they are
+    first needed. The checksum is kept as it was unless the data has changed.
+    """
 
-        section_data = data[55:]
-        section_chunks = [section_data[i:i + 12] for i in range(0, len(section_data), 12)]
-        s = []
-        for chunk in section_chunks:
-            s.append(Section.from_data(chunk))
+    __slots__ = ('checksum', '_fields', '_effect', '_common', '_sections')
 
-        return cls(checksum=data[0], effect=e, common=c, sections=s)
+    def __init__(self, checksum: int, effect: EffectSettings, common: Common, sections: List[Section]):
+        self.checksum = checksum
+        self._fields = None
+        self._effect = effect
+        self._common = common
+        self._sections = sections
 
-    def as_data(self) -> bytes:
-        data = bytearray()
+    @classmethod
+    def from_data(cls, data: bytes):
+        return cls.from_fields(MULTI_STRUCT.unpack_from(data))
 
-        data.extend(self.effect.as_data())
-        data.extend(self.common.as_data())
+    @classmethod
+    def from_fields(cls, f: tuple):
+        """Make a multi out of the fields unpacked with MULTI_STRUCT."""
+        m = cls.__new__(cls)
+        m.checksum = f[0]
+        m._fields = f
+        m._effect = m._common = m._sections = None
+        return m
+
+    @property
+    def effect(self) -> EffectSettings:
+        if self._effect is None:
+            f = self._fields
+            self._effect = EffectSettings(f[1], Reverb(*f[2:8]), Effect(*f[8:14]), Effect(*f[14:20]),
+                Effect(*f[20:26]), Effect(*f[26:32]), list(f[32:39]))
+        return self._effect
+
+    @effect.setter
+    def effect(self, value: EffectSettings):
+        self._effect = value
+
+    @property
+    def common(self) -> Common:
+        if self._common is None:
+            f = self._fields
+            self._common = Common(f[39].decode(encoding='ascii'), f[40], get_mutes(f[41]),
+                Control(*f[42:45]), Control(*f[45:48]), f[41] & 0xf0)
+        return self._common
+
+    @common.setter
+    def common(self, value: Common):
+        self._common = value
+
+    @property
+    def sections(self) -> List[Section]:
+        if self._sections is None:
+            f = self._fields
+            self._sections = [Section((f[i] << 7) | f[i + 1], f[i + 2], f[i + 3], f[i + 4], f[i + 5], f[i + 6],
+                (f[i + 7], f[i + 8]), VelocitySwitching(f[i + 9], f[i + 10]), f[i + 11])
+                for i in range(48, 96, SECTION_DATA_SIZE)]
+        return self._sections
+
+    @sections.setter
+    def sections(self, value: List[Section]):
+        self._sections = value
+
+    def get_fields(self) -> tuple:
+        """Get the fields of the multi for MULTI_STRUCT, with the checksum as it is."""
+        if self._effect is None and self._common is None and self._sections is None:
+            return (self.checksum,) + self._fields[1:]  # nothing has been decoded, so nothing has changed
+        e, c = self.effect, self.common
+        r = e.reverb
+        fields = [self.checksum, e.algorithm, r.reverb_type, r.dry_wet1, r.dry_wet2, r.param2, r.param3, r.param4]
+        for effect in [e.effect1, e.effect2, e.effect3, e.effect4]:
+            fields.extend((effect.effect_type, effect.dry_wet, effect.param1, effect.param2, effect.param3, effect.param4))
+        fields.extend(e.geq)
+        fields.extend((get_name_data(c.name), c.volume, get_mute_byte(c.mutes) | c.mute_bits,
+            c.control1.source, c.control1.destination, c.control1.depth,
+            c.control2.source, c.control2.destination, c.control2.depth))
         for s in self.sections:
-            data.extend(s.as_data())
-
-        checksum = get_checksum(data)
-        data.insert(0, checksum)
+            fields.extend(s.as_fields())
+        return tuple(fields)
 
+    def as_data(self) -> bytes:
+        fields = self.get_fields()
+        data = bytearray(MULTI_STRUCT.pack(*fields))
+        if self._fields is None or fields[1:] != self._fields[1:]:
+            data[0] = get_checksum(data[1:])
         return bytes(data)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MultiPatch):
+            return NotImplemented
+        return (self.checksum, self.effect, self.common, self.sections) == (other.checksum, other.effect, other.common, other.sections)
+
+    def __repr__(self) -> str:
+        return f'MultiPatch(checksum={self.checksum!r}, effect={self.effect!r}, common={self.common!r}, sections={self.sections!r})'
+
+class MultiBank:
+    """The multis of a .KCA bank (or any run of multis) as columns over one buffer.
+
+    The columns are strided views into the buffer, with one row per multi: NumPy arrays
+    if NumPy is installed, otherwise lists (of tuples for the per-section columns).
+    """
+
+    def __init__(self, data: bytes):
+        count = len(data) // MULTI_DATA_SIZE
+        self.data = memoryview(data)[:count * MULTI_DATA_SIZE]
+        self.count = count
+        self.rows = np.frombuffer(self.data, dtype=np.uint8).reshape(count, MULTI_DATA_SIZE) if np is not None else None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> MultiPatch:
+        return MultiPatch.from_data(self.data[index * MULTI_DATA_SIZE : (index + 1) * MULTI_DATA_SIZE])
+
+    def get_fields(self) -> list[tuple]:
+        """Unpack all the multis into tuples of MULTI_STRUCT fields, without making any objects.
+        This is much faster than getting the MultiPatch objects, when only the values are needed."""
+        return list(MULTI_STRUCT.iter_unpack(self.data))
+
+    def get_multis(self) -> list[MultiPatch]:
+        return [MultiPatch.from_fields(fields) for fields in MULTI_STRUCT.iter_unpack(self.data)]
+
+    def column(self, offset: int):
+        """Get the byte at offset in each multi."""
+        if self.rows is not None:
+            return self.rows[:, offset]
+        return self.data[offset::MULTI_DATA_SIZE].tolist()
+
+    def section_column(self, offset: int):
+        """Get the byte at offset in each section of each multi, as a (count, 4) column."""
+        start = SECTION_OFFSET + offset
+        if self.rows is not None:
+            return self.rows[:, start : start + SECTION_COUNT * SECTION_DATA_SIZE : SECTION_DATA_SIZE]
+        return list(zip(*(self.column(start + i * SECTION_DATA_SIZE) for i in range(SECTION_COUNT))))
+
+    @property
+    def names(self) -> list[str]:
+        return [get_name(self.data[i * MULTI_DATA_SIZE : (i + 1) * MULTI_DATA_SIZE]) for i in range(self.count)]
+
+    @property
+    def checksum(self):
+        return self.column(0)
+
+    @property
+    def algorithm(self):
+        return self.column(ALGORITHM_OFFSET)
+
+    @property
+    def effect_type(self):
+        """The reverb type and the types of the four effects, as a (count, 5) column."""
+        offsets = [REVERB_TYPE_OFFSET] + EFFECT_TYPE_OFFSETS
+        if self.rows is not None:
+            return self.rows[:, offsets]
+        return list(zip(*(self.column(offset) for offset in offsets)))
+
+    @property
+    def common_volume(self):
+        return self.column(VOLUME_OFFSET)
+
+    @property
+    def mutes(self):
+        """The mute flag of each section, as a (count, 4) column."""
+        if self.rows is not None:
+            return (self.rows[:, [MUTE_OFFSET]] & (1 << np.arange(SECTION_COUNT))) == 0
+        return [MUTES[b & 0x0f] for b in self.column(MUTE_OFFSET)]
+
+    @property
+    def instrument(self):
+        """The instrument (single number) of each section, as a (count, 4) column."""
+        if self.rows is not None:
+            return (self.section_column(0).astype(np.int32) << 7) | self.section_column(1)
+        return [tuple((msb << 7) | lsb for msb, lsb in zip(m, l))
+            for m, l in zip(self.section_column(0), self.section_column(1))]
+
+    @property
+    def volume(self):
+        return self.section_column(2)
+
+    @property
+    def zone(self):
+        """The low and high key of each section, as a (count, 4, 2) column."""
+        if self.rows is not None:
+            return np.stack([self.section_column(7), self.section_column(8)], axis=2)
+        return [tuple(zip(low, high)) for low, high in zip(self.section_column(7), self.section_column(8))]
+
+    @property
+    def receive_channel(self):
+        return self.section_column(11)
+
+    def get_section_refs(self) -> list[list[tuple[bool, int]]]:
+        """Get the mute flag and the instrument of each section of each multi, like get_section_refs."""
+        mutes, instruments = self.mutes, self.instrument
+        if self.rows is not None:
+            mutes, instruments = mutes.tolist(), instruments.tolist()
+        return [list(zip(m, i)) for m, i in zip(mutes, instruments)]
+
+    def find_reverb_type(self, reverb_type: int) -> list[int]:
+        """Get the indexes of the multis that use the given reverb type."""
+        if self.rows is not None:
+            return np.flatnonzero(self.column(REVERB_TYPE_OFFSET) == reverb_type).tolist()
+        return [i for i, t in enumerate(self.column(REVERB_TYPE_OFFSET)) if t == reverb_type]
+
+    def find_instrument(self, instrument: int) -> list[int]:
+        """Get the indexes of the multis that have an active section playing the given single."""
+        if self.rows is not None:
+            return np.flatnonzero(((self.instrument == instrument) & ~self.mutes).any(axis=1)).tolist()
+        return [i for i, (instruments, mutes) in enumerate(zip(self.instrument, self.mutes))
+            if any(ins == instrument and not mute for ins, mute in zip(instruments, mutes))]
+
+    def get_instrument_counts(self) -> dict[int, int]:
+        """Count how many active sections play each single."""
+        if self.rows is not None:
+            values, counts = np.unique(self.instrument[~self.mutes], return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        counts = {}
+        for instruments, mutes in zip(self.instrument, self.mutes):
+            for ins, mute in zip(instruments, mutes):
+                if not mute:
+                    counts[ins] = counts.get(ins, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def get_effect_type_counts(self, column: int = 0) -> dict[int, int]:
+        """Count how many multis use each reverb type (column 0) or effect type (columns 1...4)."""
+        if self.rows is not None:
+            values, counts = np.unique(self.effect_type[:, column], return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        counts = {}
+        for types in self.effect_type:
+            counts[types[column]] = counts.get(types[column], 0) + 1
+        return dict(sorted(counts.items()))
+
+    def get_zone_histogram(self, bin_size: int = 12) -> list[int]:
+        """Count the active sections whose key zone covers each range of bin_size keys."""
+        bin_count = (128 + bin_size - 1) // bin_size
+        if self.rows is not None:
+            zones = self.zone[~self.mutes]
+            starts = np.arange(bin_count) * bin_size
+            covered = (zones[:, [0]] < starts + bin_size) & (zones[:, [1]] >= starts)
+            return covered.sum(axis=0).tolist()
+        histogram = [0] * bin_count
+        for zones, mutes in zip(self.zone, self.mutes):
+            for (low, high), mute in zip(zones, mutes):
+                if not mute:
+                    for n in range(bin_count):
+                        if low < (n + 1) * bin_size and high >= n * bin_size:
+                            histogram[n] += 1
+        return histogram
@@ -0,0 +1,155 @@
+# Index and search the names of single and multi patches in a library
+
+import sys
+import os
+import time
+import difflib
+import argparse
+
+import bank
+import cache
+import dedup
+import fileindex
+import helpers
+import multi
+import sysex
+
+EXTENSIONS = ['kaa', 'ka1', 'kca', 'kc1', 'syx']
+
+def get_trigrams(s: str) -> set[str]:
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
+def normalize(name: str) -> str:
+    return name.rstrip(' \x7f\x00').lower()
+
+def get_file_names(filename: str) -> list[tuple[str, str]]:
+    """Get the (slot, name) of every single and multi patch in a file."""
+    names = []
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    if extension == 'kaa':
+        with cache.open_bank(filename) as bank_data:
+            names.extend((f'{p.index + 1:03}', p.name) for p in bank_data.patches)
+    elif extension in ['kca', 'kc1']:
+        names.extend((f'M{number:02}', m['name']) for number, m in enumerate(cache.get_multis(filename), start=1))
+    elif extension == 'ka1':
+        data = helpers.read_file_data(filename)
+        if bank.check_single_size(len(data)):
+            names.append(('', dedup.get_patch_name(data)))
+    elif extension == 'syx':
+        for offset, message in sysex.read_messages(filename):
+            names.extend((slot, dedup.get_patch_name(patch_data)) for slot, patch_data in sysex.get_singles(message))
+            names.extend((slot, multi.get_name(patch_data)) for slot, patch_data in sysex.get_multis(message))
+    return names
+
+class NameIndex(fileindex.FileIndex):
+    """Patch names with trigram postings, stored in an SQLite database.
+
+    The postings point to the distinct normalized names (keys), since the same
+    names occur many times in a library.
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS names (path TEXT, slot TEXT, name TEXT, key TEXT);
+            CREATE TABLE IF NOT EXISTS keys (id INTEGER PRIMARY KEY, key TEXT UNIQUE);
+            CREATE TABLE IF NOT EXISTS trigrams (trigram TEXT, key_id INTEGER, PRIMARY KEY (trigram, key_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS names_path ON names (path);
+            CREATE INDEX IF NOT EXISTS names_key ON names (key);
+        ''')
+
+    def remove_file(self, path: str) -> None:
+        keys = self.db.execute('SELECT DISTINCT key FROM names WHERE path = ?', (path,)).fetchall()
+        self.db.execute('DELETE FROM names WHERE path = ?', (path,))
+        # Forget the names that no other file has, so that they don't match any more
+        for (key,) in keys:
+            if self.db.execute('SELECT 1 FROM names WHERE key = ? LIMIT 1', (key,)).fetchone() is not None:
+                continue
+            row = self.db.execute('SELECT id FROM keys WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.db.executemany('DELETE FROM trigrams WHERE trigram = ? AND key_id = ?',
+                    ((t, row[0]) for t in get_trigrams(f'  {key} ')))
+                self.db.execute('DELETE FROM keys WHERE id = ?', row)
+        super().remove_file(path)
+
+    def add_file(self, path: str) -> None:
+        for slot, name in get_file_names(path):
+            key = normalize(name)
+            self.db.execute('INSERT INTO names VALUES (?, ?, ?, ?)', (path, slot, name, key))
+            cursor = self.db.execute('INSERT OR IGNORE INTO keys (key) VALUES (?)', (key,))
+            if cursor.rowcount == 1:
+                # Pad with spaces so that the start and end of the name get trigrams of their own
+                self.db.executemany('INSERT INTO trigrams VALUES (?, ?)',
+                    ((t, cursor.lastrowid) for t in get_trigrams(f'  {key} ')))
+
+    def get_name_count(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM names').fetchone()[0]
+
+    def find_substring(self, query: str, limit: int = 100) -> list[tuple[str, str, str]]:
+        """Find the names containing query (case-insensitive). Returns (path, slot, name) tuples."""
+        key = normalize(query)
+        trigrams = get_trigrams(key)
+        if not trigrams:
+            # Too short for trigrams, so check all the distinct names
+            rows = self.db.execute('''SELECT path, slot, name FROM names WHERE key IN
+                (SELECT key FROM keys WHERE instr(key, ?) > 0) ORDER BY key, path, slot LIMIT ?''', (key, limit))
+            return rows.fetchall()
+        marks = ','.join('?' * len(trigrams))
+        rows = self.db.execute(f'''SELECT path, slot, name FROM names WHERE key IN
+            (SELECT key FROM keys WHERE instr(key, ?) > 0 AND id IN
+                (SELECT key_id FROM trigrams WHERE trigram IN ({marks}) GROUP BY key_id HAVING COUNT(*) = ?))
+            ORDER BY key, path, slot LIMIT ?''', (key, *trigrams, len(trigrams), limit))
+        return rows.fetchall()
+
+    def find_prefix(self, query: str, limit: int = 100) -> list[tuple[str, str, str]]:
+        key = normalize(query)
+        rows = self.db.execute('SELECT path, slot, name FROM names WHERE key >= ? AND key < ? ORDER BY key, path, slot LIMIT ?',
+            (key, key + '\U0010ffff', limit))
+        return rows.fetchall()
+
+    def find_similar(self, query: str, limit: int = 20) -> list[tuple[float, str, str, str]]:
+        """Find the names most similar to query. Returns (score, path, slot, name) tuples, best first."""
+        key = normalize(query)
+        trigrams = get_trigrams(f'  {key} ')
+        marks = ','.join('?' * len(trigrams))
+        # Rank the distinct names by the number of shared trigrams first, then compare them properly
+        candidates = self.db.execute(f'''SELECT key, COUNT(*) AS shared FROM trigrams JOIN keys ON keys.id = trigrams.key_id
+            WHERE trigram IN ({marks}) AND EXISTS (SELECT 1 FROM names WHERE names.key = keys.key)
+            GROUP BY key ORDER BY shared DESC LIMIT ?''',
+            (*trigrams, limit * 10)).fetchall()
+        scored = sorted(((difflib.SequenceMatcher(None, key, k).ratio(), k) for k, _ in candidates), reverse=True)[:limit]
+        results = []
+        for score, k in scored:
+            for path, slot, name in self.db.execute('SELECT path, slot, name FROM names WHERE key = ? ORDER BY path, slot', (k,)):
+                results.append((score, path, slot, name))
+        return results[:limit]
+
+def format_location(path: str, slot: str) -> str:
+    return f'{path} {slot}' if slot else path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index and search the names of Kawai K5000 patches')
+    parser.add_argument(dest='query', metavar='query', nargs='?', help='Name or part of name to search for')
+    parser.add_argument('-i', dest='index', action='store', default='k5knames.sqlite', help='Index file (default k5knames.sqlite)')
+    parser.add_argument('-u', dest='update', action='append', default=[], metavar='path', help='Add or update files, directories or glob patterns in the index')
+    parser.add_argument('-p', dest='prefix', action='store_true', help='Find names starting with the query')
+    parser.add_argument('-z', dest='fuzzy', action='store_true', help='Find names similar to the query')
+    parser.add_argument('-n', type=int, dest='limit', action='store', default=100, help='Maximum number of results')
+    args = parser.parse_args()
+
+    index = NameIndex(args.index)
+    if args.update:
+        indexed, removed = index.update(helpers.expand_paths(args.update, EXTENSIONS))
+        print(f'Indexed {indexed} new or changed files, removed {removed} missing files, {index.get_name_count()} names in total')
+
+    if args.query is not None:
+        start_time = time.perf_counter()
+        if args.fuzzy:
+            for score, path, slot, name in index.find_similar(args.query, args.limit):
+                print(f'{score:.2f}  {name:8}  {format_location(path, slot)}')
+        else:
+            results = index.find_prefix(args.query, args.limit) if args.prefix else index.find_substring(args.query, args.limit)
+            for path, slot, name in results:
+                print(f'{name:8}  {format_location(path, slot)}')
+        print(f'Search took {1000 * (time.perf_counter() - start_time):.1f} ms', file=sys.stderr)
+    index.close()
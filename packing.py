@@ -0,0 +1,262 @@
+# Choose which single patches to put into .KAA banks
+#
+# A bank can hold at most MAX_PATCH_COUNT patches, and their total size must fit
+# in POOL_SIZE bytes, so picking the best subset of candidates for a bank is
+# a knapsack problem with two constraints.
+
+import sys
+import os
+import csv
+import struct
+import time
+import math
+import argparse
+from dataclasses import dataclass
+
+import archive
+import bank
+import helpers
+
+@dataclass
+class Candidate:
+    key: str
+    size: int
+    weight: float = 1.0
+
+def greedy_select(candidates: list[Candidate], capacity: int = bank.POOL_SIZE,
+                  max_count: int = bank.MAX_PATCH_COUNT, key=None) -> list[Candidate]:
+    """Pick candidates in order of key (weight per byte by default) while they fit."""
+    if key is None:
+        key = lambda c: (-c.weight / c.size, c.size)
+    selected = []
+    for c in sorted(candidates, key=key):
+        if len(selected) == max_count:
+            break
+        if c.size <= capacity:
+            selected.append(c)
+            capacity -= c.size
+    return selected
+
+def _get_multipliers(items: list[Candidate], capacity: int, max_count: int) -> tuple[float, float]:
+    """Find multipliers for the size and count constraints that give a tight upper
+    bound in the Lagrangian relaxation of the problem, by alternately minimizing
+    the bound over one of them while keeping the other fixed."""
+    lam, mu = 0.0, 0.0
+    for _ in range(20):
+        # With mu fixed, the best lambda is the ratio where the capacity runs out
+        ratios = sorted(((c.weight - mu) / c.size, c.size) for c in items if c.weight > mu)
+        lam = 0.0
+        used = 0
+        for ratio, size in reversed(ratios):
+            used += size
+            if used > capacity:
+                lam = ratio
+                break
+        # With lambda fixed, the best mu is the reduced weight of the item after the first max_count
+        reduced = sorted((c.weight - lam * c.size for c in items), reverse=True)
+        new_mu = max(0.0, reduced[max_count]) if len(reduced) > max_count else 0.0
+        if abs(new_mu - mu) < 1e-12:
+            break
+        mu = new_mu
+    return lam, mu
+
+def select_patches(candidates: list[Candidate], capacity: int = bank.POOL_SIZE,
+                   max_count: int = bank.MAX_PATCH_COUNT, time_limit: float = 0.5) -> tuple[list[Candidate], bool]:
+    """Pick the subset of candidates with the largest total weight that fits in one bank.
+
+    Uses branch and bound, starting from the greedy solution. If the search does not
+    finish within time_limit seconds, the best subset found so far is returned.
+    Returns the subset and a flag telling if it is known to be optimal.
+    """
+    items = [c for c in candidates if c.size <= capacity]
+    if not items:
+        return [], True
+
+    # Any multipliers give a valid upper bound: lam * capacity + mu * count plus
+    # the sum of the reduced weights over the items still to decide.
+    lam, mu = _get_multipliers(items, capacity, max_count)
+    reduced_weight = lambda c: (-(c.weight - lam * c.size - mu), c.size)
+    items.sort(key=reduced_weight)
+    n = len(items)
+    sizes = [c.size for c in items]
+    weights = [c.weight for c in items]
+    reduced = [0.0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        reduced[i] = reduced[i + 1] + max(0.0, weights[i] - lam * sizes[i] - mu)
+
+    # Start from the best of a few greedy solutions
+    greedy = max((greedy_select(items, capacity, max_count, key) for key in
+        [None, reduced_weight, lambda c: (-c.weight, c.size)]), key=lambda s: sum(c.weight for c in s))
+    best_value = sum(c.weight for c in greedy)
+    best_chosen = None
+    epsilon = 1e-6
+    # With whole number weights, the bound can be rounded down
+    integral = all(float(w).is_integer() for w in weights)
+
+    deadline = time.perf_counter() + time_limit
+    nodes = 0
+    finished = True
+    # Each stack entry is (next item, capacity left, count left, value so far, chosen items).
+    # The chosen items are a linked list of (item, rest) tuples so that they can be shared.
+    stack = [(0, capacity, max_count, 0.0, None)]
+    while stack:
+        nodes += 1
+        if nodes % 4096 == 0 and time.perf_counter() > deadline:
+            finished = False
+            break
+        i, cap, count, value, chosen = stack.pop()
+        if value > best_value + epsilon:
+            best_value, best_chosen = value, chosen
+        if i == n or count == 0:
+            continue
+        bound = value + lam * cap + mu * count + reduced[i]
+        if integral:
+            bound = math.floor(bound + epsilon)
+        if bound <= best_value + epsilon:
+            continue
+        stack.append((i + 1, cap, count, value, chosen))  # without item i
+        if sizes[i] <= cap:
+            stack.append((i + 1, cap - sizes[i], count - 1, value + weights[i], (i, chosen)))  # with item i, tried first
+
+    if best_chosen is None:
+        return greedy, finished
+    selected = []
+    while best_chosen is not None:
+        i, best_chosen = best_chosen
+        selected.append(items[i])
+    selected.reverse()
+    return selected, finished
+
+def _first_fit_decreasing(candidates: list[Candidate], capacity: int, max_count: int) -> list[list[Candidate]]:
+    banks = []
+    free = []  # bytes left in each bank
+    for c in sorted(candidates, key=lambda c: -c.size):
+        for b, left in enumerate(free):
+            if c.size <= left and len(banks[b]) < max_count:
+                banks[b].append(c)
+                free[b] -= c.size
+                break
+        else:
+            banks.append([c])
+            free.append(capacity - c.size)
+    return banks
+
+def _fill_banks(candidates: list[Candidate], capacity: int, max_count: int, time_limit: float) -> list[list[Candidate]]:
+    # Fill one bank at a time, using up as much of both the pool and the patch slots as possible.
+    # Each bank gets an equal share of the time left, and when the time runs out,
+    # the rest of the candidates are put into banks with first fit decreasing.
+    deadline = time.perf_counter() + time_limit
+    remaining = {id(c): c for c in candidates}
+    banks = []
+    while remaining:
+        originals = list(remaining.values())
+        time_left = deadline - time.perf_counter()
+        if time_left <= 0:
+            return banks + _first_fit_decreasing(originals, capacity, max_count)
+        usage = [Candidate(c.key, c.size, c.size / capacity + 1 / max_count) for c in originals]
+        bank_time = time_left / get_min_bank_count(originals, capacity, max_count)
+        selected, _ = select_patches(usage, capacity, max_count, bank_time)
+        chosen = {id(u) for u in selected}
+        banks.append([c for c, u in zip(originals, usage) if id(u) in chosen])
+        for c in banks[-1]:
+            del remaining[id(c)]
+    return banks
+
+def split_into_banks(candidates: list[Candidate], capacity: int = bank.POOL_SIZE,
+                     max_count: int = bank.MAX_PATCH_COUNT, time_limit: float = 0.5) -> list[list[Candidate]]:
+    """Distribute all the candidates into as few banks as possible.
+
+    Tries first fit decreasing, and filling one bank at a time with the knapsack
+    search (within time_limit seconds for all the banks), and returns the one with fewer banks.
+    """
+    for c in candidates:
+        if c.size > capacity:
+            raise ValueError(f'"{c.key}" does not fit in a bank ({c.size} bytes)')
+    lower_bound = get_min_bank_count(candidates, capacity, max_count)
+    banks = _first_fit_decreasing(candidates, capacity, max_count)
+    if len(banks) > lower_bound:
+        filled = _fill_banks(candidates, capacity, max_count, time_limit)
+        if len(filled) < len(banks):
+            banks = filled
+    return banks
+
+def get_min_bank_count(candidates: list[Candidate], capacity: int = bank.POOL_SIZE,
+                       max_count: int = bank.MAX_PATCH_COUNT) -> int:
+    """Get a lower bound for the number of banks needed for all the candidates."""
+    total = sum(c.size for c in candidates)
+    return max(math.ceil(total / capacity), math.ceil(len(candidates) / max_count))
+
+def read_weights(filename: str) -> dict[str, float]:
+    """Read patch priorities from a CSV file with filename and weight columns."""
+    weights = {}
+    with open(filename, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2:
+                try:
+                    weights[os.path.basename(row[0]).lower()] = float(row[1])
+                except ValueError:
+                    pass  # probably a header row
+    return weights
+
+def write_banks(banks: list[list[Candidate]], out_dir: str) -> int:
+    """Write the banks into out_dir as BANK001.KAA and so on. A bank that can't be made
+    or written is reported and skipped. Returns the number of banks that failed."""
+    failed_count = 0
+    for number, candidates in enumerate(banks, start=1):
+        out_filename = os.path.join(out_dir, f'BANK{number:03}.KAA')
+        try:
+            patches = [bank.make_single_patch(index, archive.read_data(c.key)) for index, c in enumerate(candidates)]
+            data = bank.write_bank(patches)
+            os.makedirs(out_dir, exist_ok=True)
+            print(f'Writing {len(patches)} patches to "{out_filename}"')
+            helpers.write_file_atomic(out_filename, [data])
+        except OSError as e:
+            failed_count += 1
+            print(f'Unable to write "{out_filename}": {e.strerror or e}', file=sys.stderr)
+        except (ValueError, IndexError, struct.error) as e:
+            failed_count += 1
+            print(f'Unable to write "{out_filename}": {e}', file=sys.stderr)
+    return failed_count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Choose Kawai K5000 .KA1 files to pack into .KAA banks')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='.KA1 files, directories or glob patterns')
+    parser.add_argument('-w', dest='weights', action='store', help='CSV file with filename and priority weight columns')
+    parser.add_argument('--split', dest='split', action='store_true', help='Put all the files into as few banks as possible')
+    parser.add_argument('-t', type=float, dest='time_limit', action='store', default=0.5,
+        help='Time limit for the search in seconds (for all the banks together with --split)')
+    parser.add_argument('-o', dest='outdir', action='store', help='Write the banks into this directory')
+    args = parser.parse_args()
+
+    weights = read_weights(args.weights) if args.weights is not None else {}
+    candidates = []
+    for filename in helpers.expand_paths(args.filenames, ['ka1']):
+        size = os.path.getsize(filename)
+        if not bank.check_single_size(size):
+            print(f'Skipping "{filename}", size does not appear to be valid (was {size} bytes)')
+            continue
+        candidates.append(Candidate(filename, size, weights.get(os.path.basename(filename).lower(), 1.0)))
+    print(f'{len(candidates)} candidates, {sum(c.size for c in candidates)} bytes')
+
+    if args.split:
+        start_time = time.perf_counter()
+        banks = split_into_banks(candidates, time_limit=args.time_limit)
+        elapsed = time.perf_counter() - start_time
+        print(f'Split into {len(banks)} banks (at least {get_min_bank_count(candidates)} needed) in {elapsed:.3f} seconds')
+    else:
+        start_time = time.perf_counter()
+        selected, optimal = select_patches(candidates, time_limit=args.time_limit)
+        elapsed = time.perf_counter() - start_time
+        print(f'Selected {len(selected)} patches with total weight {sum(c.weight for c in selected):g} in {elapsed:.3f} seconds',
+            '(optimal)' if optimal else '(best found within the time limit)')
+        banks = [selected]
+
+    for number, candidates in enumerate(banks, start=1):
+        used = sum(c.size for c in candidates)
+        print(f'Bank {number}: {len(candidates)} patches, {used} bytes ({bank.POOL_SIZE - used} free)')
+        for c in candidates:
+            print(f'    {c.key}  {c.size:>4}  {c.weight:g}')
+
+    if args.outdir is not None:
+        failed_count = write_banks(banks, args.outdir)
+        sys.exit(1 if failed_count else 0)
@@ -0,0 +1,179 @@
+# Convert many Kawai K5000 files with the reading, converting and writing overlapped
+#
+# Does the same conversions as convert.py, in three stages connected by bounded queues:
+# files are read on a thread pool driven by asyncio, converted by a pool of worker
+# processes, and written on the thread pool again. A stage that falls behind holds back
+# the stages before it, so only a limited number of files are in memory at a time.
+# This helps most when the files are on network storage, where reads and writes spend
+# most of their time waiting. Use --sequential to compare with one file at a time.
+
+import sys
+import os
+import time
+import asyncio
+import argparse
+import functools
+import concurrent.futures
+import struct
+import typing
+
+import archive
+import bank
+import convert
+import helpers
+import sysex
+
+DEFAULT_IO_LIMIT = 16  # files read or written at the same time
+
+def convert_data(job: tuple[str, str, str], data: bytes, options: dict) -> dict:
+    """Convert the data of a file read by the pipeline, in a worker process.
+    Returns the filename, the output filenames and data, and the input size or an error."""
+    filename, out_dir, _ = job
+    result = {'filename': filename, 'size': len(data), 'files': []}
+    try:
+        for name, parts in convert.get_outputs(filename, options, data):
+            # Join the pieces here, since they may be views into data, which can't be sent back
+            result['files'].append((os.path.join(out_dir, name), b''.join(parts)))
+    except (ValueError, IndexError, UnicodeDecodeError, struct.error) as e:
+        result['error'] = str(e)
+    return result
+
+def write_files(files: list[tuple[str, bytes]]) -> None:
+    for out_filename, data in files:
+        os.makedirs(os.path.dirname(out_filename) or '.', exist_ok=True)
+        helpers.write_file_atomic(out_filename, [data])
+
+class Pipeline:
+    """Reads, converts and writes files, each stage with a bounded queue of work before it.
+
+    io_limit files are read and written at the same time, and jobs processes convert them.
+    The results come out in the order the files are finished, not in the order of the jobs.
+    """
+
+    def __init__(self, options: dict, jobs: int, io_limit: int = DEFAULT_IO_LIMIT, queue_size: int = None):
+        self.options = options
+        self.jobs = jobs
+        self.io_limit = io_limit
+        self.queue_size = queue_size or 2 * max(io_limit, jobs)
+
+    async def read(self, pending: list, read_queue: asyncio.Queue, write_queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while pending:
+            job = pending.pop()
+            try:
+                data = await loop.run_in_executor(self.io_executor, archive.read_data, job[0])
+            except OSError as e:
+                await write_queue.put({'filename': job[0], 'size': 0, 'files': [], 'error': e.strerror or str(e)})
+                continue
+            await read_queue.put((job, data))  # waits while the converters are behind
+
+    async def convert(self, read_queue: asyncio.Queue, write_queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while (item := await read_queue.get()) is not None:
+            job, data = item
+            result = await loop.run_in_executor(self.process_executor, convert_data, job, data, self.options)
+            await write_queue.put(result)  # waits while the writers are behind
+
+    async def write(self, write_queue: asyncio.Queue, results: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while (result := await write_queue.get()) is not None:
+            result['outputs'] = [out_filename for out_filename, data in result['files']]
+            result['written'] = sum(len(data) for out_filename, data in result['files'])
+            if 'error' not in result:
+                try:
+                    await loop.run_in_executor(self.io_executor, write_files, result['files'])
+                except OSError as e:
+                    result['error'] = e.strerror or str(e)
+            del result['files']
+            await results.put(result)
+
+    async def run(self, jobs: list[tuple[str, str, str]]) -> typing.AsyncIterator[dict]:
+        """Convert the files of the jobs, yielding a result like convert.convert_file for each."""
+        read_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+        results = asyncio.Queue()
+        pending = list(reversed(jobs))  # taken from the end, so in order
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.io_limit) as self.io_executor, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as self.process_executor:
+            readers = [asyncio.create_task(self.read(pending, read_queue, write_queue)) for _ in range(self.io_limit)]
+            converters = [asyncio.create_task(self.convert(read_queue, write_queue)) for _ in range(self.jobs)]
+            writers = [asyncio.create_task(self.write(write_queue, results)) for _ in range(self.io_limit)]
+
+            async def finish() -> None:
+                # Each stage is done when the one before it is, and has stopped all of its tasks
+                try:
+                    await asyncio.gather(*readers)
+                    for _ in converters:
+                        await read_queue.put(None)
+                    await asyncio.gather(*converters)
+                    for _ in writers:
+                        await write_queue.put(None)
+                    await asyncio.gather(*writers)
+                finally:
+                    await results.put(None)  # and if something failed, the error comes from awaiting this
+
+            finisher = asyncio.create_task(finish())
+            while (result := await results.get()) is not None:
+                yield result
+            await finisher
+
+async def run_pipeline(pipeline: Pipeline, jobs: list[tuple[str, str, str]], report: typing.Callable[[dict], None]) -> None:
+    async for result in pipeline.run(jobs):
+        report(result)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Kawai K5000 native files to System Exclusive format and back, '
+        'overlapping reading, converting and writing')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='Files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-o', dest='out_dir', action='store', required=True, help='Output directory')
+    parser.add_argument('-c', type=int, dest='channel', action='store', default=1, help='MIDI channel (1...16)')
+    parser.add_argument('-b', dest='bank_id', action='store', default='A', help='Bank identifier for .KAA and .KA1 files (A, B, D, E, F)')
+    parser.add_argument('-n', type=int, dest='number', action='store', default=1,
+        help='Tone number for .KA1 files (1...128), or multi number for .KC1 files (1...64)')
+    parser.add_argument('-j', type=int, dest='jobs', action='store', default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--io', type=int, dest='io_limit', action='store', default=DEFAULT_IO_LIMIT,
+        help=f'Number of files read or written at the same time (default {DEFAULT_IO_LIMIT})')
+    parser.add_argument('--queue', type=int, dest='queue_size', action='store',
+        help='Number of files waiting between the stages (default twice the larger of -j and --io)')
+    parser.add_argument('--sequential', dest='sequential', action='store_true',
+        help='Read, convert and write one file at a time, for comparison')
+    args = parser.parse_args()
+
+    if args.channel < 1 or args.channel > 16:
+        print(f'MIDI channel must be between 1 and 16 (was {args.channel})')
+        sys.exit(-1)
+    bank_id = args.bank_id.upper()
+    if bank_id not in sysex.BANK_IDS:
+        print(f'Bank name must be A, B, D, E or F (was {bank_id})')
+        sys.exit(-1)
+    if args.number < 1 or args.number > bank.MAX_PATCH_COUNT:
+        print(f'Number must be between 1 and {bank.MAX_PATCH_COUNT} (was {args.number})')
+        sys.exit(-1)
+
+    options = {'channel': args.channel, 'bank_id': bank_id, 'number': args.number}
+    start_time = time.perf_counter()
+    jobs = convert.get_jobs(args.filenames, args.out_dir)
+
+    totals = {'files': 0, 'failed': 0, 'size': 0, 'written': 0}
+    def report(result: dict) -> None:
+        print(convert.format_status(result))
+        totals['files'] += 1
+        totals['size'] += result['size']
+        totals['written'] += result['written']
+        if 'error' in result:
+            totals['failed'] += 1
+
+    if args.sequential:
+        for result in map(functools.partial(convert.convert_file, options=options), jobs):
+            report(result)
+    else:
+        pipeline = Pipeline(options, max(1, args.jobs or 1), max(1, args.io_limit), args.queue_size)
+        asyncio.run(run_pipeline(pipeline, jobs, report))
+
+    seconds = time.perf_counter() - start_time
+    file_count, failed_count = totals['files'], totals['failed']
+    print(f'Converted {file_count - failed_count} of {file_count} files, {failed_count} failed, '
+        f'in {seconds:.2f} seconds ({file_count / seconds:.0f} files/s, {totals["size"] / seconds / 1e6:.1f} MB/s read, '
+        f'{totals["written"] / seconds / 1e6:.1f} MB/s written)', file=sys.stderr)
+    sys.exit(1 if failed_count else 0)
@@ -0,0 +1,190 @@
+# Resolve the singles that multis refer to, given the banks loaded into the K5000
+#
+# A device configuration says which .KAA file is loaded into each of the banks A, B, D, E
+# and F. The singles of the banks and the section references of the multis are kept in
+# an SQLite database, so resolving any number of multis is a join, not a reparse.
+
+import sys
+import os
+import argparse
+
+import bank
+import cache
+import dedup
+import fileindex
+import helpers
+
+EXTENSIONS = ['kca', 'kc1']  # the multi files to resolve
+DEFAULT_INDEX = 'k5kresolve.sqlite'
+
+# The single number of the first patch in each bank, like in bank.get_single_name.
+# Bank G is the General MIDI bank in ROM, so it can't be loaded.
+BANK_BASES = {'A': 256, 'B': 128, 'D': 384, 'E': 512, 'F': 640}
+
+def read_config(filename: str) -> dict[str, str]:
+    """Read a device configuration with lines like "A = MyBank.kaa".
+    Relative paths are relative to the directory of the configuration file."""
+    config = {}
+    directory = os.path.dirname(os.path.abspath(filename))
+    with open(filename, 'r') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            letter, sep, path = line.partition('=')
+            letter = letter.strip().upper()
+            if not sep or letter not in BANK_BASES:
+                raise ValueError(f'{filename}, line {number}: expected a bank (A, B, D, E or F) and a filename')
+            config[letter] = os.path.join(directory, path.strip())
+    return config
+
+def parse_single_name(name: str) -> int:
+    """Get the single number from a name like A078 (the reverse of bank.get_single_name)."""
+    letter, number = name[:1].upper(), name[1:]
+    bases = dict(BANK_BASES, G=0)
+    if letter not in bases or not number.isdigit() or int(number) not in range(1, bank.MAX_PATCH_COUNT + 1):
+        raise ValueError(f'Invalid single "{name}", expected something like A078')
+    return bases[letter] + int(number) - 1
+
+class ResolveIndex(fileindex.FileIndex):
+    """The singles of banks and the section references of multis, stored in an SQLite database.
+
+    Files are only reparsed when their size or modification time has changed.
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS singles (path TEXT, slot INTEGER, name TEXT, hash TEXT, PRIMARY KEY (path, slot)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS multis (path TEXT, multi INTEGER, name TEXT, PRIMARY KEY (path, multi)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sections (path TEXT, multi INTEGER, section INTEGER, instrument INTEGER, active INTEGER,
+                PRIMARY KEY (path, multi, section)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS sections_instrument ON sections (instrument);
+            CREATE TEMP TABLE config (bank TEXT PRIMARY KEY, base INTEGER, path TEXT);
+            CREATE TEMP TABLE targets (path TEXT PRIMARY KEY);
+        ''')
+
+    def remove_file(self, path: str) -> None:
+        for table in ['singles', 'multis', 'sections']:
+            self.db.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+        super().remove_file(path)
+
+    def add_file(self, path: str) -> None:
+        extension = os.path.splitext(path)[1].lower()[1:]
+        if extension == 'kaa':
+            self.db.executemany('INSERT INTO singles VALUES (?, ?, ?, ?)',
+                ((path, int(slot) - 1, name, fingerprint.hex())
+                    for slot, fingerprint, name in dedup.get_file_patches(path)))
+        elif extension in ['kca', 'kc1']:
+            for number, m in enumerate(cache.get_multis(path), start=1):
+                self.db.execute('INSERT INTO multis VALUES (?, ?, ?)', (path, number, m['name']))
+                self.db.executemany('INSERT INTO sections VALUES (?, ?, ?, ?, ?)',
+                    ((path, number, section, instrument, not muted)
+                        for section, (muted, instrument) in enumerate(m['sections'], start=1)))
+
+    def set_config(self, config: dict[str, str]) -> None:
+        """Declare which bank files are loaded, indexing them if needed."""
+        self.update(config.values(), prune=False)
+        self.db.execute('DELETE FROM config')
+        self.db.executemany('INSERT INTO config VALUES (?, ?, ?)',
+            ((letter, BANK_BASES[letter], os.path.abspath(path)) for letter, path in config.items()))
+
+    def resolve(self, filenames: list[str]) -> list[tuple]:
+        """Resolve the active sections of the multis in the files against the current configuration.
+
+        Returns (path, multi number, multi name, section number, instrument, single name, single hash)
+        tuples. The single name and hash are None if the bank is not loaded or the slot is empty.
+        """
+        self.update(filenames, prune=False)
+        self.db.execute('DELETE FROM targets')
+        self.db.executemany('INSERT OR IGNORE INTO targets VALUES (?)', ((os.path.abspath(f),) for f in filenames))
+        rows = self.db.execute('''
+            SELECT s.path, s.multi, m.name, s.section, s.instrument, g.name, g.hash
+            FROM targets t JOIN sections s ON s.path = t.path JOIN multis m ON m.path = s.path AND m.multi = s.multi
+            LEFT JOIN config c ON s.instrument >= c.base AND s.instrument < c.base + ?
+            LEFT JOIN singles g ON g.path = c.path AND g.slot = s.instrument - c.base
+            WHERE s.active ORDER BY s.path, s.multi, s.section''', (bank.MAX_PATCH_COUNT,))
+        return rows.fetchall()
+
+    def find_users(self, instrument: int) -> list[tuple[str, int, str, int]]:
+        """Find the multis with an active section that plays the given single.
+        Returns (path, multi number, multi name, section number) tuples."""
+        rows = self.db.execute('''SELECT s.path, s.multi, m.name, s.section FROM sections s
+            JOIN multis m ON m.path = s.path AND m.multi = s.multi
+            WHERE s.instrument = ? AND s.active ORDER BY s.path, s.multi, s.section''', (instrument,))
+        return rows.fetchall()
+
+    def get_changed_slots(self, letter: str, filename: str) -> list[int]:
+        """Compare the bank loaded as the given letter with another bank file, and get
+        the single numbers of the slots whose patch would change."""
+        self.update([filename], prune=False)
+        path = os.path.abspath(filename)
+        # A slot changes if its patch is not found in the other bank in either direction
+        rows = self.db.execute('''
+            WITH old AS (SELECT slot, hash FROM singles WHERE path = (SELECT path FROM config WHERE bank = ?)),
+                new AS (SELECT slot, hash FROM singles WHERE path = ?)
+            SELECT (SELECT base FROM config WHERE bank = ?) + slot FROM (
+                SELECT slot FROM (SELECT * FROM old EXCEPT SELECT * FROM new)
+                UNION SELECT slot FROM (SELECT * FROM new EXCEPT SELECT * FROM old))
+            ORDER BY slot''', (letter, path, letter))
+        return [instrument for (instrument,) in rows.fetchall()]
+
+def format_single(instrument: int, name: str, loaded: set[str]) -> str:
+    single = bank.get_single_name(instrument)
+    if name is not None:
+        return f'{single} {name}'
+    if single[:1] in loaded:
+        return f'{single} (empty slot)'
+    return single
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the singles that Kawai K5000 multis use, given the loaded banks')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='*', help='.KCA/.KC1 files, directories or glob patterns')
+    parser.add_argument('-c', dest='config', action='store', help='Device configuration file with lines like "A = MyBank.kaa"')
+    for letter in BANK_BASES:
+        parser.add_argument(f'-{letter}', dest=f'bank_{letter}', metavar='bankfile', action='store', help=f'Bank loaded as {letter}')
+    parser.add_argument('-i', dest='index', action='store', default=DEFAULT_INDEX, help=f'Index file (default {DEFAULT_INDEX})')
+    parser.add_argument('--users', dest='single', action='store', help='List the multis that use this single (like A078)')
+    parser.add_argument('--changes', dest='changes', metavar='BANK=bankfile', action='store',
+        help='List the multis affected if the given bank was replaced by another file')
+    args = parser.parse_args()
+
+    try:
+        config = read_config(args.config) if args.config is not None else {}
+        for letter in BANK_BASES:
+            if getattr(args, f'bank_{letter}') is not None:
+                config[letter] = getattr(args, f'bank_{letter}')
+        single = parse_single_name(args.single) if args.single is not None else None
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(-1)
+
+    index = ResolveIndex(args.index)
+    index.set_config(config)
+    filenames = helpers.expand_paths(args.filenames, EXTENSIONS)
+
+    if single is not None or args.changes is not None:
+        index.update(filenames, prune=False)
+        if single is not None:
+            instruments = [single]
+        else:
+            letter, _, bank_filename = args.changes.partition('=')
+            letter = letter.strip().upper()
+            if letter not in config:
+                print(f'Bank {letter} is not in the configuration')
+                sys.exit(-1)
+            instruments = index.get_changed_slots(letter, bank_filename)
+            print(f'{len(instruments)} slots in bank {letter} would change')
+        for instrument in instruments:
+            for path, number, name, section in index.find_users(instrument):
+                print(f'{bank.get_single_name(instrument)}: {path} M{number:02} {name} section {section}')
+    else:
+        previous = None
+        for path, number, name, section, instrument, single_name, _ in index.resolve(filenames):
+            if (path, number) != previous:
+                if previous is not None:
+                    print()
+                print(f'{path} M{number:02} {name}')
+                previous = (path, number)
+            print(f'Section {section}: {format_single(instrument, single_name, set(config))}')
+    index.close()
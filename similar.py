@@ -0,0 +1,195 @@
+# Find single patches that are similar to each other, parameter by parameter
+#
+# Each single is turned into a vector of its tone common data, source data and
+# (optionally) ADD kits, and the distance between two singles is the sum of the
+# squared differences of their parameters. Requires NumPy.
+
+import sys
+import os
+import argparse
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import bank
+import helpers
+import sysex
+
+EXTENSIONS = ['kaa', 'ka1', 'syx']
+BLOCK_SIZE = 1024  # rows compared at a time
+
+# Bytes left out of the comparison: the checksum and the name
+IGNORED = [0] + list(range(bank.NAME_OFFSET, bank.NAME_OFFSET + bank.NAME_LENGTH))
+
+def get_vector_size(with_add_kits: bool = False) -> int:
+    size = bank.TONE_COMMON_DATA_SIZE + bank.MAX_SOURCE_COUNT * bank.SOURCE_DATA_SIZE
+    if with_add_kits:
+        size += bank.MAX_SOURCE_COUNT * bank.ADD_KIT_SIZE
+    return size
+
+def get_kit_offsets(add_sources: list[bool]) -> list[int]:
+    """Get the offsets of the ADD kits in single patch data without a pointer table (like
+    a .KA1 file), where the kits follow the sources in the same order as the ADD sources.
+    There is one offset for each source, None for the PCM sources."""
+    offsets = []
+    kit_offset = bank.TONE_COMMON_DATA_SIZE + len(add_sources) * bank.SOURCE_DATA_SIZE
+    for is_add in add_sources:
+        offsets.append(kit_offset if is_add else None)
+        if is_add:
+            kit_offset += bank.ADD_KIT_SIZE
+    return offsets
+
+def get_vector(data: bytes, kit_offsets: list[int], with_add_kits: bool = False):
+    """Make a parameter vector out of single patch data, with the ADD kit offsets of
+    its sources (None for PCM sources). Unused sources and ADD kits are left as zeros,
+    and the ADD kits are placed by their source."""
+    vector = np.zeros(get_vector_size(with_add_kits), dtype=np.uint8)
+    common_and_sources = bank.TONE_COMMON_DATA_SIZE + len(kit_offsets) * bank.SOURCE_DATA_SIZE
+    vector[:common_and_sources] = np.frombuffer(data, dtype=np.uint8, count=common_and_sources)
+    vector[IGNORED] = 0
+    if with_add_kits:
+        vector_offset = bank.TONE_COMMON_DATA_SIZE + bank.MAX_SOURCE_COUNT * bank.SOURCE_DATA_SIZE
+        for i, kit_offset in enumerate(kit_offsets):
+            if kit_offset is None:
+                continue
+            if kit_offset < common_and_sources or kit_offset + bank.ADD_KIT_SIZE > len(data):
+                raise ValueError(f'ADD kit of source {i + 1} is outside the patch data (at offset {kit_offset})')
+            start = vector_offset + i * bank.ADD_KIT_SIZE
+            vector[start : start + bank.ADD_KIT_SIZE] = np.frombuffer(data, dtype=np.uint8,
+                count=bank.ADD_KIT_SIZE, offset=kit_offset)
+            vector[start] = 0  # the ADD kit checksum
+    return vector
+
+def get_file_singles(filename: str) -> list[tuple[str, bytes, list[int]]]:
+    """Get the (slot, data, ADD kit offsets) of every single patch in a file. In a bank
+    the kits are found with the pointer table, like in bank.get_bank_layout."""
+    singles = []
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    if extension == 'kaa':
+        with bank.BankFile(filename) as bank_file:
+            for patch in bank_file.get_bank(verbose=False).patches:
+                kit_offsets = [ptr - patch.tone if ptr != 0 else None for ptr in patch.sources[:patch.source_count]]
+                singles.append((f'{patch.index + 1:03}', bytes(patch.data), kit_offsets))
+    elif extension == 'ka1':
+        data = helpers.read_file_data(filename)
+        if bank.check_single_size(len(data)):
+            singles.append(('', data, get_kit_offsets(bank.get_add_sources(data))))
+    elif extension == 'syx':
+        for slot, patch_data in sysex.read_singles(filename):
+            singles.append((slot, bytes(patch_data), get_kit_offsets(bank.get_add_sources(patch_data))))
+    return singles
+
+class SimilarityIndex:
+    """Parameter vectors of single patches, compared by brute force in blocks.
+
+    The vectors are kept as bytes, and a block of them at a time is converted to
+    float64 for the distances, which are computed with matrix products from the
+    squared norms of the vectors and their dot products. The sums of squares of
+    two vectors can be over 2**24, so float32 would round them.
+    """
+
+    def __init__(self, with_add_kits: bool = False):
+        if np is None:
+            raise ImportError('SimilarityIndex requires NumPy')
+        self.with_add_kits = with_add_kits
+        self.locations = []  # (path, slot, name)
+        self._rows = []
+        self.vectors = None
+        self.norms = None
+
+    def add_file(self, filename: str) -> int:
+        singles = get_file_singles(filename)
+        vectors = [get_vector(data, kit_offsets, self.with_add_kits) for slot, data, kit_offsets in singles]
+        for (slot, data, kit_offsets), vector in zip(singles, vectors):
+            name = bytes(data[bank.NAME_OFFSET : bank.NAME_OFFSET + bank.NAME_LENGTH]).decode('ascii', errors='replace')
+            self.locations.append((filename, slot, name))
+            self._rows.append(vector)
+        return len(singles)
+
+    def build(self) -> None:
+        self.vectors = np.array(self._rows, dtype=np.uint8).reshape(len(self._rows), get_vector_size(self.with_add_kits))
+        self._rows = []
+        self.norms = np.empty(len(self.vectors), dtype=np.float64)
+        for start in range(0, len(self.vectors), BLOCK_SIZE):
+            block = self._get_block(start)
+            self.norms[start : start + BLOCK_SIZE] = np.einsum('ij,ij->i', block, block)
+
+    def _get_block(self, start: int):
+        return self.vectors[start : start + BLOCK_SIZE].astype(np.float64)
+
+    def _get_block_distances(self, block, block_norms, others, other_norms):
+        distances = block_norms[:, None] + other_norms[None, :] - 2 * (block @ others.T)
+        return np.rint(distances).astype(np.int64)
+
+    def find_nearest(self, vector, count: int = 10) -> list[tuple[int, int]]:
+        """Find the patches nearest to vector. Returns (distance, row) pairs, nearest first."""
+        vector = vector.astype(np.float64)[None, :]
+        vector_norm = np.einsum('ij,ij->i', vector, vector)
+        distances = np.concatenate([self._get_block_distances(vector, vector_norm, self._get_block(start),
+            self.norms[start : start + BLOCK_SIZE])[0] for start in range(0, len(self.vectors), BLOCK_SIZE)])
+        count = min(count, len(distances))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.lexsort((nearest, distances[nearest]))]
+        return [(int(distances[i]), int(i)) for i in nearest]
+
+    def find_near_duplicates(self, max_distance: int):
+        """Generate the (distance, row, other row) of all pairs of patches within max_distance
+        of each other, comparing a block of rows against the following rows at a time."""
+        n = len(self.vectors)
+        for start in range(0, n, BLOCK_SIZE):
+            block = self._get_block(start)
+            block_norms = self.norms[start : start + BLOCK_SIZE]
+            for other_start in range(start, n, BLOCK_SIZE):
+                others = block if other_start == start else self._get_block(other_start)
+                distances = self._get_block_distances(block, block_norms, others, self.norms[other_start : other_start + BLOCK_SIZE])
+                rows, cols = np.nonzero(distances <= max_distance)
+                for r, c in zip(rows.tolist(), cols.tolist()):
+                    if start + r < other_start + c:
+                        yield int(distances[r, c]), start + r, other_start + c
+
+def format_location(location: tuple[str, str, str]) -> str:
+    path, slot, name = location
+    return f'"{name}"  {path} {slot}' if slot else f'"{name}"  {path}'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find similar Kawai K5000 single patches')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='.KAA, .KA1 and .syx files, directories or glob patterns')
+    parser.add_argument('-q', dest='query', action='store', help='Find the patches most similar to this .KA1 file')
+    parser.add_argument('-n', type=int, dest='count', action='store', default=10, help='Number of similar patches to find')
+    parser.add_argument('-d', type=int, dest='max_distance', action='store', default=64, help='Maximum distance (sum of squared differences) for near duplicates')
+    parser.add_argument('-a', dest='with_add_kits', action='store_true', help='Compare the ADD kits too')
+    args = parser.parse_args()
+
+    if np is None:
+        print('This program requires NumPy')
+        sys.exit(-1)
+
+    index = SimilarityIndex(args.with_add_kits)
+    for filename in helpers.expand_paths(args.filenames, EXTENSIONS):
+        try:
+            index.add_file(filename)
+        except (OSError, ValueError, IndexError, UnicodeDecodeError, struct.error) as e:
+            print(f'Unable to read "{filename}": {e}', file=sys.stderr)
+    if not index.locations:
+        print('No single patches found')
+        sys.exit(-1)
+    index.build()
+    print(f'{len(index.locations)} single patches')
+
+    if args.query is not None:
+        data = helpers.read_file_data(args.query)
+        if not bank.check_single_size(len(data)):
+            print(f'File size does not appear to be valid (was {len(data)} bytes)')
+            sys.exit(-1)
+        vector = get_vector(data, get_kit_offsets(bank.get_add_sources(data)), args.with_add_kits)
+        for distance, row in index.find_nearest(vector, args.count):
+            print(f'{distance:>6}  {format_location(index.locations[row])}')
+    else:
+        pair_count = 0
+        for distance, row, other in index.find_near_duplicates(args.max_distance):
+            print(f'{distance:>6}  {format_location(index.locations[row])}  ~  {format_location(index.locations[other])}')
+            pair_count += 1
+        print(f'{pair_count} pairs of near duplicates')
@@ -0,0 +1,142 @@
+# Helpers for Kawai K5000 MIDI System Exclusive messages
+
+import re
+import typing
+
+import archive
+import bank
+import multi
+import tonemap
+
+KAWAI_ID = 0x40
+ONE = 0x20  # one patch in the message
+BLOCK = 0x21  # a block of patches
+SINGLE = 0x00
+MULTI = 0x20  # combi/multi
+BANK_IDS = ['A', 'B', 'D', 'E', 'F']  # location byte values 0...4
+HEADER_SIZE = 8  # up to and including the location byte
+TONE_MAP_SIZE = tonemap.TONE_MAP_SIZE
+CHUNK_SIZE = 1 << 16  # bytes read at a time when splitting a file into messages
+MAX_MESSAGE_SIZE = 1 << 20  # longer unterminated messages are dropped (a block dump is well below this)
+
+STATUS_PATTERN = re.compile(rb'[\x80-\xff]')  # any byte that is not a data byte
+
+def get_header(channel: int, cardinality: int, kind: int, location: int = None) -> bytes:
+    """Make the header of a K5000 System Exclusive message for MIDI channel 1...16,
+    up to and including the location byte. Block combi/multi dumps have no location."""
+    header = bytes([0xF0, KAWAI_ID, channel - 1, cardinality, 0x00, 0x0A, kind])
+    return header + bytes([location]) if location is not None else header
+
+def is_sysex(data: bytes) -> bool:
+    return len(data) > 2 and data[0] == 0xf0 and data[-1] == 0xf7
+
+def is_kawai(data: bytes) -> bool:
+    return data[1] == KAWAI_ID
+
+def get_single_entries(data: bytes) -> list[tuple[str, int, int, int]]:
+    """Get the bank (like A), zero-based tone number, offset and size of the single
+    patches in a one or block single dump. Returns an empty list for other messages."""
+    if not is_sysex(data) or not is_kawai(data) or len(data) < HEADER_SIZE or data[6] != SINGLE:
+        return []
+
+    location = BANK_IDS[data[7]] if data[7] < len(BANK_IDS) else '?'
+    singles = []
+    if data[3] == ONE:
+        singles.append((location, data[HEADER_SIZE], HEADER_SIZE + 1, len(data) - HEADER_SIZE - 2))
+    elif data[3] == BLOCK:
+        offset = HEADER_SIZE + TONE_MAP_SIZE
+        for number in tonemap.iter_tones(data[HEADER_SIZE : HEADER_SIZE + TONE_MAP_SIZE]):
+            if offset + bank.TONE_COMMON_DATA_SIZE > len(data) - 1:
+                break  # truncated message
+            size = bank.get_single_size(data, offset)
+            singles.append((location, number, offset, size))
+            offset += size
+    return singles
+
+def get_single_offsets(data: bytes) -> list[tuple[str, int, int]]:
+    """Get the tone number (like A001), offset and size of the single patches
+    in a one or block single dump. Returns an empty list for other messages."""
+    return [(f'{location}{number + 1:03}', offset, size) for location, number, offset, size in get_single_entries(data)]
+
+def get_singles(data: bytes) -> list[tuple[str, memoryview]]:
+    """Get the single patches from a one or block single dump, with tone numbers like A001.
+    The patch data are views into data."""
+    view = memoryview(data)
+    return [(slot, view[offset : offset + size]) for slot, offset, size in get_single_offsets(data)]
+
+def get_multi_offsets(data: bytes) -> list[tuple[str, int]]:
+    """Get the number (like M01) and offset of the multi patches in a one or block
+    combi/multi dump. Returns an empty list for other messages."""
+    if not is_sysex(data) or not is_kawai(data) or len(data) < HEADER_SIZE or data[6] != MULTI:
+        return []
+
+    if data[3] == ONE:
+        return [(f'M{data[7] + 1:02}', HEADER_SIZE)]
+    elif data[3] == BLOCK:
+        # A block has no location byte in the header
+        start = HEADER_SIZE - 1
+        offsets = range(start, len(data) - multi.MULTI_DATA_SIZE, multi.MULTI_DATA_SIZE)
+        return [(f'M{number:02}', offset) for number, offset in enumerate(offsets, start=1)]
+    return []
+
+def get_multis(data: bytes) -> list[tuple[str, memoryview]]:
+    """Get the multi patches from a one or block combi/multi dump, with numbers like M01.
+    The patch data are views into data."""
+    view = memoryview(data)
+    return [(number, view[offset : offset + multi.MULTI_DATA_SIZE]) for number, offset in get_multi_offsets(data)]
+
+def split_messages(f: typing.BinaryIO, chunk_size: int = CHUNK_SIZE,
+        max_size: int = MAX_MESSAGE_SIZE) -> typing.Iterator[tuple[int, memoryview]]:
+    """Split a stream into System Exclusive messages, reading it chunk_size bytes at a time.
+
+    Yields the file offset and the data (from F0h to F7h) of each message. Bytes outside
+    messages, and messages interrupted by another status byte or longer than max_size, are
+    skipped. Only the current chunk and the unfinished message are kept in memory,
+    however large the file is.
+    """
+    parts = []  # the pieces of a message that continues from the previous chunks
+    size = 0
+    start = None  # file offset of the message being collected
+    offset = 0  # file offset of the chunk
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        pos = 0
+        while pos < len(chunk):
+            if start is None:
+                pos = chunk.find(0xf0, pos)
+                if pos < 0:
+                    break
+                start = offset + pos
+                parts, size = [], 0
+                pos += 1
+            begin = start - offset if start >= offset else 0
+            status = STATUS_PATTERN.search(chunk, pos)
+            if status is None:
+                parts.append(chunk[begin:])
+                size += len(chunk) - begin
+                if size > max_size:
+                    start = None
+                break
+
+            pos = status.start()
+            if chunk[pos] == 0xf7:
+                if parts:
+                    parts.append(chunk[begin : pos + 1])
+                    yield start, memoryview(b''.join(parts))
+                else:
+                    yield start, memoryview(chunk)[begin : pos + 1]
+                pos += 1
+            start = None  # done, or cut short by another status byte
+        offset += len(chunk)
+
+def read_messages(filename: str, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[tuple[int, memoryview]]:
+    """Split a .syx file (or archive member) into System Exclusive messages, see split_messages."""
+    with archive.open_file(filename) as f:
+        yield from split_messages(f, chunk_size)
+
+def read_singles(filename: str) -> typing.Iterator[tuple[str, memoryview]]:
+    """Get the single patches from all the one and block single dumps in a .syx file, see get_singles."""
+    for offset, message in read_messages(filename):
+        yield from get_singles(message)
@@ -0,0 +1,129 @@
+# Convert Kawai K5000 MIDI System Exclusive dumps back into native files
+#
+# A block single dump becomes a .KAA bank, a one single dump a .KA1 file,
+# a one combi/multi dump a .KC1 file and a block combi/multi dump a .KCA bank.
+
+import os
+import argparse
+import struct
+import typing
+
+import archive
+import bank
+import helpers
+import multi
+import sysex
+
+def decode_block_single(message: bytes) -> bytes:
+    """Make a .KAA bank from a block single dump. The patches go into the slots
+    given by the tone map, packed into the pool in the order they are in the dump."""
+    view = memoryview(message)
+    patches = [bank.make_single_patch(number, view[offset : offset + size])
+        for location, number, offset, size in sysex.get_single_entries(message)]
+    if not patches:
+        raise ValueError('No single patches in the dump')
+    return bank.write_bank(patches)
+
+def decode_one_single(message: bytes) -> memoryview:
+    """Get the data of a .KA1 file from a one single dump."""
+    data = memoryview(message)[sysex.HEADER_SIZE + 1 : -1]  # after the tone number
+    if not bank.check_single_size(len(data)):
+        raise ValueError(f'Single patch size does not appear to be valid (was {len(data)} bytes)')
+    return data
+
+def decode_one_multi(message: bytes) -> memoryview:
+    """Get the data of a .KC1 file from a one combi/multi dump."""
+    data = memoryview(message)[sysex.HEADER_SIZE : -1]
+    if not multi.check_size(len(data)):
+        raise ValueError(f'Multi patch size does not appear to be valid (was {len(data)} bytes)')
+    return data
+
+def decode_block_multi(message: bytes) -> memoryview:
+    """Get the data of a .KCA bank from a block combi/multi dump."""
+    data = memoryview(message)[sysex.HEADER_SIZE - 1 : -1]  # a block has no location byte
+    if len(data) != multi.MULTI_COUNT * multi.MULTI_DATA_SIZE:
+        raise ValueError(f'Multi bank size does not appear to be valid (was {len(data)} bytes)')
+    return data
+
+def decode_message(message: bytes) -> tuple[str, bytes]:
+    """Decode a K5000 System Exclusive message into the extension and data of a native file."""
+    if len(message) < sysex.HEADER_SIZE or not sysex.is_sysex(message) or not sysex.is_kawai(message):
+        raise ValueError('Not a System Exclusive message for Kawai')
+    cardinality, kind = message[3], message[6]
+    if kind == sysex.SINGLE:
+        if cardinality == sysex.BLOCK:
+            return 'KAA', decode_block_single(message)
+        elif cardinality == sysex.ONE:
+            return 'KA1', decode_one_single(message)
+    elif kind == sysex.MULTI:
+        if cardinality == sysex.BLOCK:
+            return 'KCA', decode_block_multi(message)
+        elif cardinality == sysex.ONE:
+            return 'KC1', decode_one_multi(message)
+    raise ValueError(f'Unsupported message (cardinality {cardinality:02X}h, kind {kind:02X}h)')
+
+def decode_messages(messages: typing.Iterable[tuple[int, bytes]], filename: str) -> tuple[list[tuple[str, bytes]], list[str]]:
+    """Decode each K5000 message of a .syx file, given as (offset, message) pairs like from
+    sysex.split_messages. Returns the (extension, data) of the native files, and lines about
+    the messages that were skipped."""
+    outputs = []
+    lines = []
+    for offset, message in messages:
+        try:
+            outputs.append(decode_message(message))
+        except (ValueError, IndexError, struct.error) as e:
+            lines.append(f'Skipping message at offset {offset} in "{filename}": {e}')
+    return outputs, lines
+
+def decode_file(filename: str) -> tuple[list[tuple[str, bytes]], list[str]]:
+    """Decode each K5000 message in a .syx file, see decode_messages."""
+    return decode_messages(sysex.read_messages(filename), filename)
+
+def get_out_names(filename: str, outputs: list[tuple[str, bytes]]) -> list[str]:
+    """Name the native files decoded from filename. If there is more than one, they are numbered."""
+    stem = os.path.splitext(archive.get_basename(filename))[0]
+    if len(outputs) == 1:
+        return [f'{stem}.{outputs[0][0]}']
+    return [f'{stem}-{number:02}.{extension}' for number, (extension, data) in enumerate(outputs, start=1)]
+
+def convert_file(job: tuple[str, str]) -> list[str]:
+    """Convert each K5000 message in a .syx file into a native file, for a (filename,
+    output directory) job. Returns the status lines."""
+    filename, out_dir = job
+    try:
+        outputs, lines = decode_file(filename)
+    except OSError as e:
+        return [f'Unable to read "{filename}": {e.strerror}']
+
+    for name, (extension, data) in zip(get_out_names(filename, outputs), outputs):
+        out_filename = os.path.join(out_dir, name)
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            helpers.write_file_atomic(out_filename, [data])
+        except OSError as e:
+            lines.append(f'Unable to write "{out_filename}": {e.strerror or e}')
+            continue
+        lines.append(f'Wrote {len(data)} bytes from "{filename}" to "{out_filename}"')
+    if not outputs and not lines:
+        lines.append(f'No K5000 patches in "{filename}"')
+    return lines
+
+def get_jobs(args: list[str], out_dir: str) -> list[tuple[str, str]]:
+    """Expand the arguments into (filename, output directory) pairs, mirroring the input tree."""
+    jobs = []
+    for arg in args:
+        root = helpers.get_root(arg)
+        for filename in helpers.expand_paths([arg], ['syx'], archives=True):
+            jobs.append((filename, helpers.get_out_dir(filename, root, out_dir)))
+    return jobs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Kawai K5000 System Exclusive files to native .KAA, .KA1, .KCA or .KC1 files')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='+', help='.syx files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-o', dest='out_dir', action='store', default='.', help='Output directory (default is the current directory)')
+    parser.add_argument('-j', type=int, dest='jobs', action='store', default=os.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    for lines in helpers.map_parallel(convert_file, get_jobs(args.filenames, args.out_dir), args.jobs):
+        for line in lines:
+            print(line)
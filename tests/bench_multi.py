@@ -0,0 +1,43 @@
+# Time decoding and encoding the multis of a .KCA bank, per multi
+#
+# Run with "python3 -m tests.bench_multi [file.kca]". Without a file, a made-up bank is used.
+
+import sys
+import random
+import timeit
+
+import helpers
+import multi
+from tests import samples
+
+def decode_baseline(data: bytes) -> multi.MultiPatch:
+    """Decode a multi like MultiPatch.from_data did before the precompiled struct:
+    part by part from slices, making every object right away."""
+    e = multi.EffectSettings.from_data(data[:39])
+    c = multi.Common.from_data(data[39:55])
+    section_data = data[55:]
+    s = [multi.Section.from_data(section_data[i : i + 12]) for i in range(0, len(section_data), 12)]
+    return multi.MultiPatch(checksum=data[0], effect=e, common=c, sections=s)
+
+def get_time(function, count: int) -> float:
+    """Get the best time of one call in microseconds, divided by count."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number / count * 1e6
+
+if __name__ == '__main__':
+    data = helpers.read_file_data(sys.argv[1]) if len(sys.argv) > 1 else samples.make_kca(random.Random(1))
+    multis = multi.MultiBank(data)
+    objects = multis.get_multis()
+    count = len(multis)
+    chunks = [bytes(multis.data[i * multi.MULTI_DATA_SIZE : (i + 1) * multi.MULTI_DATA_SIZE]) for i in range(count)]
+    baseline = get_time(lambda: [decode_baseline(chunk) for chunk in chunks], count)
+    print(f'{count} multis, microseconds per multi (and speedup over the old decoder):')
+    print(f'old decoder              {baseline:8.2f}')
+    for label, function in [('MultiPatch.from_data', lambda: [multi.MultiPatch.from_data(chunk) for chunk in chunks]),
+            ('MultiBank.get_multis', multis.get_multis), ('MultiBank.get_fields', multis.get_fields)]:
+        t = get_time(function, count)
+        print(f'{label:24} {t:8.2f}  {baseline / t:5.1f}x')
+    print(f'decode all parts         {get_time(lambda: [(m.effect, m.common, m.sections) for m in multis.get_multis()], count):8.2f}')
+    print(f'MultiBank.instrument     {get_time(lambda: multis.instrument, count):8.2f}')
+    print(f'MultiPatch.as_data       {get_time(lambda: [m.as_data() for m in objects], count):8.2f}')
@@ -0,0 +1,69 @@
+# Made-up K5000 data for the tests, with the structure of real files but random parameters
+
+import random
+import struct
+
+import bank
+import multi
+import sysex
+
+def make_single(rng: random.Random, name: str, pcm_count: int, add_count: int) -> bytes:
+    """Make the data of a single patch, like a .KA1 file, with the ADD sources in random places."""
+    source_count = pcm_count + add_count
+    common = bytearray(rng.randrange(128) for _ in range(bank.TONE_COMMON_DATA_SIZE))
+    common[bank.NAME_OFFSET : bank.NAME_OFFSET + bank.NAME_LENGTH] = name.ljust(bank.NAME_LENGTH)[:bank.NAME_LENGTH].encode('ascii')
+    common[bank.SOURCE_COUNT_OFFSET] = source_count
+    kinds = [True] * add_count + [False] * pcm_count
+    rng.shuffle(kinds)
+    sources = []
+    for is_add in kinds:
+        source = bytearray(rng.randrange(128) for _ in range(bank.SOURCE_DATA_SIZE))
+        wave = bank.ADD_WAVE_NUMBER if is_add else rng.randrange(bank.ADD_WAVE_NUMBER)
+        source[bank.WAVE_KIT_OFFSET : bank.WAVE_KIT_OFFSET + 2] = bytes([wave >> 7, wave & 0x7F])
+        sources.append(bytes(source))
+    kits = [bytes(rng.randrange(128) for _ in range(bank.ADD_KIT_SIZE)) for _ in range(add_count)]
+    return bytes(common) + b''.join(sources) + b''.join(kits)
+
+def make_random_single(rng: random.Random, name: str) -> bytes:
+    pcm_count, add_count = rng.choice(list(bank.SINGLE_INFO.values()))
+    return make_single(rng, name, pcm_count, add_count)
+
+def make_single_dump(data: bytes, number: int, location: int = 0) -> bytes:
+    """Wrap the data of a single patch into a one single dump for tone number (0...127)."""
+    return sysex.get_header(1, sysex.ONE, sysex.SINGLE, location) + bytes([number]) + data + b'\xf7'
+
+def make_bank(rng: random.Random, count: int, base: int = 0x12340, max_padding: int = 16) -> bytes:
+    """Make a .KAA bank with count singles in random slots. The singles are stored in
+    another order than their slots, with some padding between them."""
+    slots = rng.sample(range(bank.MAX_PATCH_COUNT), count)
+    rows = [[0] * 7 for _ in range(bank.MAX_PATCH_COUNT)]
+    pool = bytearray(bank.POOL_SIZE)
+    tone_ptr = 0
+    for slot in slots:
+        data = make_random_single(rng, f'S{slot:03}')
+        add_sources = bank.get_add_sources(data)
+        rows[slot][0] = base + tone_ptr
+        kit_ptr = bank.TONE_COMMON_DATA_SIZE + bank.SOURCE_DATA_SIZE * len(add_sources)
+        for i, is_add in enumerate(add_sources):
+            if is_add:
+                rows[slot][i + 1] = base + tone_ptr + kit_ptr
+                kit_ptr += bank.ADD_KIT_SIZE
+        pool[tone_ptr : tone_ptr + len(data)] = data
+        tone_ptr += len(data) + rng.randrange(max_padding + 1)
+    table = b''.join(struct.pack('>7I', *row) for row in rows)
+    return table + struct.pack('>I', base + tone_ptr) + bytes(pool)
+
+def make_multi(rng: random.Random, name: str) -> bytes:
+    """Make the data of a multi, with the checksum set. Like in some real banks, the mute
+    byte can have junk in the bits above the four mute bits."""
+    data = bytearray(rng.randrange(128) for _ in range(multi.MULTI_DATA_SIZE))
+    data[multi.NAME_OFFSET : multi.NAME_OFFSET + multi.NAME_LENGTH] = multi.get_name_data(name)
+    for i in range(multi.SECTION_COUNT):
+        instrument = rng.randrange(768)
+        offset = multi.SECTION_OFFSET + i * multi.SECTION_DATA_SIZE
+        data[offset : offset + 2] = bytes([instrument >> 7, instrument & 0x7F])
+    data[0] = multi.get_checksum(data[1:])
+    return bytes(data)
+
+def make_kca(rng: random.Random) -> bytes:
+    return b''.join(make_multi(rng, f'MULTI{number:03}') for number in range(1, multi.MULTI_COUNT + 1))
@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+
+import bank
+import makebank
+from tests import samples
+
+def get_patch_fields(patch: bank.SinglePatch) -> tuple:
+    # The pointers are compared relative to the start of the patch, since the patch may move
+    sources = tuple(ptr - patch.tone if ptr != 0 else 0 for ptr in patch.sources)
+    return (patch.index, patch.name, sources, patch.source_count, patch.size, bytes(patch.data))
+
+class WriteBankTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(7)
+        for count in [0, 1, 2, 10, 40]:
+            data = samples.make_bank(rng, count)
+            original = bank.get_bank(data, verbose=False)
+            written = bank.write_bank(original.patches, original.base)
+            self.assertEqual(len(written), bank.BANK_SIZE)
+            result = bank.get_bank(written, verbose=False)
+            self.assertEqual(result.base, original.base)
+            self.assertEqual([get_patch_fields(p) for p in result.patches],
+                [get_patch_fields(p) for p in original.patches])
+            self.assertTrue(all(p.padding == 0 for p in result.patches))
+            # Writing the compacted bank again changes nothing
+            self.assertEqual(bank.write_bank(result.patches, result.base), written)
+
+    def test_empty_bank(self):
+        data = bank.write_bank([])
+        result = bank.get_bank(data, verbose=False)
+        self.assertEqual((result.patches, result.base, result.high), ([], bank.DEFAULT_BASE_ADDRESS, 0))
+        self.assertEqual(bank.write_bank(result.patches, result.base), data)
+        # Without even the high pointer set
+        result = bank.get_bank(bytes(bank.BANK_SIZE), verbose=False)
+        self.assertEqual((result.patches, result.base, result.high), ([], bank.DEFAULT_BASE_ADDRESS, 0))
+
+    def test_round_trip_without_numpy(self):
+        np = bank.np
+        bank.np = None
+        try:
+            self.test_round_trip()
+            self.test_empty_bank()
+        finally:
+            bank.np = np
+
+    def test_single_patches(self):
+        rng = random.Random(8)
+        singles = [samples.make_single(rng, f'K{i}', pcm_count, add_count)
+            for i, (pcm_count, add_count) in enumerate(bank.SINGLE_INFO.values())]
+        patches = [bank.make_single_patch(index, data) for index, data in enumerate(singles)]
+        result = bank.get_bank(bank.write_bank(patches), verbose=False)
+        self.assertEqual([p.index for p in result.patches], list(range(len(singles))))
+        self.assertEqual([bytes(p.data) for p in result.patches], singles)
+        for patch, data in zip(result.patches, singles):
+            self.assertEqual([ptr != 0 for ptr in patch.sources[:patch.source_count]], bank.get_add_sources(data))
+
+    def test_invalid_patches(self):
+        rng = random.Random(9)
+        patch = bank.make_single_patch(0, samples.make_single(rng, 'A', 2, 0))
+        with self.assertRaises(ValueError):
+            bank.write_bank([patch, patch])
+        big = samples.make_single(rng, 'B', 0, 6)
+        with self.assertRaises(ValueError):
+            bank.write_bank([bank.make_single_patch(i, big) for i in range(bank.MAX_PATCH_COUNT)])
+        with self.assertRaises(ValueError):
+            bank.write_bank([patch], base=0)
+
+class CompactBankTest(unittest.TestCase):
+    def test_compact_in_place(self):
+        data = samples.make_bank(random.Random(10), 20, max_padding=100)
+        original = bank.get_bank(data, verbose=False)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'BANK.KAA')
+            with open(filename, 'wb') as f:
+                f.write(data)
+            reclaimed = makebank.compact_bank(filename, filename)
+            self.assertEqual(reclaimed, sum(p.padding for p in original.patches))
+            self.assertEqual(os.listdir(directory), ['BANK.KAA'])
+            with open(filename, 'rb') as f:
+                result = bank.get_bank(f.read(), verbose=False)
+        self.assertEqual([get_patch_fields(p) for p in result.patches], [get_patch_fields(p) for p in original.patches])
+
+if __name__ == '__main__':
+    unittest.main()
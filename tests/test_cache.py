@@ -0,0 +1,86 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import bank
+import cache
+from tests import samples
+
+def get_patch_fields(bank_data: bank.Bank) -> list[tuple]:
+    return [(p.index, p.tone, tuple(p.sources), p.source_count, p.size, p.next_tone, p.name) for p in bank_data.patches]
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.filename = os.path.join(self.directory.name, 'BANK.KAA')
+        data = samples.make_bank(random.Random(11), 12)
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        self.expected = cache.parse_bank(data)
+        self.parse_cache = cache.ParseCache(os.path.join(self.directory.name, 'cache', 'parse.sqlite'))
+        self.addCleanup(self.parse_cache.close)
+
+    def get_total(self) -> int:
+        self.parse_cache.flush()
+        return self.parse_cache.db.execute('SELECT SUM(LENGTH(structure)) FROM entries').fetchone()[0]
+
+    def test_hit(self):
+        self.assertEqual(self.parse_cache.get(self.filename, 'kaa'), self.expected)
+        self.assertEqual(self.parse_cache.get(self.filename, 'kaa'), self.expected)
+        self.parse_cache.flush()
+        self.assertEqual(self.parse_cache.get(self.filename, 'kaa'), self.expected)
+        self.assertEqual((self.parse_cache.hits, self.parse_cache.misses), (2, 1))
+
+    def test_touched_file(self):
+        self.parse_cache.get(self.filename, 'kaa')
+        self.parse_cache.flush()
+        st = os.stat(self.filename)
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        # Found by the content hash, and the entry of the path is replaced
+        self.assertEqual(self.parse_cache.get(self.filename, 'kaa'), self.expected)
+        self.assertEqual((self.parse_cache.hits, self.parse_cache.misses), (1, 1))
+        self.assertEqual(self.parse_cache.total, self.get_total())
+        # Touched again before the change was written
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+        self.assertEqual(self.parse_cache.get(self.filename, 'kaa'), self.expected)
+        self.assertEqual(self.parse_cache.total, self.get_total())
+
+    def test_copied_file(self):
+        self.parse_cache.get(self.filename, 'kaa')
+        self.parse_cache.flush()
+        copy = os.path.join(self.directory.name, 'COPY.KAA')
+        shutil.copy(self.filename, copy)
+        self.assertEqual(self.parse_cache.get(copy, 'kaa'), self.expected)
+        self.assertEqual((self.parse_cache.hits, self.parse_cache.misses), (1, 1))
+        self.assertEqual(self.parse_cache.total, self.get_total())
+
+class OpenBankTest(unittest.TestCase):
+    def test_with_and_without_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'BANK.KAA')
+            data = samples.make_bank(random.Random(12), 20)
+            with open(filename, 'wb') as f:
+                f.write(data)
+            expected = get_patch_fields(bank.get_bank(data, verbose=False))
+            environment = os.environ.get('K5KTOOLS_CACHE')
+            try:
+                os.environ['K5KTOOLS_CACHE'] = 'off'
+                with cache.open_bank(filename) as bank_data:
+                    self.assertEqual(get_patch_fields(bank_data), expected)
+                    self.assertEqual(bytes(bank_data.patches[0].data), bytes(bank.get_bank(data, verbose=False).patches[0].data))
+                os.environ['K5KTOOLS_CACHE'] = os.path.join(directory, 'parse.sqlite')
+                with cache.open_bank(filename) as bank_data:
+                    self.assertEqual(get_patch_fields(bank_data), expected)
+                cache.get_default_cache().close()
+            finally:
+                cache._default_cache = None
+                if environment is None:
+                    del os.environ['K5KTOOLS_CACHE']
+                else:
+                    os.environ['K5KTOOLS_CACHE'] = environment
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import checksum
+import sysex
+from tests import samples
+
+def set_checksums(data: bytes) -> bytes:
+    """Set the checksums of a single patch, and of its ADD kits."""
+    data = bytearray(data)
+    for label, start, end in checksum.get_single_data_segments(data, 0, 'Single'):
+        data[start - 1] = checksum.get_segment_checksums(data, [(start, end)])[0]
+    return bytes(data)
+
+def make_one_dump(rng: random.Random, number: int, pcm_count: int, add_count: int) -> bytes:
+    return samples.make_single_dump(set_checksums(samples.make_single(rng, f'ONE{number}', pcm_count, add_count)), number)
+
+class CheckSysexTest(unittest.TestCase):
+    def test_several_messages(self):
+        rng = random.Random(13)
+        messages = [make_one_dump(rng, 0, 2, 0), make_one_dump(rng, 1, 1, 2), make_one_dump(rng, 2, 0, 1)]
+        data = b''.join(messages)
+        results = checksum.check_data(data, 'syx')
+        self.assertEqual([label for label, *_ in results],
+            ['A001', 'A002', 'A002 ADD kit 1', 'A002 ADD kit 2', 'A003', 'A003 ADD kit 1'])
+        self.assertEqual(checksum.get_mismatches(results), [])
+
+        # Break the checksum of the second message only
+        offset = len(messages[0]) + sysex.HEADER_SIZE + 1
+        broken = bytearray(data)
+        broken[offset] ^= 0x01
+        mismatches = checksum.get_mismatches(checksum.check_data(bytes(broken), 'syx'))
+        self.assertEqual([(label, at) for label, at, *_ in mismatches], [('A002', offset)])
+        self.assertEqual(checksum.repair(bytes(broken), mismatches), data)
+
+    def test_repair_mirrors_tree(self):
+        rng = random.Random(14)
+        with tempfile.TemporaryDirectory() as directory:
+            data = bytearray(make_one_dump(rng, 0, 3, 0))
+            data[sysex.HEADER_SIZE + 1] ^= 0x01
+            for subdirectory in ['one', 'two']:
+                os.makedirs(os.path.join(directory, 'in', subdirectory))
+                with open(os.path.join(directory, 'in', subdirectory, 'PATCH.syx'), 'wb') as f:
+                    f.write(data)
+            out_dir = os.path.join(directory, 'out')
+            script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'checksum.py')
+            subprocess.run([sys.executable, script, os.path.join(directory, 'in'), os.path.join(directory, 'missing.syx'),
+                '-q', '-r', out_dir], check=True, capture_output=True)
+            for subdirectory in ['one', 'two']:
+                with open(os.path.join(out_dir, subdirectory, 'PATCH.syx'), 'rb') as f:
+                    self.assertEqual(checksum.get_mismatches(checksum.check_data(f.read(), 'syx')), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import os
+import random
+import tempfile
+import unittest
+
+import dedup
+from tests import samples
+
+class FilePatchesTest(unittest.TestCase):
+    def test_sysex_messages(self):
+        rng = random.Random(15)
+        singles = [samples.make_single(rng, f'SYX{i}', pcm_count, add_count)
+            for i, (pcm_count, add_count) in enumerate([(2, 0), (1, 2), (0, 1)])]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'PATCHES.syx')
+            with open(filename, 'wb') as f:
+                f.write(b''.join(samples.make_single_dump(data, number) for number, data in enumerate(singles)))
+            patches = dedup.get_file_patches(filename)
+        self.assertEqual(patches, [(f'A{number + 1:03}', dedup.fingerprint(data), f'SYX{number}'.ljust(8))
+            for number, data in enumerate(singles)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import stat
+import tempfile
+import unittest
+
+import helpers
+
+class WriteFileTest(unittest.TestCase):
+    def test_write_parts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.bin')
+            parts = [b'\xf0', b'', bytearray(b'abc'), memoryview(b'0123456789')[2:5], b'\xf7']
+            helpers.write_file_parts(filename, parts)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), b''.join(parts))
+
+    @unittest.skipIf(os.name != 'posix', 'needs POSIX permissions')
+    def test_atomic_write_permissions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'new.syx')
+            umask = os.umask(0o027)
+            try:
+                helpers.write_file_atomic(filename, [b'new'])
+            finally:
+                os.umask(umask)
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o640)
+            # A file that is replaced keeps its permissions
+            os.chmod(filename, 0o604)
+            helpers.write_file_atomic(filename, [b'replaced'])
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o604)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), b'replaced')
+            self.assertEqual(os.listdir(directory), ['new.syx'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import random
+import unittest
+
+import multi
+from tests import samples
+
+class MultiPatchTest(unittest.TestCase):
+    def setUp(self):
+        self.data = samples.make_kca(random.Random(11))
+
+    def test_round_trip(self):
+        multis = multi.MultiBank(self.data)
+        for index, m in enumerate(multis.get_multis()):
+            chunk = self.data[index * multi.MULTI_DATA_SIZE : (index + 1) * multi.MULTI_DATA_SIZE]
+            self.assertEqual(m, multi.MultiPatch.from_data(chunk))
+            self.assertEqual(m.as_data(), chunk)
+
+    def test_fields(self):
+        multis = multi.MultiBank(self.data)
+        fields = multis.get_fields()
+        self.assertEqual(len(fields), multi.MULTI_COUNT)
+        self.assertEqual([multi.MultiPatch.from_fields(f) for f in fields], multis.get_multis())
+
+    def test_decoded_round_trip(self):
+        # Decode all the parts, so that the data is made out of them
+        for index, m in enumerate(multi.MultiBank(self.data).get_multis()):
+            m.effect, m.common, m.sections
+            self.assertEqual(m.as_data(), self.data[index * multi.MULTI_DATA_SIZE : (index + 1) * multi.MULTI_DATA_SIZE])
+
+    def test_mute_byte_junk(self):
+        # The top bits of the mute byte are kept, even when the mutes change
+        self.assertTrue(any(self.data[i + multi.MUTE_OFFSET] & 0xF0 for i in range(0, len(self.data), multi.MULTI_DATA_SIZE)))
+        data = bytearray(self.data[: multi.MULTI_DATA_SIZE])
+        data[multi.MUTE_OFFSET] = 0x55
+        m = multi.MultiPatch.from_data(data)
+        self.assertEqual(m.common.mutes, [False, True, False, True])
+        m.common.mutes = [True, True, True, False]
+        self.assertEqual(m.as_data()[multi.MUTE_OFFSET], 0x58)
+
+    def test_checksum(self):
+        # A wrong checksum is kept as long as nothing changes
+        data = bytearray(self.data[: multi.MULTI_DATA_SIZE])
+        data[0] = (data[0] + 1) & 0x7F
+        m = multi.MultiPatch.from_data(data)
+        self.assertEqual(m.as_data(), data)
+        m.common.volume = (m.common.volume + 1) & 0x7F
+        changed = m.as_data()
+        self.assertEqual(changed[0], multi.get_checksum(changed[1:]))
+
+    def check_columns(self):
+        multis = multi.MultiBank(self.data)
+        objects = multis.get_multis()
+        self.assertEqual(multis.names, [m.common.name for m in objects])
+        self.assertEqual(multis.get_section_refs(),
+            [[(mute, s.instrument) for mute, s in zip(m.common.mutes, m.sections)] for m in objects])
+        self.assertEqual([list(types) for types in multis.effect_type.tolist()] if multi.np is not None
+            else [list(types) for types in multis.effect_type],
+            [[m.effect.reverb.reverb_type] + [e.effect_type for e in [m.effect.effect1, m.effect.effect2,
+                m.effect.effect3, m.effect.effect4]] for m in objects])
+
+    def test_columns(self):
+        self.check_columns()
+
+    def test_columns_without_numpy(self):
+        np = multi.np
+        multi.np = None
+        try:
+            self.check_columns()
+        finally:
+            multi.np = np
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import random
+import tempfile
+import unittest
+
+import nameindex
+from tests import samples
+
+class NameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.index = nameindex.NameIndex(os.path.join(self.directory.name, 'names.sqlite'))
+        self.addCleanup(self.index.close)
+        self.rng = random.Random(16)
+
+    def write_dump(self, filename: str, names: list[str]) -> str:
+        path = os.path.join(self.directory.name, filename)
+        with open(path, 'wb') as f:
+            f.write(b''.join(samples.make_single_dump(samples.make_single(self.rng, name, 2, 0), number)
+                for number, name in enumerate(names)))
+        return path
+
+    def test_sysex_messages(self):
+        path = self.write_dump('PATCHES.syx', ['Strings', 'Brass'])
+        self.assertEqual(self.index.update([path]), (1, 0))
+        self.assertEqual(nameindex.get_file_names(path), [('A001', 'Strings '), ('A002', 'Brass   ')])
+        self.assertEqual(self.index.find_substring('brass'), [(path, 'A002', 'Brass   ')])
+
+    def test_padded_query(self):
+        path = self.write_dump('PAD.syx', ['Pad'])
+        self.index.update([path])
+        self.assertEqual(self.index.find_prefix('Pad     '), [(path, 'A001', 'Pad     ')])
+        self.assertEqual(self.index.find_substring('Pad\x7f'), [(path, 'A001', 'Pad     ')])
+
+    def test_stale_names(self):
+        path = self.write_dump('OLD.syx', ['Organ', 'Choir'])
+        other = self.write_dump('OTHER.syx', ['Choir'])
+        self.index.update([path, other])
+        # The file changes, and the name that only it had must not match any more
+        self.write_dump('OLD.syx', ['Guitar'])
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        self.index.update([path, other])
+        keys = [key for (key,) in self.index.db.execute('SELECT key FROM keys ORDER BY key')]
+        self.assertEqual(keys, ['choir', 'guitar'])
+        self.assertEqual(self.index.find_similar('organ'), [])
+        self.assertEqual([name for score, path, slot, name in self.index.find_similar('choir')], ['Choir   '])
+        trigram_keys = {key_id for (key_id,) in self.index.db.execute('SELECT DISTINCT key_id FROM trigrams')}
+        self.assertEqual(len(trigram_keys), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import bank
+import packing
+from tests import samples
+
+class WriteBanksTest(unittest.TestCase):
+    def test_bad_bank_is_skipped(self):
+        rng = random.Random(20)
+        with tempfile.TemporaryDirectory() as directory:
+            candidates = []
+            for number in range(30):
+                filename = os.path.join(directory, f'P{number:02}.KA1')
+                with open(filename, 'wb') as f:
+                    f.write(samples.make_single(rng, f'P{number:02}', 0, 6))
+                candidates.append(packing.Candidate(filename, os.path.getsize(filename), 1.0))
+            # The first bank is too big for the pool, the second one is fine
+            out_dir = os.path.join(directory, 'out')
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as errors:
+                failed_count = packing.write_banks([candidates, candidates[:3]], out_dir)
+            self.assertEqual(failed_count, 1)
+            self.assertIn('BANK001.KAA', errors.getvalue())
+            self.assertEqual(os.listdir(out_dir), ['BANK002.KAA'])
+            with open(os.path.join(out_dir, 'BANK002.KAA'), 'rb') as f:
+                self.assertEqual(len(bank.get_bank(f.read(), verbose=False).patches), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import bank
+import similar
+from tests import samples
+
+@unittest.skipIf(similar.np is None, 'NumPy is not installed')
+class SimilarityIndexTest(unittest.TestCase):
+    def test_distances_are_exact(self):
+        np = similar.np
+        rng = np.random.default_rng(1)
+        size = similar.get_vector_size()
+        # Vectors near the largest values, where the sums of squares go over 2**24
+        vectors = [np.full(size, 127, dtype=np.uint8)] + [rng.integers(120, 128, size, dtype=np.uint8) for _ in range(20)]
+        index = similar.SimilarityIndex()
+        index.locations = [('', '', '')] * len(vectors)
+        index._rows = list(vectors)
+        index.build()
+        self.assertEqual(index.vectors.dtype, np.uint8)
+        expected = sorted((int(np.sum((v.astype(np.int64) - vectors[0]) ** 2)), i) for i, v in enumerate(vectors))
+        self.assertEqual(index.find_nearest(vectors[0], len(vectors)), expected)
+
+        # The same over several blocks
+        block_size = similar.BLOCK_SIZE
+        similar.BLOCK_SIZE = 4
+        try:
+            index._rows = list(vectors)
+            index.build()
+            self.assertEqual(index.find_nearest(vectors[0], len(vectors)), expected)
+            pairs = sorted((d, r, o) for d, r, o in index.find_near_duplicates(size * 64))
+        finally:
+            similar.BLOCK_SIZE = block_size
+        expected_pairs = sorted((int(np.sum((v.astype(np.int64) - w) ** 2)), i, j)
+            for i, v in enumerate(vectors) for j, w in enumerate(vectors) if i < j)
+        self.assertEqual(pairs, [p for p in expected_pairs if p[0] <= size * 64])
+
+    def test_add_kits_by_pointer(self):
+        rng = random.Random(2)
+        data = samples.make_single(rng, 'KITS', 1, 2)
+        offsets = similar.get_kit_offsets(bank.get_add_sources(data))
+        first, second = [offset for offset in offsets if offset is not None]
+        # Store the kits the other way around in a bank, with the pointers telling where they are
+        swapped = (data[:first] + data[second : second + bank.ADD_KIT_SIZE] + data[first : first + bank.ADD_KIT_SIZE]
+            + data[second + bank.ADD_KIT_SIZE :])
+        base = bank.DEFAULT_BASE_ADDRESS
+        pointers = [0] * bank.MAX_SOURCE_COUNT
+        for i, offset in enumerate(offsets):
+            if offset is not None:
+                pointers[i] = base + (second if offset == first else first)
+        bank_data = bytearray(bank.BANK_SIZE)
+        struct.pack_into('>7I', bank_data, 0, base, *pointers)
+        struct.pack_into('>I', bank_data, bank.POINTER_TABLE_SIZE, base + len(swapped))
+        pool_offset = bank.POINTER_TABLE_SIZE + 4
+        bank_data[pool_offset : pool_offset + len(swapped)] = swapped
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'KITS.KAA')
+            with open(filename, 'wb') as f:
+                f.write(bank_data)
+            (slot, patch_data, kit_offsets), = similar.get_file_singles(filename)
+        self.assertEqual(patch_data, swapped)
+        self.assertTrue((similar.get_vector(patch_data, kit_offsets, True) == similar.get_vector(data, offsets, True)).all())
+
+    def test_sysex_messages(self):
+        rng = random.Random(3)
+        singles = [samples.make_single(rng, f'SYX{i}', 2 - i, i) for i in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'PATCHES.syx')
+            with open(filename, 'wb') as f:
+                f.write(b''.join(samples.make_single_dump(data, number) for number, data in enumerate(singles)))
+            result = similar.get_file_singles(filename)
+        self.assertEqual([(slot, data) for slot, data, kit_offsets in result], [('A001', singles[0]), ('A002', singles[1]), ('A003', singles[2])])
+
+if __name__ == '__main__':
+    unittest.main()
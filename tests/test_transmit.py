@@ -0,0 +1,79 @@
+import random
+import unittest
+
+import multi
+import sysex
+import tonemap
+import transmit
+from tests import samples
+
+class SplitBlockTest(unittest.TestCase):
+    def test_other_messages(self):
+        one = samples.make_single_dump(samples.make_single(random.Random(17), 'ONE', 2, 0), 5)
+        for message in [b'\xf0\xf7', b'\xf0\x40\x00\x21\xf7', b'\xf0\x43\x00\x21\x00\x0a\x00\x00\x01\xf7', one]:
+            self.assertEqual(transmit.split_block(message), [message])
+            self.assertEqual(transmit.split_block(memoryview(message)), [message])
+
+    def test_block_singles(self):
+        rng = random.Random(18)
+        singles = {number: samples.make_random_single(rng, f'T{number}') for number in [0, 9, 127]}
+        message = (sysex.get_header(3, sysex.BLOCK, sysex.SINGLE, 1) + tonemap.encode(singles.keys())
+            + b''.join(singles.values()) + b'\xf7')
+        self.assertEqual(transmit.split_block(message),
+            [sysex.get_header(3, sysex.ONE, sysex.SINGLE, 1) + bytes([number]) + data + b'\xf7' for number, data in singles.items()])
+        # A truncated block loses the patches that are not all there
+        parts = transmit.split_block(message[: sysex.HEADER_SIZE + sysex.TONE_MAP_SIZE + len(singles[0]) + 10])
+        self.assertEqual(len(parts), 1)
+
+    def test_block_multis(self):
+        data = samples.make_kca(random.Random(19))
+        message = sysex.get_header(1, sysex.BLOCK, sysex.MULTI) + data + b'\xf7'
+        parts = transmit.split_block(message)
+        self.assertEqual(len(parts), multi.MULTI_COUNT)
+        self.assertEqual(parts[1], sysex.get_header(1, sysex.ONE, sysex.MULTI, 1)
+            + data[multi.MULTI_DATA_SIZE : 2 * multi.MULTI_DATA_SIZE] + b'\xf7')
+
+class TransmitterTest(unittest.TestCase):
+    def test_pacing(self):
+        clock = transmit.VirtualClock()
+        port = transmit.LoopbackPort(clock)
+        transmitter = transmit.Transmitter(port, 0.1, clock, clock.sleep)
+        messages = [bytes(100), bytes(3125), bytes(10)]
+        statuses = []
+        seconds = transmitter.send(messages, statuses.append)
+
+        wire_times = [transmit.get_wire_time(len(message)) for message in messages]
+        self.assertAlmostEqual(wire_times[1], 1.0)
+        expected_times = [0.0, wire_times[0] + 0.1, wire_times[0] + wire_times[1] + 0.2]
+        self.assertEqual([message for sent_at, message in port.messages], messages)
+        for (sent_at, message), expected in zip(port.messages, expected_times):
+            self.assertAlmostEqual(sent_at, expected)
+        self.assertAlmostEqual(seconds, transmitter.get_duration(messages))
+        self.assertAlmostEqual(seconds, sum(wire_times) + 0.2)
+        self.assertEqual([status['sent'] for status in statuses], [100, 3225, 3235])
+        # The estimate of the time left is right, since the clock only moves when waiting
+        for status in statuses:
+            self.assertAlmostEqual(status['elapsed'] + status['eta'], seconds)
+
+    def test_slow_port(self):
+        # A port that blocks for longer than the wire time delays only the gap after it
+        clock = transmit.VirtualClock()
+
+        class SlowPort(transmit.LoopbackPort):
+            def send(self, message: bytes) -> None:
+                super().send(message)
+                clock.sleep(0.5)
+
+        port = SlowPort(clock)
+        seconds = transmit.Transmitter(port, 0.1, clock, clock.sleep).send([bytes(10), bytes(10)])
+        self.assertAlmostEqual(port.messages[1][0], 0.6)
+        self.assertAlmostEqual(seconds, 1.1)
+
+    def test_nothing_to_send(self):
+        clock = transmit.VirtualClock()
+        port = transmit.LoopbackPort(clock)
+        self.assertEqual(transmit.Transmitter(port, 0.1, clock, clock.sleep).send([]), 0.0)
+        self.assertEqual(port.messages, [])
+
+if __name__ == '__main__':
+    unittest.main()
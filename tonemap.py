@@ -0,0 +1,117 @@
+# Encode and decode the tone map of K5000 block single dumps
+#
+# The tone map tells which of the 128 tones of a bank are included in the dump.
+# It has 19 bytes of seven bits each: bit0 of the first byte is tone 1 (like A001),
+# bit1 is tone 2 and so on. The last byte only has two valid bits.
+
+import sys
+import timeit
+import typing
+import operator
+import functools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TONE_COUNT = 128
+BITS_PER_BYTE = 7
+TONE_MAP_SIZE = (TONE_COUNT + BITS_PER_BYTE - 1) // BITS_PER_BYTE  # 19
+
+# The numbers of the bits set in each 7-bit byte, lowest first
+BYTE_BITS = [tuple(bit for bit in range(BITS_PER_BYTE) if b & (1 << bit)) for b in range(1 << BITS_PER_BYTE)]
+
+# The valid bits of each byte (the last byte only has two)
+BYTE_MASKS = [0x7f] * (TONE_MAP_SIZE - 1) + [(1 << (TONE_COUNT - (TONE_MAP_SIZE - 1) * BITS_PER_BYTE)) - 1]
+BYTE_SHIFTS = range(0, TONE_MAP_SIZE * BITS_PER_BYTE, BITS_PER_BYTE)
+
+def encode(numbers: typing.Iterable[int]) -> bytes:
+    """Make a tone map from zero-based tone numbers (0...127)."""
+    # Set the bits in one integer first, then cut it into 7-bit bytes
+    numbers = list(numbers)
+    if numbers and (min(numbers) < 0 or max(numbers) >= TONE_COUNT):
+        raise ValueError(f'Invalid tone number, must be 0...{TONE_COUNT - 1}')
+    bits = functools.reduce(operator.or_, map((1).__lshift__, numbers), 0)
+    return bytes([(bits >> shift) & 0x7f for shift in BYTE_SHIFTS])
+
+def iter_tones(tone_map: bytes) -> typing.Iterator[int]:
+    """Iterate over the zero-based numbers of the tones set in a tone map, in order."""
+    for i, (b, mask) in enumerate(zip(tone_map, BYTE_MASKS)):
+        for bit in BYTE_BITS[b & mask]:
+            yield i * BITS_PER_BYTE + bit
+
+def get_tone_numbers(tone_map: bytes) -> list[int]:
+    """Get the zero-based numbers of the tones included in a tone map, in order."""
+    return list(iter_tones(tone_map))
+
+def decode(tone_map: bytes) -> list[bool]:
+    """Get a flag for each of the 128 tones."""
+    flags = [False] * TONE_COUNT
+    for number in iter_tones(tone_map):
+        flags[number] = True
+    return flags
+
+def count(tone_map: bytes) -> int:
+    """Count the tones included in a tone map."""
+    return sum(len(BYTE_BITS[b & mask]) for b, mask in zip(tone_map, BYTE_MASKS))
+
+def encode_many(banks: typing.Iterable[typing.Iterable[int]]) -> list[bytes]:
+    """Make the tone maps of many banks at once, from the tone numbers of each bank."""
+    return [encode(numbers) for numbers in banks]
+
+def decode_many(tone_maps: list[bytes]) -> typing.Any:
+    """Decode many tone maps at once.
+
+    Returns a (count, 128) array of booleans if NumPy is installed, otherwise a list of lists.
+    """
+    if np is None:
+        return [decode(tone_map) for tone_map in tone_maps]
+    data = np.frombuffer(b''.join(bytes(tone_map[:TONE_MAP_SIZE]) for tone_map in tone_maps), dtype=np.uint8)
+    bits = (data.reshape(len(tone_maps), TONE_MAP_SIZE, 1) >> np.arange(BITS_PER_BYTE, dtype=np.uint8)) & 1
+    return bits.reshape(len(tone_maps), TONE_MAP_SIZE * BITS_PER_BYTE)[:, :TONE_COUNT].astype(bool)
+
+def encode_flags_many(flags: typing.Any) -> list[bytes]:
+    """Make tone maps from rows of 128 flags, like the ones decode_many returns."""
+    if np is None:
+        return [encode(number for number, flag in enumerate(row) if flag) for row in flags]
+    rows = np.zeros((len(flags), TONE_MAP_SIZE * BITS_PER_BYTE), dtype=np.uint8)
+    rows[:, :TONE_COUNT] = np.asarray(flags, dtype=bool)
+    weights = (1 << np.arange(BITS_PER_BYTE)).astype(np.uint8)
+    tone_maps = (rows.reshape(len(flags), TONE_MAP_SIZE, BITS_PER_BYTE) * weights).sum(axis=2, dtype=np.uint8)
+    return [row.tobytes() for row in tone_maps]
+
+def _encode_strings(numbers: list[int]) -> bytes:
+    # The way kaatosyx used to do it, for comparison
+    tone_bits = ['0'] * TONE_COUNT
+    for number in numbers:
+        tone_bits[number] = '1'
+    groups = [tone_bits[i : i + BITS_PER_BYTE] for i in range(0, len(tone_bits), BITS_PER_BYTE)]
+    return bytes(int(''.join(reversed(group)), 2) for group in groups)
+
+def _decode_strings(tone_map: bytes) -> list[bool]:
+    # The way identify used to do it, for comparison
+    bit_str = ''.join('{0:07b}'.format(b)[::-1] for b in tone_map)
+    return [bit == '1' for bit in bit_str[:TONE_COUNT]]
+
+if __name__ == '__main__':
+    # Compare with the string-based versions, on a bank with every other tone
+    numbers = list(range(0, TONE_COUNT, 2))
+    tone_map = encode(numbers)
+    if _encode_strings(numbers) != tone_map or _decode_strings(tone_map) != decode(tone_map):
+        print('The results differ from the string-based versions')
+        sys.exit(-1)
+
+    count_per_run = 10000
+    benchmarks = [
+        ('encode', lambda: encode(numbers)),
+        ('encode (strings)', lambda: _encode_strings(numbers)),
+        ('decode', lambda: decode(tone_map)),
+        ('decode (strings)', lambda: _decode_strings(tone_map)),
+        ('get_tone_numbers', lambda: get_tone_numbers(tone_map)),
+        (f'decode_many (1000 maps{", NumPy" if np is not None else ""})', lambda: decode_many([tone_map] * 1000)),
+    ]
+    for name, function in benchmarks:
+        seconds = min(timeit.repeat(function, number=count_per_run if 'many' not in name else 10, repeat=3))
+        per_call = seconds / (count_per_run if 'many' not in name else 10)
+        print(f'{name:36} {per_call * 1e6:10.2f} us')
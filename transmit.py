@@ -0,0 +1,219 @@
+# Send Kawai K5000 System Exclusive files to a MIDI port, paced for the MIDI wire
+#
+# MIDI runs at 31250 bits per second, and each byte takes ten bits on the wire (a start bit,
+# eight data bits and a stop bit), so a full block single dump takes tens of seconds to send.
+# The messages are sent no faster than the wire can carry them, with a gap after each one
+# to give the K5000 time to store it. A block dump can also be sent as one dump per patch,
+# for receivers that can't keep up with a big message.
+
+import sys
+import time
+import argparse
+import typing
+
+import helpers
+import ka1tosyx
+import kc1tosyx
+import sysex
+
+try:
+    import mido
+except ImportError:
+    mido = None
+
+BAUD_RATE = 31250
+BITS_PER_BYTE = 10  # start bit, eight data bits, stop bit
+DEFAULT_GAP = 0.1  # seconds after each message
+
+def get_wire_time(size: int) -> float:
+    """Get the time in seconds that sending size bytes takes on the MIDI wire."""
+    return size * BITS_PER_BYTE / BAUD_RATE
+
+def split_block(message: bytes) -> list[bytes]:
+    """Split a block single or combi/multi dump into one dump for each patch in it.
+    Other messages, also short or truncated ones, are returned as they are."""
+    if len(message) <= sysex.HEADER_SIZE or not sysex.is_kawai(message) or message[3] != sysex.BLOCK:
+        return [bytes(message)]
+    channel = message[2] + 1
+    entries = sysex.get_single_entries(message)
+    if entries and all(location in sysex.BANK_IDS for location, number, offset, size in entries):
+        return [ka1tosyx.make_message(message[offset : offset + size], channel, location, number + 1)
+            for location, number, offset, size in entries]
+    multis = sysex.get_multis(message)
+    if multis:
+        return [kc1tosyx.make_message(data, channel, int(name[1:])) for name, data in multis]
+    return [bytes(message)]
+
+class LoopbackPort:
+    """A stand-in for a MIDI port that keeps the messages sent and the times they were
+    sent at, for checking the timing and the order without hardware."""
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.messages = []
+
+    def send(self, message: bytes) -> None:
+        self.messages.append((self.clock(), bytes(message)))
+
+    def close(self) -> None:
+        pass
+
+class FilePort:
+    """A stand-in for a MIDI port that writes the messages into a file, one after another."""
+
+    def __init__(self, filename: str):
+        self.f = open(filename, 'wb')
+
+    def send(self, message: bytes) -> None:
+        self.f.write(message)
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+class MidoPort:
+    """A MIDI output port opened with mido (which needs a backend like python-rtmidi)."""
+
+    def __init__(self, name: str = None):
+        if mido is None:
+            raise RuntimeError('Sending to a MIDI port needs the mido package')
+        self.port = mido.open_output(name)
+
+    def send(self, message: bytes) -> None:
+        self.port.send(mido.Message('sysex', data=bytes(message[1:-1])))  # without F0 and F7
+
+    def close(self) -> None:
+        self.port.close()
+
+class VirtualClock:
+    """A clock that only advances when sleeping, for working out the timing without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(0.0, seconds)
+
+class Transmitter:
+    """Sends messages to a port, waiting for each message to be through the MIDI wire
+    and then for the gap before sending the next one.
+
+    The port only needs a send(message) method. The clock and sleep functions can be
+    replaced, like with a VirtualClock.
+    """
+
+    def __init__(self, port: typing.Any, gap: float = DEFAULT_GAP,
+            clock: typing.Callable[[], float] = time.monotonic, sleep: typing.Callable[[float], None] = time.sleep):
+        self.port = port
+        self.gap = gap
+        self.clock = clock
+        self.sleep = sleep
+
+    def get_duration(self, messages: list[bytes]) -> float:
+        """Get the time that sending the messages takes, with the gaps between them."""
+        return sum(get_wire_time(len(message)) for message in messages) + self.gap * max(0, len(messages) - 1)
+
+    def send(self, messages: list[bytes], progress: typing.Callable[[dict], None] = None) -> float:
+        """Send the messages, in order. After each message, progress (if given) gets the number
+        of messages and bytes sent and in total, and the estimated time left in seconds.
+        Returns the time the whole transmission took."""
+        total = sum(len(message) for message in messages)
+        remaining = self.get_duration(messages)
+        start = ready = self.clock()
+        sent = 0
+        for number, message in enumerate(messages, start=1):
+            delay = ready - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            sent_at = self.clock()
+            self.port.send(message)
+            # A port may take the whole message at once or block while it is being sent
+            done = max(sent_at + get_wire_time(len(message)), self.clock())
+            ready = done + self.gap
+            sent += len(message)
+            remaining -= get_wire_time(len(message)) + (self.gap if number < len(messages) else 0)
+            if progress is not None:
+                # The rest starts after the gap, or the transmission ends with this message
+                next_start = ready if number < len(messages) else done
+                eta = max(0.0, next_start - self.clock()) + max(0.0, remaining)
+                progress({'message': number, 'count': len(messages), 'sent': sent, 'total': total,
+                    'elapsed': self.clock() - start, 'eta': eta})
+
+        # Don't return before the last message is through, so the port is not closed too early
+        delay = ready - self.gap - self.clock() if messages else 0
+        if delay > 0:
+            self.sleep(delay)
+        return self.clock() - start
+
+def read_messages(filenames: list[str], split: bool = False) -> list[bytes]:
+    """Read the System Exclusive messages of the files, in order, optionally
+    splitting block dumps into one dump per patch."""
+    messages = []
+    for filename in filenames:
+        for offset, message in sysex.read_messages(filename):
+            messages.extend(split_block(message) if split else [bytes(message)])
+    return messages
+
+def format_progress(status: dict) -> str:
+    percent = 100 * status['sent'] // status['total'] if status['total'] else 100
+    return (f'Message {status["message"]}/{status["count"]}, {status["sent"]} of {status["total"]} bytes ({percent}%), '
+        f'{status["elapsed"]:.1f} s, {status["eta"]:.1f} s left')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send Kawai K5000 System Exclusive files to a MIDI port')
+    parser.add_argument(dest='filenames', metavar='filename', nargs='*', help='.syx files, directories, glob patterns or ZIP/tar archives')
+    parser.add_argument('-p', dest='port', action='store', help='MIDI output port (default is the first one)')
+    parser.add_argument('-o', dest='outfile', action='store', help='Write the messages into a file instead of a MIDI port')
+    parser.add_argument('-g', type=float, dest='gap', action='store', default=DEFAULT_GAP * 1000,
+        help=f'Gap after each message in milliseconds (default {DEFAULT_GAP * 1000:.0f})')
+    parser.add_argument('-s', dest='split', action='store_true', help='Send block dumps as one dump for each patch')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='Only show how long sending would take')
+    parser.add_argument('--list', dest='list_ports', action='store_true', help='List the MIDI output ports')
+    args = parser.parse_args()
+
+    if args.list_ports:
+        if mido is None:
+            print('Listing MIDI ports needs the mido package')
+            sys.exit(-1)
+        for name in mido.get_output_names():
+            print(name)
+        sys.exit(0)
+
+    try:
+        messages = read_messages(helpers.expand_paths(args.filenames, ['syx'], archives=True), args.split)
+    except OSError as e:
+        print(f'Unable to read "{e.filename}": {e.strerror}')
+        sys.exit(-1)
+    if not messages:
+        print('No System Exclusive messages to send')
+        sys.exit(-1)
+
+    gap = args.gap / 1000
+    if args.dry_run:
+        clock = VirtualClock()
+        port = LoopbackPort(clock)
+        transmitter = Transmitter(port, gap, clock, clock.sleep)
+    else:
+        try:
+            port = FilePort(args.outfile) if args.outfile is not None else MidoPort(args.port)
+        except (OSError, RuntimeError) as e:
+            print(e)
+            sys.exit(-1)
+        transmitter = Transmitter(port, gap)
+
+    total = sum(len(message) for message in messages)
+    print(f'Sending {len(messages)} messages, {total} bytes, in about {transmitter.get_duration(messages):.1f} seconds')
+    if args.dry_run:
+        seconds = transmitter.send(messages)
+        for sent_at, message in port.messages:
+            print(f'{sent_at:8.3f} s  {len(message):>6} bytes  {get_wire_time(len(message)):6.3f} s on the wire')
+    else:
+        try:
+            seconds = transmitter.send(messages, lambda status: print(f'\r{format_progress(status)}', end='', file=sys.stderr))
+            print(file=sys.stderr)
+        finally:
+            port.close()
+    print(f'Sent {len(messages)} messages in {seconds:.1f} seconds')